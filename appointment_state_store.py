@@ -0,0 +1,138 @@
+"""
+Change data capture for appointment snapshots.
+
+St. Lukes sends us full snapshots of their appointments every day, and most of
+the rows did not change since the last run. We keep a local SQLite store keyed
+by external appointment id, with a compact digest of what we last posted
+successfully, and use it to drop unchanged appointments before they are
+serialized and posted.
+
+Whether the posts were committed is part of the digest: an appointment that
+was only validated (commit=False) is posted again by the first run that
+commits.
+"""
+import hashlib
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from external_appointment_struct import ExternalAppointmentStruct
+
+
+# SQLite limits the number of variables in a single statement.
+_QUERY_BATCH_SIZE = 500
+
+
+def appointment_digest(appointment: ExternalAppointmentStruct,
+                       commit: bool = False) -> str:
+  """
+  Returns a compact digest of everything that we post for this appointment,
+  and of whether the post is committed. The digest only depends on the struct
+  fields, so it is the same whether it is computed at extraction time or
+  after a successful post.
+  """
+  h = hashlib.blake2b(digest_size=16)
+  h.update(f"commit={bool(commit)}\x1f".encode('utf-8'))
+  for key, value in sorted(appointment.__dict__.items()):
+    h.update(f"{key}={value!r}\x1f".encode('utf-8'))
+  return h.hexdigest()
+
+
+class AppointmentStateStore:
+  """
+  SQLite backed map of external_appointment_id -> (digest, last modified date)
+  for the appointments that were posted successfully.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS appointment_state (
+        external_appointment_id TEXT PRIMARY KEY,
+        digest TEXT NOT NULL,
+        external_last_modified_date TEXT,
+        posted_at REAL NOT NULL
+      )""")
+
+  def close(self):
+    self._conn.close()
+
+  def states(self, external_appointment_ids: Iterable[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+    """
+    Returns the (digest, last modified date) that we have for each of the
+    external appointment ids passed in. Unknown ids are not in the result.
+    """
+    ids = [i for i in set(external_appointment_ids) if i]
+    result = {}
+    for start in range(0, len(ids), _QUERY_BATCH_SIZE):
+      batch = ids[start:start + _QUERY_BATCH_SIZE]
+      placeholders = ",".join("?" * len(batch))
+      for row in self._conn.execute(
+          "SELECT external_appointment_id, digest, external_last_modified_date "
+          f"FROM appointment_state WHERE external_appointment_id IN ({placeholders})",
+          batch):
+        result[row[0]] = (row[1], row[2])
+    return result
+
+  def drop_unchanged(
+      self,
+      appointments: List[ExternalAppointmentStruct],
+      commit: bool = False
+  ) -> Tuple[List[ExternalAppointmentStruct], int]:
+    """
+    Returns the appointments that changed since they were last posted
+    successfully with this commit flag, and the number of unchanged
+    appointments that were dropped. Appointments without an external id are
+    always kept.
+    """
+    states = self.states(a.external_appointment_id for a in appointments)
+    changed = []
+    for appointment in appointments:
+      state = states.get(appointment.external_appointment_id)
+      if state and state[0] == appointment_digest(appointment, commit):
+        continue
+      changed.append(appointment)
+
+    return changed, len(appointments) - len(changed)
+
+  def mark_posted(self, appointments: List[ExternalAppointmentStruct],
+                  commit: bool = False):
+    """
+    Records the appointments as posted. Only call this once the SFE confirmed
+    the post, otherwise a failed appointment would be skipped on the next run.
+    """
+    self.mark_states(state(a, commit) for a in appointments
+                     if a.external_appointment_id)
+
+  def mark_states(self, states: Iterable[Tuple[str, str, Optional[str]]]):
+    """
+    Records the (external id, digest, last modified date) of appointments
+    that were posted, as returned by state() - e.g. the ones that the retry
+    queue kept for its posts.
+    """
+    now = time.time()
+    self._conn.executemany(
+      "INSERT OR REPLACE INTO appointment_state (external_appointment_id, "
+      "digest, external_last_modified_date, posted_at) VALUES (?, ?, ?, ?)",
+      [(external_id, digest, last_modified, now)
+       for external_id, digest, last_modified in states])
+
+
+def state(appointment: ExternalAppointmentStruct,
+          commit: bool = False) -> Tuple[str, str, Optional[str]]:
+  """
+  Returns the row that mark_posted records for the appointment, as
+  (external id, digest, last modified date).
+  """
+  return (appointment.external_appointment_id,
+          appointment_digest(appointment, commit),
+          _format_last_modified(appointment.external_last_modified_date))
+
+
+def _format_last_modified(value) -> Optional[str]:
+  if value is None:
+    return None
+  return value.isoformat() if hasattr(value, 'isoformat') else str(value)
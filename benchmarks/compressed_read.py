@@ -0,0 +1,104 @@
+"""
+Benchmarks reading compressed appointment files in chunks as they are
+decompressed (common_io.iter_members), against extracting them to disk first
+and reading the extracted files.
+
+    python -m benchmarks.compressed_read [--rows 200000] [--members 2]
+
+The zip archive has the given number of members, each with all the rows.
+"""
+import argparse
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Callable, Iterator, List
+
+import common_io
+from benchmarks.synthetic import SEP, write_synthetic_appointments
+from stlukes_mappings import StLukesEtlAppointmentMapping
+
+
+def count_rows(files: Iterator) -> int:
+  columns = StLukesEtlAppointmentMapping().columns()
+  return sum(len(chunk)
+             for f in files
+             for chunk in common_io.iter_csv_chunks(f, columns=columns,
+                                                    chunksize=10000, sep=SEP))
+
+
+def streamed(path: str) -> Iterator:
+  for _, member in common_io.iter_members(path):
+    yield member
+
+
+def extract(path: str, extract_dir: str) -> List[str]:
+  """
+  Extracts the archive or decompresses the file into extract_dir, and
+  returns the paths of the files.
+  """
+  if zipfile.is_zipfile(path):
+    with zipfile.ZipFile(path) as archive:
+      archive.extractall(extract_dir)
+      return [os.path.join(extract_dir, name) for name in archive.namelist()]
+
+  opener = gzip.open if path.endswith('.gz') else bz2.open
+  out_path = os.path.join(extract_dir, "extracted.csv")
+  with opener(path, 'rb') as f, open(out_path, 'wb') as out:
+    shutil.copyfileobj(f, out, 1024 * 1024)
+  return [out_path]
+
+
+def timed(fn: Callable[[], int]):
+  start = time.perf_counter()
+  rows = fn()
+  return rows, time.perf_counter() - start
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, default=200000)
+  parser.add_argument("--members", type=int, default=2)
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = write_synthetic_appointments(
+      os.path.join(tmp_dir, "appointments.csv"), args.rows, args.template_path)
+
+    zip_path = os.path.join(tmp_dir, "appointments.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+      for i in range(args.members):
+        archive.write(csv_path, f"appointments_{i}.csv")
+    gzip_path = csv_path + ".gz"
+    bz2_path = csv_path + ".bz2"
+    for path, opener in [(gzip_path, gzip.open), (bz2_path, bz2.open)]:
+      with open(csv_path, 'rb') as f, opener(path, 'wb') as out:
+        shutil.copyfileobj(f, out, 1024 * 1024)
+
+    rows, elapsed = timed(lambda: count_rows([csv_path]))
+    print(f"{'plain':<6} {'':<16} {rows:>9} rows {elapsed:>7.2f}s")
+
+    for label, path in [("zip", zip_path), ("gzip", gzip_path), ("bz2", bz2_path)]:
+      streamed_rows, streamed_elapsed = timed(
+        lambda: count_rows(streamed(path)))
+
+      def extract_then_read() -> int:
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as extract_dir:
+          return count_rows(extract(path, extract_dir))
+      extracted_rows, extracted_elapsed = timed(extract_then_read)
+
+      if streamed_rows != extracted_rows:
+        raise RuntimeError(f"{label}: read {streamed_rows} rows streamed, but "
+                           f"{extracted_rows} extracted")
+      size_mb = os.path.getsize(path) / 1e6
+      print(f"{label:<6} {size_mb:>6.1f}MB on disk {streamed_rows:>9} rows "
+            f"streamed {streamed_elapsed:>7.2f}s  "
+            f"extracted {extracted_elapsed:>7.2f}s")
+
+
+if __name__ == "__main__":
+  main()
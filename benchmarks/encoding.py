@@ -0,0 +1,132 @@
+"""
+Benchmarks the encoding of the request bodies that we post to the SFE.
+
+For appointments (from 6K.csv) and for patients with 500 claims each, reports
+the bytes on the wire and the encode time per payload, for the stdlib json
+encoder that requests uses and for common.encode_json, with each of the
+content encodings that the posting layer supports.
+
+    python -m benchmarks.encoding [--input-file-path 6K.csv] [--patients 20]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, List
+
+import common
+from claim_struct import ClaimStruct
+from diagnosis_struct import DiagnosisStruct
+from external_appointment_struct import ExternalAppointmentStructSchema
+from patient_struct import PatientStruct, PatientStructSchema
+from procedure_struct import ProcedureStruct
+from provider_struct import ProviderStruct
+import common_io
+from stlukes_mappings import StLukesEtlAppointmentMapping
+
+
+def appointment_payloads(input_file_path: str) -> List[dict]:
+  mapping = StLukesEtlAppointmentMapping()
+  df = common_io.read_csv_fast(input_file_path,
+                               columns=mapping.columns(),
+                               sep='|',
+                               parse_dates=[
+                                 mapping.appointment_date,
+                                 mapping.date_of_birth,
+                                 mapping.external_created_date,
+                                 mapping.external_last_modified_date,
+                               ])
+  schema = ExternalAppointmentStructSchema()
+  payloads = []
+  for i in df.index:
+    appointment = mapping.get_appointment_struct(df.loc[i])
+    appointment.plan_id = 1
+    appointment.appointment_timezone = 'America/Boise'
+    payloads.append(schema.dump(appointment))
+
+  return payloads
+
+
+def patient_payloads(num_patients: int, num_claims: int = 500) -> List[dict]:
+  schema = PatientStructSchema()
+  from_date = datetime(2020, 1, 1)
+  payloads = []
+  for p in range(num_patients):
+    member_number = f"M{p:08d}"
+    claims = []
+    for c in range(num_claims):
+      claim_number = f"C{p:06d}{c:05d}"
+      claims.append(ClaimStruct(
+        claim_number=claim_number,
+        claim_type='professional',
+        member_number=member_number,
+        from_date=from_date + timedelta(days=c % 365),
+        thru_date=from_date + timedelta(days=c % 365 + 1),
+        provider_npi='1265407266',
+        medical_group_tin='123456789',
+        setting='office',
+        diagnoses=[DiagnosisStruct(claim_number, member_number, code, 'icd10')
+                   for code in ['E11.9', 'I10', 'Z00.00']],
+        procedures=[ProcedureStruct(claim_number, member_number, '99213')],
+        amount_gross=Decimal('125.40'),
+        amount_paid=Decimal('98.12'),
+      ))
+    patient = PatientStruct(member_number=member_number,
+                            plan_id=1,
+                            first_name='Lisa',
+                            last_name='Orange',
+                            gender='F',
+                            date_of_birth=datetime(1950, 10, 5).date(),
+                            provider=ProviderStruct('Laron', 'Crosland',
+                                                    '1265407266'),
+                            claims=claims)
+    payloads.append(schema.dump(patient))
+
+  return payloads
+
+
+def _stdlib_encode(json_dict: dict) -> bytes:
+  # This is what requests does with json=, plus the default that it would
+  # need to encode Decimals.
+  return json.dumps(json_dict, default=common._json_default).encode('utf-8')
+
+
+def _report(name: str,
+            payloads: List[dict],
+            encode: Callable[[dict], bytes],
+            content_encoding: str):
+  total_bytes = 0
+  start = time.perf_counter()
+  for payload in payloads:
+    total_bytes += len(encode(payload))
+  elapsed = time.perf_counter() - start
+
+  print(f"{name:<14} {content_encoding:<10} "
+        f"{total_bytes / len(payloads):>14,.0f} B/payload "
+        f"{elapsed / len(payloads) * 1000:>10.3f} ms/payload")
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--input-file-path", default="6K.csv")
+  parser.add_argument("--patients", type=int, default=20)
+  parser.add_argument("--claims", type=int, default=500)
+  args = parser.parse_args(argv)
+
+  print(f"orjson available: {common.orjson is not None}")
+  for name, payloads in [
+    ("appointments", appointment_payloads(args.input_file_path)),
+    (f"patients x{args.claims}", patient_payloads(args.patients, args.claims)),
+  ]:
+    print(f"\n{name}: {len(payloads)} payloads")
+    _report("stdlib json", payloads, _stdlib_encode,
+            common.CONTENT_ENCODING_IDENTITY)
+    for content_encoding in common.CONTENT_ENCODINGS:
+      _report("encode_json", payloads,
+              lambda p: common.encode_request_body(p, content_encoding)[0],
+              content_encoding)
+
+
+if __name__ == "__main__":
+  main()
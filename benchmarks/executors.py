@@ -0,0 +1,84 @@
+"""
+Compares the wall time of the appointments pipeline under each executor
+profile (see executor_profiles.py), on 6K.csv and on a synthetic file 100 times
+larger, posting to an in-process mock SFE.
+
+    python -m benchmarks.executors [--scale 100] [--profiles threads hybrid]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+from prefect import Flow, Parameter, unmapped
+
+import common
+import executor_profiles
+from benchmarks import mock_sfe
+from benchmarks.synthetic import write_synthetic_appointments
+from tasks.appointment_tasks import aggregate_summaries, build_graphs, \
+  extract_data_frame, extract_nodes, partition_appointments, post_batch
+
+
+def build_flow() -> Flow:
+  """
+  The appointments flow, minus validation, registration and storage.
+  """
+  with Flow("Appointments executor benchmark") as flow:
+    input_file_path = Parameter("input_file_path")
+    post_batch_size = Parameter("post_batch_size", default=100)
+
+    df = extract_data_frame(input_file_path, None, None)
+    nodes, extract_summary = extract_nodes(df)
+    graphs = build_graphs(nodes)
+    batches = partition_appointments(graphs, post_batch_size)
+    summaries = post_batch.map(batches, unmapped(None), unmapped(None),
+                               unmapped(None))
+    aggregate_summaries(summaries, extract_summary=extract_summary)
+
+  return flow
+
+
+def run(profile: str, input_file_path: str) -> float:
+  flow = build_flow()
+  start = time.perf_counter()
+  state = flow.run(parameters={"input_file_path": input_file_path},
+                   executor=executor_profiles.get_executor(profile))
+  elapsed = time.perf_counter() - start
+  if not state.is_successful():
+    raise RuntimeError(f"Flow run failed with profile {profile}: {state}")
+  return elapsed
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--input-file-path", default="6K.csv")
+  parser.add_argument("--scale", type=int, default=100)
+  parser.add_argument("--profiles", nargs="+",
+                      default=sorted(executor_profiles.EXECUTOR_PROFILES))
+  args = parser.parse_args(argv)
+
+  # Worker processes inherit the environment, so they post to the mock too.
+  server, url = mock_sfe.serve_in_background()
+  os.environ['SFE_URL'] = common.SFE_URL = url
+
+  with open(args.input_file_path) as f:
+    num_rows = sum(1 for _ in f) - 1
+
+  with tempfile.TemporaryDirectory() as tmp:
+    synthetic_path = write_synthetic_appointments(
+      os.path.join(tmp, "synthetic.csv"), num_rows * args.scale,
+      args.input_file_path)
+
+    try:
+      for name, path in [(args.input_file_path, args.input_file_path),
+                         (f"{args.scale}x synthetic", synthetic_path)]:
+        for profile in args.profiles:
+          print(f"{name:<20} {profile:<10} {run(profile, path):>8.1f}s")
+    finally:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+"""
+Checks the import time of the flow and task modules against a budget.
+
+Each module is imported in a fresh interpreter with `-X importtime`, and the
+cumulative time of the module itself is compared to the budget. The time
+spent importing prefect, which every flow needs, is shown apart, and the
+slowest imports under the module are listed, to find what to make lazy.
+
+    python -m benchmarks.import_time [--budget-seconds 1.0] [--top 10]
+
+Exits with an error if any module is over the budget. The budget is for the
+whole import, prefect included: prefect alone takes 0.7-0.9s of it on our
+machines, and our own modules under 0.07s more. Pass --exclude-prefect to
+import prefect first, and hold only the time of the module on top of it to a
+budget, 0.25s by default - e.g. on a loaded machine, where the time of prefect
+varies too much to compare runs. The packages that prefect imports itself,
+like marshmallow, are then not counted against the module.
+"""
+import argparse
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+MODULES = [
+  'flows.appointments',
+  'flows.appointments_streaming',
+  'flows.sftp',
+  'tasks.appointment_tasks',
+  'tasks.sftp_tasks',
+  'common',
+]
+
+DEFAULT_BUDGET_SECONDS = 1.0
+DEFAULT_EXCLUDE_PREFECT_BUDGET_SECONDS = 0.25
+
+# import time:      self [us] |  cumulative | imported package
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def import_times(module: str,
+                 preload: str = None) -> List[Tuple[str, int, int, int]]:
+  """
+  Imports the module in a fresh interpreter, after preload if one is passed,
+  and returns the (name, self us, cumulative us, depth) of every module that
+  they imported, in the order that -X importtime lists them.
+  """
+  code = f'import {preload}; import {module}' if preload else f'import {module}'
+  stderr = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', code],
+    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    universal_newlines=True,
+  ).stderr
+
+  result = []
+  for line in stderr.splitlines():
+    match = _IMPORTTIME_LINE.match(line)
+    if match:
+      self_us, cumulative_us, indent, name = match.groups()
+      result.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+  return result
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--budget-seconds", type=float, default=None)
+  parser.add_argument("--top", type=int, default=10)
+  parser.add_argument("--exclude-prefect", action="store_true")
+  parser.add_argument("modules", nargs="*", default=MODULES)
+  args = parser.parse_args(argv)
+  if args.budget_seconds is None:
+    args.budget_seconds = DEFAULT_EXCLUDE_PREFECT_BUDGET_SECONDS \
+      if args.exclude_prefect else DEFAULT_BUDGET_SECONDS
+
+  over_budget = []
+  for module in args.modules:
+    times = import_times(module, 'prefect' if args.exclude_prefect else None)
+    prefect = sum(cumulative for name, _, cumulative, _ in times
+                  if name == 'prefect') / 1e6
+    if args.exclude_prefect:
+      # Only what the module imported on top of prefect, listed after it.
+      times = times[next(i for i, (name, _, _, _) in enumerate(times)
+                         if name == 'prefect') + 1:]
+    module_time = next(cumulative for name, _, cumulative, _ in times
+                       if name == module) / 1e6
+    if args.exclude_prefect:
+      total, rest = prefect + module_time, module_time
+    else:
+      total, rest = module_time, module_time - prefect
+    measured = rest if args.exclude_prefect else total
+    status = "OK" if measured <= args.budget_seconds else "OVER BUDGET"
+    print(f"{module:<32} {total:>6.3f}s (prefect {prefect:.3f}s, "
+          f"rest {rest:.3f}s)  {status}")
+
+    # The top level packages that it pulled in, slowest first.
+    top_level = sorted(((cumulative, name) for name, _, cumulative, depth in times
+                        if depth == 1), reverse=True)
+    for cumulative, name in top_level[:args.top]:
+      print(f"    {name:<40} {cumulative / 1e6:>6.3f}s")
+
+    if measured > args.budget_seconds:
+      over_budget.append(module)
+
+  if over_budget:
+    sys.exit(f"Over the {args.budget_seconds}s import budget: {over_budget}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,118 @@
+"""
+Replays appointment payloads derived from 6K.csv against an SFE at a given
+concurrency, and reports latency percentiles and throughput.
+
+By default it starts a mock SFE in the same process (see benchmarks/mock_sfe.py)
+- pass --url to point it at an already running one:
+
+    python -m benchmarks.load_test --concurrency 16 --requests 20000
+    python -m benchmarks.load_test --url http://localhost:8099 --latency-ms 20
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import common
+from benchmarks import mock_sfe
+from benchmarks.encoding import appointment_payloads
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+  if not sorted_values:
+    return 0.0
+  index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+  return sorted_values[index]
+
+
+def _post(url: str, json_data: dict, content_encoding: str):
+  start = time.perf_counter()
+  err, content = common.requests_post(url, {
+    'json_data': json_data,
+    'commit': False,
+    'data_set_id': 1,
+  }, content_encoding=content_encoding)
+  latency = time.perf_counter() - start
+
+  if not err and not json.loads(content)['success']:
+    err = "; ".join(json.loads(content)['errors'])
+  return latency, err
+
+
+def run(url: str,
+        payloads: List[dict],
+        num_requests: int,
+        concurrency: int,
+        content_encoding: Optional[str] = None) -> dict:
+  """
+  Posts num_requests payloads (cycling through the ones passed in) to the
+  appointment update path, and returns latency percentiles in milliseconds
+  and the throughput in requests per second.
+  """
+  post_url = url + mock_sfe.APPOINTMENT_UPDATE_PATH
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    results = list(executor.map(
+      lambda i: _post(post_url, payloads[i % len(payloads)], content_encoding),
+      range(num_requests)))
+  elapsed = time.perf_counter() - start
+
+  latencies = sorted(latency * 1000 for latency, _ in results)
+  errors = [err for _, err in results if err]
+  return {
+    'requests': num_requests,
+    'concurrency': concurrency,
+    'errors': len(errors),
+    'p50_ms': percentile(latencies, 50),
+    'p95_ms': percentile(latencies, 95),
+    'p99_ms': percentile(latencies, 99),
+    'throughput_rps': num_requests / elapsed,
+  }
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--url", default=None,
+                      help="SFE to post to, defaults to an in-process mock SFE")
+  parser.add_argument("--input-file-path", default="6K.csv")
+  parser.add_argument("--requests", type=int, default=6000)
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+  parser.add_argument("--content-encoding", default=None,
+                      choices=common.CONTENT_ENCODINGS)
+  # Only used for the in-process mock SFE.
+  parser.add_argument("--latency-ms", type=float, default=0)
+  parser.add_argument("--latency-jitter-ms", type=float, default=0)
+  parser.add_argument("--error-rate", type=float, default=0)
+  parser.add_argument("--rate-limit-rate", type=float, default=0)
+  args = parser.parse_args(argv)
+
+  server = None
+  url = args.url
+  if not url:
+    server, url = mock_sfe.serve_in_background(mock_sfe.MockSfeConfig(
+      latency_ms=args.latency_ms,
+      latency_jitter_ms=args.latency_jitter_ms,
+      error_rate=args.error_rate,
+      rate_limit_rate=args.rate_limit_rate,
+    ))
+
+  payloads = appointment_payloads(args.input_file_path)
+  print(f"Posting {args.requests} of {len(payloads)} payloads to {url}")
+  try:
+    for concurrency in args.concurrency:
+      report = run(url, payloads, args.requests, concurrency,
+                   args.content_encoding)
+      print(f"concurrency={report['concurrency']:<3} "
+            f"p50={report['p50_ms']:.1f}ms "
+            f"p95={report['p95_ms']:.1f}ms "
+            f"p99={report['p99_ms']:.1f}ms "
+            f"throughput={report['throughput_rps']:.0f} req/s "
+            f"errors={report['errors']}")
+  finally:
+    if server:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,256 @@
+"""
+A local stand-in for the SFE api, so that the posting path can be exercised and
+benchmarked without touching a real SFE.
+
+It implements the endpoints that the ETL posts to, with the same response
+envelope (`success`, `errors`, `update_summary`), and lets us inject latency,
+errors and 429 Too Many Requests responses:
+
+    python -m benchmarks.mock_sfe --port 8099 --latency-ms 20 --error-rate 0.01
+    SFE_URL=http://localhost:8099 python -m benchmarks.load_test
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+
+
+APPOINTMENT_UPDATE_PATH = '/api/external_appointment/update'
+PATIENT_UPDATE_PATH = '/api/patient/update'
+
+# Equivalent of the SFE's api_plan_set_roster and api_plan_set_roster_for_mg,
+# and of the endpoints that apply a diff to the roster (see roster_sync.py).
+PLAN_ROSTER_PATH = re.compile(r'^/api/plan/(?P<plan_id>\d+)/roster(?P<diff>/diff)?$')
+MG_PLAN_ROSTER_PATH = re.compile(
+  r'^/api/medical_group/(?P<medical_group_id>\d+)/plan/(?P<plan_id>\d+)'
+  r'/roster(?P<diff>/diff)?$')
+
+
+class MockSfeConfig:
+  """
+  The failure modes of the mock SFE. Rates are probabilities between 0 and 1.
+  """
+  def __init__(self,
+               latency_ms: float = 0,
+               latency_jitter_ms: float = 0,
+               error_rate: float = 0,
+               rate_limit_rate: float = 0):
+    self.latency_ms = latency_ms
+    self.latency_jitter_ms = latency_jitter_ms
+    self.error_rate = error_rate
+    self.rate_limit_rate = rate_limit_rate
+
+
+class MockSfeState:
+  """
+  What the mock SFE has seen so far. Rosters are kept per (medical group, plan)
+  so that the roster endpoints can report orphaned member numbers the same way
+  the SFE does.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests_by_path: Dict[str, int] = {}
+    self.rosters: Dict[Tuple[Optional[str], str], Set[str]] = {}
+
+  def count(self, path: str):
+    with self.lock:
+      self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+
+  def set_roster(self,
+                 key: Tuple[Optional[str], str],
+                 member_numbers: List[str],
+                 commit: bool) -> List[str]:
+    with self.lock:
+      previous = self.rosters.get(key, set())
+      current = set(member_numbers)
+      if commit:
+        self.rosters[key] = current
+      return sorted(previous - current)
+
+  def apply_roster_diff(self,
+                        key: Tuple[Optional[str], str],
+                        added: List[str],
+                        removed: List[str],
+                        commit: bool) -> List[str]:
+    with self.lock:
+      previous = self.rosters.get(key, set())
+      orphaned = previous & set(removed)
+      if commit:
+        self.rosters[key] = (previous | set(added)) - orphaned
+      return sorted(orphaned)
+
+
+class MockSfeHandler(BaseHTTPRequestHandler):
+
+  # Keep-alive, like the SFE behind its load balancer.
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    config: MockSfeConfig = self.server.config
+    state: MockSfeState = self.server.state
+    state.count(self.path)
+
+    try:
+      json_dict = self._read_json()
+    except ValueError as e:
+      return self._respond(400, {'success': False, 'errors': [f"{e}"]})
+
+    if config.latency_ms or config.latency_jitter_ms:
+      time.sleep(max(0, random.gauss(config.latency_ms,
+                                     config.latency_jitter_ms)) / 1000)
+
+    if random.random() < config.rate_limit_rate:
+      return self._respond(429, {'success': False,
+                                 'errors': ['Too Many Requests']})
+
+    if random.random() < config.error_rate:
+      return self._respond(200, {'success': False,
+                                 'errors': ['mock sfe injected error']})
+
+    commit = json_dict.get('commit', False)
+    if self.path == APPOINTMENT_UPDATE_PATH:
+      return self._respond(200, _envelope(_appointment_summary()))
+    if self.path == PATIENT_UPDATE_PATH:
+      return self._respond(200, _envelope(
+        _patient_summary(json_dict.get('json_data') or {})))
+
+    match = PLAN_ROSTER_PATH.match(self.path) or \
+      MG_PLAN_ROSTER_PATH.match(self.path)
+    if match:
+      params = match.groupdict()
+      key = (params.get('medical_group_id'), params['plan_id'])
+      if params['diff']:
+        orphaned = state.apply_roster_diff(
+          key,
+          json_dict.get('added_member_numbers') or [],
+          json_dict.get('removed_member_numbers') or [],
+          commit)
+      else:
+        orphaned = state.set_roster(key,
+                                    json_dict.get('all_member_numbers') or [],
+                                    commit)
+      return self._respond(200, {
+        'success': True,
+        'errors': [],
+        'orphaned_member_numbers': json.dumps(orphaned),
+        'orphaned_count': len(orphaned),
+      })
+
+    return self._respond(404, {'success': False,
+                               'errors': [f"Unknown path {self.path}"]})
+
+  def _read_json(self) -> dict:
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    content_encoding = self.headers.get('Content-Encoding', 'identity')
+    if content_encoding == 'gzip':
+      body = zlib.decompress(body, 31)
+    elif content_encoding == 'deflate':
+      body = zlib.decompress(body)
+    elif content_encoding != 'identity':
+      raise ValueError(f"Unsupported Content-Encoding {content_encoding}")
+
+    return json.loads(body)
+
+  def _respond(self, status: int, response: dict):
+    body = json.dumps(response).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # Logging every request to stderr would dominate the load tests.
+    pass
+
+
+def _envelope(update_summary: dict) -> dict:
+  return {'success': True, 'errors': [], 'update_summary': update_summary}
+
+
+def _appointment_summary() -> dict:
+  return {
+    'num_valid_appointments': 1,
+    'num_new_appointments': 1,
+    'num_existing_appointments': 0,
+    'num_dropped_appointments': 0,
+    'details': [],
+  }
+
+
+def _patient_summary(json_data: dict) -> dict:
+  claims = json_data.get('claims') or []
+  from_dates = sorted(c['from_date'] for c in claims if c.get('from_date'))
+  npi = (json_data.get('provider') or {}).get('npi')
+  return {
+    'num_valid_patients': 1,
+    'num_new_patients': 1,
+    'num_new_claims': len(claims),
+    'num_patients_with_new_claims': 1 if claims else 0,
+    'new_claims_min_date': from_dates[0] if from_dates else None,
+    'new_claims_max_date': from_dates[-1] if from_dates else None,
+    'new_stellar_npis': [npi] if npi else [],
+    'all_member_numbers': [json_data.get('member_number')],
+    'details': [],
+  }
+
+
+def make_server(host: str = 'localhost',
+                port: int = 0,
+                config: MockSfeConfig = None) -> ThreadingHTTPServer:
+  """
+  Returns a mock SFE server, that is not yet serving. Pass port=0 to get a
+  free port, and read it back from server.server_address.
+  """
+  server = ThreadingHTTPServer((host, port), MockSfeHandler)
+  server.daemon_threads = True
+  server.config = config or MockSfeConfig()
+  server.state = MockSfeState()
+  return server
+
+
+def serve_in_background(config: MockSfeConfig = None) -> Tuple[ThreadingHTTPServer, str]:
+  """
+  Starts a mock SFE on a free local port, and returns it along with its url.
+  Call server.shutdown() to stop it.
+  """
+  server = make_server(config=config)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  host, port = server.server_address[:2]
+  return server, f"http://{host}:{port}"
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=8099)
+  parser.add_argument("--latency-ms", type=float, default=0)
+  parser.add_argument("--latency-jitter-ms", type=float, default=0)
+  parser.add_argument("--error-rate", type=float, default=0)
+  parser.add_argument("--rate-limit-rate", type=float, default=0,
+                      help="Probability of answering 429 Too Many Requests")
+  args = parser.parse_args(argv)
+
+  server = make_server(args.host, args.port, MockSfeConfig(
+    latency_ms=args.latency_ms,
+    latency_jitter_ms=args.latency_jitter_ms,
+    error_rate=args.error_rate,
+    rate_limit_rate=args.rate_limit_rate,
+  ))
+  print(f"Mock SFE listening on http://{args.host}:{args.port}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()
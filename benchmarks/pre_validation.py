@@ -0,0 +1,62 @@
+"""
+Benchmarks checking the rules of ExternalAppointmentStructSchema on chunks of
+a synthetic appointments file with the vectorized checks of schema_rules.py,
+against building the structs and validating them with the schema one row at a
+time.
+
+    python -m benchmarks.pre_validation [--rows 100000] [--chunksize 10000]
+
+One row in a thousand has an appointment type that is too long, so that both
+find the same rejects.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import List
+
+from benchmarks.synthetic import write_synthetic_appointments
+from external_appointment_struct import ExternalAppointmentStructSchema
+from stlukes_mappings import StLukesEtlAppointmentMapping
+from tasks.appointment_tasks import _appointment_rules, _appointments_from_df, \
+  _drop_invalid, _read_appointment_chunks
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, default=100000)
+  parser.add_argument("--chunksize", type=int, default=10000)
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  mapping = StLukesEtlAppointmentMapping()
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    input_file_path = write_synthetic_appointments(
+      os.path.join(tmp_dir, "appointments.csv"), args.rows, args.template_path)
+    # The chunks of the streaming flow, with the source of each row.
+    chunks = list(_read_appointment_chunks(
+      input_file_path, None, None, args.chunksize, logging.getLogger(__name__)))
+  for chunk in chunks:
+    chunk.loc[chunk.index[::1000], mapping.appointment_type] = "X" * 31
+
+  rules = _appointment_rules(mapping)
+  start = time.perf_counter()
+  rejected = sum(_drop_invalid(chunk, mapping, rules)[2] for chunk in chunks)
+  elapsed = time.perf_counter() - start
+  print(f"vectorized rules   {elapsed:>7.2f}s {rejected} rejected")
+
+  schema = ExternalAppointmentStructSchema()
+  start = time.perf_counter()
+  rejected = 0
+  for chunk in chunks:
+    for appointment in _appointments_from_df(chunk, mapping):
+      data = schema.dump(appointment)
+      data.pop('extra_data', None)
+      rejected += bool(schema.validate(data))
+  elapsed = time.perf_counter() - start
+  print(f"per-row schema     {elapsed:>7.2f}s {rejected} rejected")
+
+
+if __name__ == "__main__":
+  main()
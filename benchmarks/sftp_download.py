@@ -0,0 +1,109 @@
+"""
+Benchmarks downloading a large file from a local SFTP server with a round trip
+latency with sftp_client.get, against the parallel ranged downloads of
+sftp_download.py, and resuming a ranged download after its connections were
+dropped partway.
+
+    python -m benchmarks.sftp_download [--size-mb 128] [--workers 1 4 8] \
+      [--latency-ms 10]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import List
+
+import sftp_download
+import sftp_pool
+from benchmarks import sftp_server
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--size-mb", type=int, default=128)
+  parser.add_argument("--part-size-mb", type=int, default=8)
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+  parser.add_argument("--latency-ms", type=float, default=10)
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as root_dir, \
+      tempfile.TemporaryDirectory() as download_dir:
+    size = args.size_mb * 1024 * 1024
+    with open(os.path.join(root_dir, "claims.dat"), 'wb') as f:
+      for _ in range(args.size_mb):
+        f.write(os.urandom(1024 * 1024))
+
+    server, host, port = sftp_server.serve_in_background(root_dir,
+                                                         args.latency_ms)
+    local_path = os.path.join(download_dir, "claims.dat")
+    part_size = args.part_size_mb * 1024 * 1024
+    try:
+      start = time.perf_counter()
+      with sftp_pool.sftp(host, port, "benchmark", "benchmark") as sftp_client:
+        sftp_client.get("/claims.dat", local_path)
+      elapsed = time.perf_counter() - start
+      print(f"sftp_client.get        {elapsed:>7.2f}s "
+            f"{size / elapsed / 1e6:>7.1f}MB/s")
+
+      for workers in args.workers:
+        os.remove(local_path)
+        start = time.perf_counter()
+        sftp_download.download(host, port, "benchmark", "benchmark",
+                               "/claims.dat", local_path, part_size=part_size,
+                               workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"ranged workers={workers:<3}     {elapsed:>7.2f}s "
+              f"{size / elapsed / 1e6:>7.1f}MB/s")
+
+      # Drops the connections to the server once a third of the parts are
+      # down, with no retries, then resumes.
+      os.remove(local_path)
+      progress_path = local_path + sftp_download.PROGRESS_SUFFIX
+      num_parts = -(-size // part_size)
+
+      def drop_connections():
+        while True:
+          try:
+            with open(progress_path) as f:
+              if len(json.load(f)['done']) >= num_parts // 3:
+                break
+          except (OSError, ValueError):
+            pass
+          time.sleep(0.01)
+        for transport in server._transports:
+          transport.close()
+
+      dropper = threading.Thread(target=drop_connections, daemon=True)
+      dropper.start()
+      try:
+        sftp_download.download(host, port, "benchmark", "benchmark",
+                               "/claims.dat", local_path, part_size=part_size,
+                               workers=max(args.workers), retries=0)
+      except Exception:
+        # e.g. paramiko.SSHException("Server connection dropped")
+        pass
+      else:
+        raise RuntimeError("The download did not fail")
+      dropper.join()
+      with open(progress_path) as f:
+        resumed_parts = len(json.load(f)['done'])
+
+      start = time.perf_counter()
+      sftp_download.download(host, port, "benchmark", "benchmark",
+                             "/claims.dat", local_path, part_size=part_size,
+                             workers=max(args.workers))
+      elapsed = time.perf_counter() - start
+      print(f"resumed {resumed_parts}/{num_parts} parts done  {elapsed:>7.2f}s")
+
+      with open(os.path.join(root_dir, "claims.dat"), 'rb') as expected, \
+          open(local_path, 'rb') as actual:
+        if expected.read() != actual.read():
+          raise RuntimeError("The resumed download differs from the file")
+    finally:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,82 @@
+"""
+Benchmarks downloading 100 small files from a local SFTP server with a new
+SSH connection per file, as the tasks did before sftp_pool.py, against the
+connections of the pool.
+
+    python -m benchmarks.sftp_handshake [--files 100] [--workers 1 8] \
+      [--latency-ms 10]
+
+The latency is the round trip time of the connections to the server, see
+benchmarks/sftp_server.py. Each handshake takes several round trips.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
+
+import paramiko
+
+import sftp_pool
+from benchmarks import sftp_server
+
+
+@contextmanager
+def _connect_per_file(host: str, port: int):
+  ssh_client = paramiko.SSHClient()
+  ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+  ssh_client.connect(host, port, "benchmark", "benchmark")
+  try:
+    yield ssh_client.open_sftp()
+  finally:
+    ssh_client.close()
+
+
+def run(open_sftp, names: List[str], workers: int, download_dir: str) -> float:
+  def download(name: str):
+    with open_sftp() as sftp_client:
+      sftp_client.get(f"/{name}", os.path.join(download_dir, name))
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    list(executor.map(download, names))
+  return time.perf_counter() - start
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--files", type=int, default=100)
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+  parser.add_argument("--latency-ms", type=float, default=10)
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as root_dir, \
+      tempfile.TemporaryDirectory() as download_dir:
+    names = [f"appointments_{i}.csv" for i in range(args.files)]
+    for name in names:
+      with open(os.path.join(root_dir, name), 'w') as f:
+        f.write("a|b\n1|2\n" * 100)
+
+    server, host, port = sftp_server.serve_in_background(root_dir,
+                                                         args.latency_ms)
+    try:
+      for workers in args.workers:
+        elapsed = run(lambda: _connect_per_file(host, port), names, workers,
+                      download_dir)
+        print(f"connect per file  workers={workers:<3} {elapsed:>7.2f}s  "
+              f"{args.files} connections")
+
+        pool = sftp_pool.SftpPool(max_channels=workers)
+        elapsed = run(lambda: pool.sftp(host, port, "benchmark", "benchmark"),
+                      names, workers, download_dir)
+        pool.close()
+        print(f"pool              workers={workers:<3} {elapsed:>7.2f}s  "
+              f"{pool.connects} connections, {pool.channels_opened} channels")
+    finally:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+"""
+Benchmarks fetching large files through the SFTP mirror (see sftp_mirror.py)
+from a local SFTP server with a round trip latency: the first fetch downloads
+them, the next ones are served from the mirror, with and without checking
+their content.
+
+    python -m benchmarks.sftp_mirror [--rows 200000] [--files 3] \
+      [--latency-ms 10]
+
+At the end, the mirror is given room for all the files but one, and evicts
+the one that was used the longest time ago.
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import sftp_pool
+from benchmarks import sftp_server
+from benchmarks.synthetic import write_synthetic_appointments
+from sftp_mirror import SftpMirror
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, default=200000)
+  parser.add_argument("--files", type=int, default=3)
+  parser.add_argument("--latency-ms", type=float, default=10)
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as root_dir, \
+      tempfile.TemporaryDirectory() as mirror_dir:
+    names = [f"appointments_{i}.csv" for i in range(args.files)]
+    write_synthetic_appointments(os.path.join(root_dir, names[0]), args.rows,
+                                 args.template_path)
+    for name in names[1:]:
+      os.link(os.path.join(root_dir, names[0]), os.path.join(root_dir, name))
+    file_size = os.path.getsize(os.path.join(root_dir, names[0]))
+
+    server, host, port = sftp_server.serve_in_background(root_dir,
+                                                         args.latency_ms)
+    try:
+      max_bytes = file_size * args.files
+      for label, verify in [("cold", True), ("warm", True), ("warm", False)]:
+        mirror = SftpMirror(mirror_dir, max_bytes=max_bytes, verify=verify)
+        start = time.perf_counter()
+        with sftp_pool.sftp(host, port, "benchmark", "benchmark") as sftp_client:
+          for name in names:
+            mirror.fetch(sftp_client, f"{host}:{port}", f"/{name}")
+        elapsed = time.perf_counter() - start
+        print(f"{label:<5} verify={str(verify):<5} {elapsed:>7.2f}s  "
+              f"{mirror.hits} hits {mirror.misses} misses, "
+              f"{mirror.total_bytes() / 1e6:.1f}MB mirrored")
+        mirror.close()
+
+      mirror = SftpMirror(mirror_dir, max_bytes=file_size * (args.files - 1))
+      mirror.evict()
+      print(f"evict to {mirror.max_bytes / 1e6:.1f}MB: "
+            f"{mirror.total_bytes() / 1e6:.1f}MB mirrored")
+      mirror.close()
+    finally:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
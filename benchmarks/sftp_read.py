@@ -0,0 +1,74 @@
+"""
+Benchmarks parsing a large appointments file straight off a local SFTP server
+with a round trip latency, reading it as a plain SFTPFile and through the
+read ahead of sftp_reader.py.
+
+    python -m benchmarks.sftp_read [--rows 200000] [--latency-ms 10] \
+      [--block-size-kb 1024] [--read-ahead 4]
+
+Both read the file in chunks with common_io.iter_csv_chunks, as
+stream_appointments does, and must read the same number of rows.
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import common_io
+import sftp_pool
+import sftp_reader
+from benchmarks import sftp_server
+from benchmarks.synthetic import SEP, write_synthetic_appointments
+from stlukes_mappings import StLukesEtlAppointmentMapping
+
+
+def count_rows(f) -> int:
+  mapping = StLukesEtlAppointmentMapping()
+  return sum(len(chunk) for chunk in common_io.iter_csv_chunks(
+    f, columns=mapping.columns(), chunksize=10000, sep=SEP))
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, default=200000)
+  parser.add_argument("--latency-ms", type=float, default=10)
+  parser.add_argument("--block-size-kb", type=int, default=1024)
+  parser.add_argument("--read-ahead", type=int, default=4)
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as root_dir:
+    write_synthetic_appointments(os.path.join(root_dir, "appointments.csv"),
+                                 args.rows, args.template_path)
+    size_mb = os.path.getsize(os.path.join(root_dir, "appointments.csv")) / 1e6
+    server, host, port = sftp_server.serve_in_background(root_dir,
+                                                         args.latency_ms)
+    try:
+      with sftp_pool.sftp(host, port, "benchmark", "benchmark") as sftp_client:
+        start = time.perf_counter()
+        with sftp_client.file("/appointments.csv") as f:
+          plain_rows = count_rows(f)
+        plain = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with sftp_reader.open_prefetching(
+            sftp_client, "/appointments.csv",
+            block_size=args.block_size_kb * 1024,
+            read_ahead=args.read_ahead) as f:
+          prefetched_rows = count_rows(f)
+        prefetched = time.perf_counter() - start
+    finally:
+      server.shutdown()
+
+  if plain_rows != prefetched_rows:
+    raise RuntimeError(f"Read {plain_rows} rows as a plain file, but "
+                       f"{prefetched_rows} with the read ahead")
+
+  print(f"{size_mb:.1f}MB, {plain_rows} rows")
+  print(f"plain SFTPFile  {plain:>7.2f}s  {size_mb / plain:>6.1f}MB/s")
+  print(f"read ahead      {prefetched:>7.2f}s  {size_mb / prefetched:>6.1f}MB/s")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,218 @@
+"""
+A local SFTP server that serves a directory, to stand in for the SFTP hosts of
+our data partners in benchmarks.
+
+Any username / password is accepted. Paths are relative to the served root
+directory, with "/" being the root. A round trip latency can be added to the
+connections, to stand in for a remote host: the bytes are delayed on their way
+in and out, so that requests that are pipelined still overlap as they would
+over a network.
+
+    python -m benchmarks.sftp_server /tmp/sftp_root --port 3373 --latency-ms 20
+"""
+import argparse
+import os
+import queue
+import socket
+import threading
+import time
+from typing import List, Tuple
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, \
+  SFTPServerInterface, ServerInterface
+from paramiko.sftp import SFTP_OK
+
+
+class _Server(ServerInterface):
+
+  def check_auth_password(self, username, password):
+    return paramiko.AUTH_SUCCESSFUL
+
+  def check_auth_publickey(self, username, key):
+    return paramiko.AUTH_SUCCESSFUL
+
+  def check_channel_request(self, kind, chanid):
+    return paramiko.OPEN_SUCCEEDED
+
+  def get_allowed_auths(self, username):
+    return "password,publickey"
+
+
+class _Handle(SFTPHandle):
+
+  def stat(self):
+    try:
+      return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+
+class _SftpServer(SFTPServerInterface):
+  """
+  Serves the files under ROOT, read only.
+  """
+
+  ROOT = None
+
+  def _local_path(self, path: str) -> str:
+    path = os.path.normpath('/' + path).replace('//', '/')
+    return os.path.join(self.ROOT, path.lstrip('/'))
+
+  def list_folder(self, path):
+    local_path = self._local_path(path)
+    try:
+      result = []
+      for name in os.listdir(local_path):
+        attr = SFTPAttributes.from_stat(os.stat(os.path.join(local_path, name)))
+        attr.filename = name
+        result.append(attr)
+      return result
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+  def stat(self, path):
+    try:
+      return SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+  def lstat(self, path):
+    try:
+      return SFTPAttributes.from_stat(os.lstat(self._local_path(path)))
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+  def open(self, path, flags, attr):
+    if flags & (os.O_WRONLY | os.O_RDWR):
+      return paramiko.sftp.SFTP_PERMISSION_DENIED
+    try:
+      f = open(self._local_path(path), 'rb')
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+    handle = _Handle(flags)
+    handle.filename = path
+    handle.readfile = f
+    return handle
+
+  def canonicalize(self, path):
+    # Resolves symlinks, as sshd does.
+    relative = os.path.relpath(os.path.realpath(self._local_path(path)),
+                               os.path.realpath(self.ROOT))
+    return '/' if relative == '.' else '/' + relative
+
+  def session_ended(self):
+    return SFTP_OK
+
+
+def _delay(src: socket.socket, dst: socket.socket, seconds: float):
+  """
+  Forwards what is received on src to dst, each chunk the given number of
+  seconds after it was received, until src is closed.
+  """
+  chunks: queue.Queue = queue.Queue()
+
+  def receive():
+    while True:
+      try:
+        data = src.recv(65536)
+      except OSError:
+        data = b''
+      chunks.put((time.monotonic() + seconds, data))
+      if not data:
+        return
+
+  def send():
+    while True:
+      deadline, data = chunks.get()
+      time.sleep(max(0.0, deadline - time.monotonic()))
+      try:
+        if not data:
+          dst.shutdown(socket.SHUT_WR)
+          return
+        dst.sendall(data)
+      except OSError:
+        return
+
+  threading.Thread(target=receive, daemon=True).start()
+  threading.Thread(target=send, daemon=True).start()
+
+
+class LocalSftpServer:
+  """
+  Accepts connections on a background thread, and serves root_dir over SFTP.
+  """
+
+  def __init__(self, root_dir: str, host: str = 'localhost', port: int = 0,
+               latency_ms: float = 0):
+    self.root_dir = os.path.abspath(root_dir)
+    self.latency_seconds = latency_ms / 1000
+    self.host_key = paramiko.RSAKey.generate(2048)
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.socket.bind((host, port))
+    self.socket.listen(100)
+    self.host, self.port = self.socket.getsockname()[:2]
+    self._transports: List[paramiko.Transport] = []
+    self._stopped = threading.Event()
+
+  def _handle(self, conn: socket.socket):
+    server_class = type('SftpServer', (_SftpServer,), {'ROOT': self.root_dir})
+    if self.latency_seconds:
+      # The transport talks to the client through a pair of sockets, with
+      # half the round trip on the way in and half on the way out.
+      client_conn = conn
+      conn, delayed_conn = socket.socketpair()
+      _delay(client_conn, delayed_conn, self.latency_seconds / 2)
+      _delay(delayed_conn, client_conn, self.latency_seconds / 2)
+    transport = paramiko.Transport(conn)
+    transport.add_server_key(self.host_key)
+    transport.set_subsystem_handler('sftp', SFTPServer, server_class)
+    transport.start_server(server=_Server())
+    self._transports.append(transport)
+
+  def serve_forever(self):
+    while not self._stopped.is_set():
+      try:
+        conn, _ = self.socket.accept()
+      except OSError:
+        break
+      threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+  def shutdown(self):
+    self._stopped.set()
+    self.socket.close()
+    for transport in self._transports:
+      transport.close()
+
+
+def serve_in_background(root_dir: str,
+                        latency_ms: float = 0) -> Tuple[LocalSftpServer, str, int]:
+  """
+  Starts a local SFTP server for root_dir on a free port, and returns it along
+  with its host and port. Call server.shutdown() to stop it.
+  """
+  server = LocalSftpServer(root_dir, latency_ms=latency_ms)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server, server.host, server.port
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("root_dir")
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=3373)
+  parser.add_argument("--latency-ms", type=float, default=0)
+  args = parser.parse_args(argv)
+
+  server = LocalSftpServer(args.root_dir, args.host, args.port, args.latency_ms)
+  print(f"Serving {server.root_dir} on sftp://{server.host}:{server.port}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,113 @@
+"""
+Benchmarks the SFTP flow fan-out (see tasks/sftp_tasks.py) against a local SFTP
+server, on 100 small appointment files and on 5 large ones, for a few numbers
+of workers.
+
+    python -m benchmarks.sftp_throughput --workers 1 4 8 [--process] [--index]
+
+By default files are only matched and downloaded; pass --process to also post
+them to an in-process mock SFE. With --index, each run is done twice with the
+same processed-file index (see sftp_index.py), the second run finding nothing
+new to process.
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Tuple
+
+from prefect import Flow, Parameter, unmapped
+from prefect.executors import LocalDaskExecutor
+
+import common
+from benchmarks import mock_sfe, sftp_server
+from benchmarks.synthetic import write_synthetic_appointments
+from tasks import sftp_tasks
+
+
+def build_flow() -> Flow:
+  with Flow("SFTP throughput benchmark") as flow:
+    hostname = Parameter("hostname")
+    port = Parameter("port")
+    path = Parameter("path")
+    process = Parameter("process", default=False)
+    index_path = Parameter("index_path", default=None)
+
+    directories, files = sftp_tasks.extract_directories(
+      hostname, port, "benchmark", "benchmark", path, index_path)
+    results = sftp_tasks.process_file.map(
+      files, unmapped(hostname), unmapped(port), unmapped("benchmark"),
+      unmapped("benchmark"), unmapped(None), unmapped(process),
+      unmapped(index_path))
+    sftp_tasks.summarize_files(results)
+
+  return flow
+
+
+def write_files(root_dir: str, name: str, num_files: int, num_rows: int,
+                template_path: str) -> str:
+  directory = os.path.join(root_dir, name)
+  os.makedirs(directory)
+  for i in range(num_files):
+    write_synthetic_appointments(os.path.join(directory, f"appointments_{i}.csv"),
+                                 num_rows, template_path)
+  return directory
+
+
+def run(flow: Flow, host: str, port: int, path: str, workers: int,
+        process: bool, index_path: str = None) -> Tuple[float, int]:
+  """
+  Returns the wall time of the flow run, and the bytes downloaded.
+  """
+  start = time.perf_counter()
+  state = flow.run(parameters={"hostname": host, "port": port, "path": path,
+                               "process": process, "index_path": index_path},
+                   executor=LocalDaskExecutor(scheduler='threads',
+                                              num_workers=workers))
+  elapsed = time.perf_counter() - start
+  if not state.is_successful():
+    raise RuntimeError(f"Flow run failed: {state}")
+
+  results = state.result[flow.get_tasks(name="process_file")[0]].result
+  return elapsed, sum(result['size'] for result in results)
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+  parser.add_argument("--small-rows", type=int, default=100)
+  parser.add_argument("--large-rows", type=int, default=200000)
+  parser.add_argument("--template-path", default="6K.csv")
+  parser.add_argument("--process", action="store_true")
+  parser.add_argument("--index", action="store_true")
+  args = parser.parse_args(argv)
+
+  if args.process:
+    sfe, url = mock_sfe.serve_in_background()
+    common.SFE_URL = url
+
+  flow = build_flow()
+  with tempfile.TemporaryDirectory() as root_dir:
+    write_files(root_dir, "small", 100, args.small_rows, args.template_path)
+    write_files(root_dir, "large", 5, args.large_rows, args.template_path)
+
+    server, host, port = sftp_server.serve_in_background(root_dir)
+    try:
+      for name in ["small", "large"]:
+        for workers in args.workers:
+          index_path = os.path.join(root_dir, f"index_{name}_{workers}.db") \
+            if args.index else None
+          runs = ["cold", "warm"] if args.index else [""]
+          for label in runs:
+            elapsed, size = run(flow, host, port, f"/{name}", workers,
+                                args.process, index_path)
+            print(f"{name:<6} workers={workers:<3} {label:<5}{elapsed:>7.2f}s "
+                  f"{size / elapsed / 1e6:>8.1f}MB/s")
+    finally:
+      server.shutdown()
+      if args.process:
+        sfe.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,74 @@
+"""
+Benchmarks the directory walk of extract_directories (see
+tasks/sftp_tasks.py) against a local SFTP server with a round trip latency,
+for a few numbers of channels.
+
+    python -m benchmarks.sftp_walk --channels 1 4 8 [--fanout 4] [--depth 4] \
+      [--latency-ms 10]
+
+The tree has fanout directories in each directory, depth levels deep, and a
+few files in each. A symlink from the deepest directories back to the root
+checks that the walk does not loop.
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import sftp_pool
+from benchmarks import sftp_server
+from tasks import sftp_tasks
+
+
+def write_tree(directory: str, fanout: int, depth: int, files_per_dir: int,
+               root_dir: str):
+  for i in range(files_per_dir):
+    with open(os.path.join(directory, f"file_{i}.csv"), 'w') as f:
+      f.write("a,b\n1,2\n")
+  if depth == 0:
+    os.symlink(root_dir, os.path.join(directory, "loop"))
+    return
+  for i in range(fanout):
+    child = os.path.join(directory, f"dir_{i}")
+    os.mkdir(child)
+    write_tree(child, fanout, depth - 1, files_per_dir, root_dir)
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 8])
+  parser.add_argument("--fanout", type=int, default=4)
+  parser.add_argument("--depth", type=int, default=4)
+  parser.add_argument("--files-per-dir", type=int, default=3)
+  parser.add_argument("--latency-ms", type=float, default=10)
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as root_dir:
+    write_tree(root_dir, args.fanout, args.depth, args.files_per_dir, root_dir)
+    server, host, port = sftp_server.serve_in_background(root_dir,
+                                                         args.latency_ms)
+    try:
+      expected = None
+      for channels in args.channels:
+        # A new pool for each run, so that they all start without connections.
+        sftp_pool.POOL = sftp_pool.SftpPool(max_channels=max(args.channels))
+        start = time.perf_counter()
+        dirs, files = sftp_tasks._walk(host, port, "benchmark", "benchmark", "/",
+                                       channels=channels)
+        elapsed = time.perf_counter() - start
+        sftp_pool.POOL.close()
+
+        if expected is None:
+          expected = (dirs, files)
+        elif (dirs, files) != expected:
+          raise RuntimeError(f"The walk with {channels} channels listed "
+                             "different directories or files")
+        print(f"channels={channels:<3} {len(dirs):>6} dirs {len(files):>7} "
+              f"files {elapsed:>8.2f}s")
+    finally:
+      server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,116 @@
+"""
+Checks that the streaming appointments pipeline (see streaming.py) runs in
+bounded memory: for synthetic files of increasing size, runs
+stream_appointments in a child process posting to a mock SFE, and fails if the
+peak RSS of any run goes over the cap, or if the peak RSS of the largest file
+is more than --max-growth-mb over the one of the smallest - i.e. if memory
+grows with the size of the file.
+
+    python -m benchmarks.streaming_memory --rows 50000 1000000 --rss-cap-mb 512
+
+At 1M rows (about 230MB of CSV), a pipeline that kept the rows or the structs
+around would grow by well over a gigabyte.
+
+The mock SFE runs in this process, so that the peak RSS of the child is only
+the one of the pipeline. Posting 1M rows takes over an hour on one core,
+even to the mock; pass --rows 100000 10000000 for a bigger spread.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from benchmarks import mock_sfe
+from benchmarks.synthetic import write_synthetic_appointments
+
+
+DEFAULT_RSS_CAP_MB = 512
+DEFAULT_MAX_GROWTH_MB = 64
+
+
+def peak_rss_mb() -> float:
+  # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_child(input_file_path: str, chunksize: int, post_workers: int):
+  from tasks.appointment_tasks import stream_appointments
+  summary = stream_appointments.run(input_file_path,
+                                    chunksize=chunksize,
+                                    post_workers=post_workers)
+  print(f"{summary['num_valid_appointments']} {peak_rss_mb():.1f}")
+
+
+def run(input_file_path: str, sfe_url: str, chunksize: int,
+        post_workers: int) -> Tuple[int, float, float]:
+  """
+  Runs the pipeline over the file in a child process, and returns the number
+  of appointments posted, the peak RSS in MB and the wall time in seconds.
+  """
+  start = time.perf_counter()
+  output = subprocess.run(
+    [sys.executable, "-m", "benchmarks.streaming_memory", "--child",
+     input_file_path, "--chunksize", str(chunksize),
+     "--post-workers", str(post_workers)],
+    check=True, stdout=subprocess.PIPE, universal_newlines=True,
+    env=dict(os.environ, SFE_URL=sfe_url),
+  ).stdout
+  elapsed = time.perf_counter() - start
+
+  num_posted, rss_mb = output.strip().split("\n")[-1].split()
+  return int(num_posted), float(rss_mb), elapsed
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, nargs="+", default=[50000, 1000000])
+  parser.add_argument("--rss-cap-mb", type=float, default=DEFAULT_RSS_CAP_MB)
+  parser.add_argument("--max-growth-mb", type=float,
+                      default=DEFAULT_MAX_GROWTH_MB)
+  parser.add_argument("--chunksize", type=int, default=1000)
+  parser.add_argument("--post-workers", type=int, default=8)
+  parser.add_argument("--template-path", default="6K.csv")
+  parser.add_argument("--child", metavar="INPUT_FILE_PATH")
+  args = parser.parse_args(argv)
+
+  if args.child:
+    run_child(args.child, args.chunksize, args.post_workers)
+    return
+
+  server, url = mock_sfe.serve_in_background()
+  over_cap = []
+  peak_rss_by_rows = {}
+  try:
+    for num_rows in args.rows:
+      with tempfile.TemporaryDirectory() as tmp:
+        path = write_synthetic_appointments(
+          os.path.join(tmp, "appointments.csv"), num_rows, args.template_path)
+        num_posted, rss_mb, elapsed = run(path, url, args.chunksize,
+                                          args.post_workers)
+
+      print(f"rows={num_rows:<10} posted={num_posted:<10} "
+            f"peak_rss={rss_mb:>7.1f}MB time={elapsed:>8.1f}s")
+      peak_rss_by_rows[num_rows] = rss_mb
+      if rss_mb > args.rss_cap_mb:
+        over_cap.append(num_rows)
+  finally:
+    server.shutdown()
+
+  if over_cap:
+    sys.exit(f"Peak RSS over {args.rss_cap_mb}MB for rows={over_cap}")
+
+  growth = peak_rss_by_rows[max(peak_rss_by_rows)] - \
+    peak_rss_by_rows[min(peak_rss_by_rows)]
+  if growth > args.max_growth_mb:
+    sys.exit(f"Peak RSS grew by {growth:.1f}MB from rows={min(peak_rss_by_rows)} "
+             f"to rows={max(peak_rss_by_rows)}, over {args.max_growth_mb}MB")
+  print(f"Peak RSS grew by {growth:.1f}MB, within {args.max_growth_mb}MB")
+
+
+if __name__ == "__main__":
+  main()
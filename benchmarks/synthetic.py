@@ -0,0 +1,51 @@
+"""
+Synthetic St. Lukes appointment files, built by repeating the rows of 6K.csv
+with unique appointment ids.
+
+    python -m benchmarks.synthetic /tmp/appointments_600K.csv --rows 600000
+"""
+import argparse
+from typing import List
+
+from stlukes_mappings import StLukesEtlAppointmentMapping
+
+
+SEP = '|'
+
+
+def write_synthetic_appointments(output_path: str,
+                                 num_rows: int,
+                                 template_path: str = '6K.csv') -> str:
+  """
+  Writes num_rows appointments to output_path, cycling through the rows of the
+  template file, and returns output_path.
+  """
+  mapping = StLukesEtlAppointmentMapping()
+  with open(template_path) as f:
+    header = f.readline()
+    rows = [line.rstrip('\n').split(SEP) for line in f if line.strip()]
+
+  id_index = header.rstrip('\n').split(SEP).index(mapping.external_appointment_id)
+  with open(output_path, 'w') as out:
+    out.write(header)
+    for i in range(num_rows):
+      row = list(rows[i % len(rows)])
+      row[id_index] = f"S{i:09d}"
+      out.write(SEP.join(row))
+      out.write('\n')
+
+  return output_path
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("output_path")
+  parser.add_argument("--rows", type=int, default=600000)
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  write_synthetic_appointments(args.output_path, args.rows, args.template_path)
+
+
+if __name__ == "__main__":
+  main()
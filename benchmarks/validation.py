@@ -0,0 +1,109 @@
+"""
+Benchmarks validating a synthetic appointments file against an expectation
+suite with the vectorized engine of expectations.py, on the whole DataFrame,
+chunk by chunk, and on a sample of the rows, against Great Expectations when
+it is installed.
+
+    python -m benchmarks.validation [--rows 600000] [--chunksize 10000] \
+      [--sample-size 10000]
+
+The suite is the one of the flow, STLUKES_DEV_6K_APPTS.warning, with
+column expectations on the appointment ids added to it, so that there are
+values to look at. One id in a hundred does not match the regex, so that the
+estimate and bounds of the sample can be compared to the exact percentage.
+"""
+import argparse
+import copy
+import os
+import tempfile
+import time
+from typing import List
+
+import pandas as pd
+
+import expectations
+from benchmarks.synthetic import SEP, write_synthetic_appointments
+from stlukes_mappings import StLukesEtlAppointmentMapping
+
+
+def benchmark_suite(ge_ctx_root: str, num_rows: int) -> dict:
+  suite = copy.deepcopy(expectations.load_suite(ge_ctx_root,
+                                                expectations.DEFAULT_SUITE_NAME))
+  for config in suite['expectations']:
+    if config['expectation_type'] == 'expect_table_row_count_to_be_between':
+      config['kwargs'] = {'min_value': num_rows * 0.9,
+                          'max_value': num_rows * 1.1}
+
+  column = StLukesEtlAppointmentMapping().external_appointment_id
+  suite['expectations'].extend([
+    {'expectation_type': 'expect_column_values_to_not_be_null',
+     'kwargs': {'column': column}},
+    {'expectation_type': 'expect_column_values_to_match_regex',
+     'kwargs': {'column': column, 'regex': r'^S\d{9}$', 'mostly': 0.95}},
+    {'expectation_type': 'expect_column_value_lengths_to_equal',
+     'kwargs': {'column': column, 'value': 10, 'mostly': 0.95}},
+  ])
+  return suite
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--rows", type=int, default=600000)
+  parser.add_argument("--chunksize", type=int, default=10000)
+  parser.add_argument("--sample-size", type=int, default=10000)
+  parser.add_argument("--ge-ctx-root", default="great_expectations")
+  parser.add_argument("--template-path", default="6K.csv")
+  args = parser.parse_args(argv)
+
+  suite = benchmark_suite(args.ge_ctx_root, args.rows)
+  mapping = StLukesEtlAppointmentMapping()
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    input_file_path = write_synthetic_appointments(
+      os.path.join(tmp_dir, "appointments.csv"), args.rows, args.template_path)
+    df = pd.read_csv(input_file_path, sep=SEP, usecols=mapping.columns(),
+                     dtype=str, keep_default_na=False)
+  column = mapping.external_appointment_id
+  df.loc[df.index[::100], column] = "X" + df[column].iloc[::100].str[1:]
+
+  start = time.perf_counter()
+  result = expectations.validate(df, suite)
+  elapsed = time.perf_counter() - start
+  print(f"vectorized            {elapsed:>7.2f}s success={result['success']}")
+
+  start = time.perf_counter()
+  validator = expectations.SuiteValidator(suite)
+  for i in range(0, len(df), args.chunksize):
+    validator.update(df.iloc[i:i + args.chunksize])
+  result = validator.result()
+  elapsed = time.perf_counter() - start
+  print(f"vectorized, chunked   {elapsed:>7.2f}s success={result['success']}")
+  exact = result['results'][2]['result']['unexpected_percent']
+
+  start = time.perf_counter()
+  validator = expectations.SuiteValidator(suite, sample_size=args.sample_size)
+  for i in range(0, len(df), args.chunksize):
+    validator.update(df.iloc[i:i + args.chunksize])
+  result = validator.result()
+  elapsed = time.perf_counter() - start
+  sampled = result['results'][2]['result']
+  low, high = sampled['unexpected_percent_bounds']
+  print(f"sampled, chunked      {elapsed:>7.2f}s success={result['success']}  "
+        f"regex unexpected {sampled['unexpected_percent']:.2f}% "
+        f"[{low:.2f}%, {high:.2f}%] at {sampled['confidence']:.0%}, "
+        f"exact {exact:.2f}%")
+
+  try:
+    import great_expectations as ge
+    from_pandas = ge.from_pandas
+  except (ImportError, AttributeError):
+    print("great_expectations is not installed, skipped")
+    return
+
+  start = time.perf_counter()
+  result = from_pandas(df).validate(expectation_suite=suite)
+  elapsed = time.perf_counter() - start
+  print(f"great_expectations    {elapsed:>7.2f}s success={result.success}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,17 +1,32 @@
+import itertools
 import json
+import os
+import zlib
 from collections import defaultdict
-from typing import List, Optional, Any, Tuple, Union, Set, Dict, DefaultDict
-from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Any, Tuple, Union, Set, Dict, DefaultDict, \
+  TYPE_CHECKING
+from datetime import datetime, date, time
 
 import marshmallow
-import pandas as pd
-import requests
 
-from patient_struct import PatientStruct
-from pcor.pcor_patient_struct import PcorPatientStruct
 import etl_err
-import prefect
+import profiling
 
+# orjson is a lot faster than the stdlib json module when encoding large
+# payloads (patients with hundreds of claims), but we don't want to require it
+# for running the ETL locally.
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# pandas, requests, prefect and the patient struct trees are imported where
+# they are used, so that importing common (and the flows that use it) stays
+# fast.
+if TYPE_CHECKING:
+  from patient_struct import PatientStruct
+  from pcor.pcor_patient_struct import PcorPatientStruct
 
 
 class RosterUpdateSummary:
@@ -54,6 +69,7 @@ def row_value(row, key, default=None, na_values: List[str] = None):
   val = row[key] if key else default
   na_values = na_values or []
 
+  import pandas as pd
   if key and pd.isnull(val):
     return default
 
@@ -86,12 +102,14 @@ def batch(iterable, batch_size=1):
     yield iterable
     return
 
-  # NOTE(octavian): In practice this seems to work, but I have copy-pasted this
-  # from the internet and I currently do not deeply understand it. Python
-  # iterables and yield are things that I should dig a bit deeper into.
-  iterable_len = len(iterable)
-  for ndx in range(0, iterable_len, batch_size):
-    yield list(iterable)[ndx:min(ndx + batch_size, iterable_len)]
+  # Slices one iterator, so that each item is only walked once, whatever the
+  # number of batches, and the iterable does not have to have a len().
+  iterator = iter(iterable)
+  while True:
+    chunk = list(itertools.islice(iterator, batch_size))
+    if not chunk:
+      return
+    yield chunk
 
 
 '''def get_etl(data_set: DataSet) -> Optional[AbstractEtl]:
@@ -134,44 +152,156 @@ def _get_etl_class(etl_name: str) -> Any:
   return [_get_etl_class(etl_name) for etl_name in settings.INSTALLED_ETLS]
 '''
 
+# ------------------------------------------------------------------------
+# The SFE we post to. This can be pointed at a local stand-in server (see
+# benchmarks/mock_sfe.py) with the SFE_URL environment variable.
+
+SFE_URL = os.environ.get('SFE_URL', 'https://app-9097.on-aptible.com')
+SFE_API_KEY = "pBSBtzsb3OqTx57W"
+
+
+# ------------------------------------------------------------------------
+# Encoding of the request bodies that we post to the SFE api.
+
+CONTENT_ENCODING_IDENTITY = 'identity'
+CONTENT_ENCODING_GZIP = 'gzip'
+CONTENT_ENCODING_DEFLATE = 'deflate'
+CONTENT_ENCODINGS = [
+  CONTENT_ENCODING_IDENTITY,
+  CONTENT_ENCODING_GZIP,
+  CONTENT_ENCODING_DEFLATE,
+]
+
+# Used when the caller of requests_post does not ask for an encoding. The SFE
+# needs to be configured to accept compressed bodies before changing this.
+DEFAULT_CONTENT_ENCODING = CONTENT_ENCODING_IDENTITY
+
+# Compression level 6 is what gzip uses by default, and is a good trade off
+# between cpu time and bytes on the wire for JSON.
+COMPRESSION_LEVEL = 6
+
+
+def _json_default(value):
+  """
+  Encodes the values that our schemas can emit, but that JSON does not know
+  about. Decimals are encoded as strings so that we do not lose precision on
+  amounts - marshmallow's Decimal field loads them back from strings.
+  """
+  if isinstance(value, Decimal):
+    return str(value)
+  if isinstance(value, (datetime, date, time)):
+    return value.isoformat()
+  if isinstance(value, set):
+    return sorted(value)
+
+  raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(json_dict: dict) -> bytes:
+  if orjson:
+    return orjson.dumps(json_dict,
+                        default=_json_default,
+                        option=orjson.OPT_NON_STR_KEYS)
+
+  return json.dumps(json_dict,
+                    default=_json_default,
+                    separators=(',', ':')).encode('utf-8')
+
+
+def encode_request_body(
+    json_dict: dict,
+    content_encoding: str = None
+) -> Tuple[bytes, Dict[str, str]]:
+  """
+  Returns the body and the headers to post the json_dict with, compressed with
+  the content_encoding passed in as a parameter.
+  """
+  content_encoding = content_encoding or DEFAULT_CONTENT_ENCODING
+  if content_encoding not in CONTENT_ENCODINGS:
+    raise ValueError(f"Unknown content encoding [{content_encoding}], "
+                     f"expected one of {CONTENT_ENCODINGS}")
+
+  body = encode_json(json_dict)
+  headers = {'Content-Type': 'application/json'}
+
+  if content_encoding == CONTENT_ENCODING_GZIP:
+    # wbits=31 writes the gzip header and trailer, and is a lot cheaper than
+    # going through the gzip module and a BytesIO.
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    body = compressor.compress(body) + compressor.flush()
+    headers['Content-Encoding'] = content_encoding
+  elif content_encoding == CONTENT_ENCODING_DEFLATE:
+    body = zlib.compress(body, COMPRESSION_LEVEL)
+    headers['Content-Encoding'] = content_encoding
+
+  return body, headers
+
+
 # ------------------------------------------------------------------------
 # Methods for posting to the SFE api.
 
-def _requests_post_rate_adapt(sfe_url, json_dict: dict):
-  r = requests.post(sfe_url, json=json_dict, timeout=120)
+def _requests_post_rate_adapt(sfe_url, json_dict: dict, content_encoding: str = None):
+  import requests
+  body, headers = encode_request_body(json_dict, content_encoding)
+  r = requests.post(sfe_url, data=body, headers=headers, timeout=120)
   if r.status_code == 429:  # Too Many Requests
     r.raise_for_status()
 
   return r
 
 
-def requests_post(sfe_url, json_dict: dict) -> Tuple[Optional[str], Optional[str]]:
-  try:
-    r = _requests_post_rate_adapt(sfe_url, json_dict)
-    r.raise_for_status()
-    #log.info("POST %s success" % sfe_url)
+def requests_post(sfe_url,
+                  json_dict: dict,
+                  content_encoding: str = None) -> Tuple[Optional[str], Optional[str]]:
+  _, err, content = requests_post_with_status(sfe_url, json_dict,
+                                              content_encoding)
+  return err, content
+
+
+def requests_post_with_status(
+    sfe_url,
+    json_dict: dict,
+    content_encoding: str = None
+) -> Tuple[Optional[int], Optional[str], Optional[str]]:
+  """
+  Same as requests_post, but also returns the HTTP status of the response, or
+  None when there was no response at all.
+  """
+  import requests
+  with profiling.http_request(sfe_url) as request:
+    try:
+      r = _requests_post_rate_adapt(sfe_url, json_dict, content_encoding)
+      request.status = r.status_code
+      r.raise_for_status()
+      #log.info("POST %s success" % sfe_url)
 
-  except requests.exceptions.RequestException as e:
-    #log.error("%s" % e)
-    return "%s" % e, None
+    except requests.exceptions.RequestException as e:
+      #log.error("%s" % e)
+      status = None
+      if e.response is not None:
+        status = request.status = e.response.status_code
+      return status, "%s" % e, None
 
-  return None, r.content
+  return r.status_code, None, r.content
 
 
 def post_to_endpoint(data_set_id: int,
                      json_data: json,
                      update_path: str,
                      summary_schema: marshmallow.Schema = None,
-                     commit: bool = False) -> Tuple[Optional[object], List[str]]:
+                     commit: bool = False,
+                     content_encoding: str = None) -> Tuple[Optional[object], List[str]]:
   """
   Wrapper for the function below, just to keep the interface the same for the
   rest of the codebase, it basically just discards the patient
   """
-  result, errors, _ = post_to_endpoint_with_patient_struct(data_set_id,
-                                                           json_data,
-                                                           update_path,
-                                                           summary_schema,
-                                                           commit)
+  result, errors, _ = post_to_endpoint_with_patient_struct(
+    data_set_id,
+    json_data,
+    update_path,
+    summary_schema,
+    commit,
+    content_encoding=content_encoding)
   return result, errors
 
 
@@ -181,8 +311,9 @@ def post_to_endpoint_with_patient_struct(
     update_path: str,
     summary_schema: marshmallow.Schema = None,
     commit: bool = False,
-    return_patient_struct: Union[PatientStruct, PcorPatientStruct] = None
-) -> Tuple[Optional[object], List[str], Union[PatientStruct, PcorPatientStruct]]:
+    return_patient_struct: Union['PatientStruct', 'PcorPatientStruct'] = None,
+    content_encoding: str = None
+) -> Tuple[Optional[object], List[str], Union['PatientStruct', 'PcorPatientStruct']]:
   """Calls the patient update endpoint, and returns a summary.
 
   If the update struct is None, then the method returns the list of errors
@@ -198,20 +329,24 @@ def post_to_endpoint_with_patient_struct(
       to commit the data to the DB.
   :param return_patient_struct: Patient struct, returned as-is, used in async
       requests to be able to map request to a patient.
+  :param content_encoding: One of CONTENT_ENCODINGS, the compression used for
+      the request body. Defaults to DEFAULT_CONTENT_ENCODING.
 
   :return: A tuple with the first being a SummaryStruct created by the
       serializer, and if this value is None, then a list of errors that caused
       the SummaryStruct to be None. Third returned value is a patient struct.
   """
   #from django.conf import settings
-  logger = prefect.context.get("logger")
-  logger.info(f"Trying to post to https://app-9097.on-aptible.com")
-  err, content = requests_post("https://app-9097.on-aptible.com" + update_path, json_dict={
+  import prefect
+  logger = prefect.context.get("logger") or prefect.utilities.logging.get_logger()
+  # This runs once per posted record, so keep it out of the shipped logs.
+  logger.debug(f"Trying to post to {SFE_URL}")
+  err, content = requests_post(SFE_URL + update_path, json_dict={
     'json_data': json_data,
     'commit': commit,
     'data_set_id': data_set_id,
-    'api_key': "pBSBtzsb3OqTx57W"
-  })
+    'api_key': SFE_API_KEY
+  }, content_encoding=content_encoding)
   if err:
     return None, [err], return_patient_struct
 
@@ -221,6 +356,11 @@ def post_to_endpoint_with_patient_struct(
     return None, response['errors'], return_patient_struct
   
   errors = None
+  # Callers that only care whether the post was accepted (e.g. retries from
+  # the retry queue) don't pass a schema, and get the raw summary back.
+  if summary_schema is None:
+    return response['update_summary'], [], return_patient_struct
+
   summary = summary_schema.load(response['update_summary'])
   if errors:
     errors = ["%s: %s" % (key, err) for key, err in errors.items()]
@@ -277,7 +417,8 @@ def _post_roster(plan_id: int,
                  roster_member_numbers: Set[str],
                  roster_summary: RosterUpdateSummary,
                  restrict_to_medical_group_id: Optional[int],
-                 commit=False):
+                 commit=False,
+                 roster_store_path: str = None):
   # If we did process a Demographics File, then all_member_numbers will not
   # be none, and as a result we go to orphaning patients.
   #
@@ -290,7 +431,8 @@ def _post_roster(plan_id: int,
     plan_id,
     roster_member_numbers,
     restrict_to_medical_group_id,
-    commit=commit)
+    commit=commit,
+    roster_store_path=roster_store_path)
 
   if orphaned_numbers:
     roster_summary.orphaned_member_numbers += orphaned_numbers
@@ -309,7 +451,8 @@ def _post_roster_to_endpoint(
     plan_id: int,
     roster_member_numbers: Set[str],
     restrict_to_medical_group_id: Optional[int],
-    commit: bool
+    commit: bool,
+    roster_store_path: str = None
 ) -> Tuple[Optional[List[str]], int, List[str]]:
   """
   Posts the roster member numbers, and the medical group restriction for a
@@ -317,34 +460,21 @@ def _post_roster_to_endpoint(
 
   The post will include the value of the commit - which will decide whether
   this is a validation only operation or one that would lead to data updates.
-  """
-  #from django.conf import settings
-  """if restrict_to_medical_group_id:
-    url = settings.SFE_URL + reverse('api_plan_set_roster_for_mg', kwargs={
-      'medical_group_id': restrict_to_medical_group_id,
-      'plan_id': plan_id
-    })
-  else:
-    url = settings.SFE_URL + reverse('api_plan_set_roster', kwargs={
-      'plan_id': plan_id
-    })
-
-  err, content = requests_post(url, json_dict={
-    'all_member_numbers': list(roster_member_numbers),
-    'commit': commit,
-    'api_key': settings.STELLAR_PATIENT_UPDATE_API_KEY
-  })
-  if err:
-    return None, 0, [err]
-
-  response = json.loads(content)
-  success = response['success']
-  if not success:
-    return None, 0, response['errors']
-
-  orphaned_member_numbers = json.loads(response['orphaned_member_numbers'])
-  orphaned_count = int(response['orphaned_count'])
 
-  return orphaned_member_numbers, orphaned_count, []
+  If a roster_store_path is passed in, only the member numbers that changed
+  since the last committed roster for this plan are uploaded, see
+  roster_sync.py.
   """
-  return None
+  # roster_sync uses the posting helpers in this module.
+  import roster_sync
+
+  store = roster_sync.RosterStore(roster_store_path) if roster_store_path else None
+  try:
+    return roster_sync.sync_roster(store,
+                                   plan_id,
+                                   roster_member_numbers,
+                                   restrict_to_medical_group_id,
+                                   commit)
+  finally:
+    if store:
+      store.close()
@@ -1,7 +1,12 @@
+import bz2
+import gzip
+import io
+import os
+import zipfile
 from datetime import datetime
 
 from io import StringIO
-from typing import Dict, Set, List
+from typing import BinaryIO, Dict, Iterator, Set, List, Tuple, Union
 import pandas as pd
 import common
 
@@ -29,6 +34,66 @@ def values_from_column(csv_file: str,
   return set(df[column_name])
 
 
+# ----------------------------------------------------------------------
+# Compressed files
+
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+
+# The header of a file is looked for in this many bytes at its start.
+HEADER_PEEK_SIZE = 64 * 1024
+
+
+def iter_members(file: Union[str, BinaryIO]) -> Iterator[Tuple[str, BinaryIO]]:
+  """
+  Yields the (name, binary stream) of each of the files in file: every member
+  of a zip archive, the decompressed content of a gzip or bz2 file, or else
+  file itself. The kind of file is told by its first bytes, not its name.
+
+  file is either a path, or a binary file object that can peek, as returned
+  by open(path, 'rb') or sftp_reader.open_prefetching. Nothing is extracted
+  to disk: each stream is decompressed as it is read, and is only valid until
+  the next one is yielded.
+  """
+  if isinstance(file, str):
+    with open(file, 'rb') as f:
+      yield from iter_members(f)
+    return
+
+  name = os.path.basename(getattr(file, 'name', '') or '')
+  magic = file.peek(len(ZIP_MAGIC))[:len(ZIP_MAGIC)]
+
+  if magic.startswith(ZIP_MAGIC):
+    with zipfile.ZipFile(file) as archive:
+      for info in archive.infolist():
+        if info.is_dir():
+          continue
+        with archive.open(info) as member:
+          yield info.filename, io.BufferedReader(member, HEADER_PEEK_SIZE)
+  elif magic.startswith(GZIP_MAGIC):
+    with gzip.GzipFile(fileobj=file, mode='rb') as member:
+      yield _strip_suffix(name, '.gz'), io.BufferedReader(member, HEADER_PEEK_SIZE)
+  elif magic.startswith(BZ2_MAGIC):
+    with bz2.BZ2File(file, mode='rb') as member:
+      yield _strip_suffix(name, '.bz2'), io.BufferedReader(member, HEADER_PEEK_SIZE)
+  else:
+    yield name, file
+
+
+def _strip_suffix(name: str, suffix: str) -> str:
+  return name[:-len(suffix)] if name.lower().endswith(suffix) else name
+
+
+def read_header(stream: BinaryIO) -> str:
+  """
+  Returns the first line of a stream from iter_members, without consuming it,
+  so that the stream can still be read from its start.
+  """
+  data = stream.peek(HEADER_PEEK_SIZE)[:HEADER_PEEK_SIZE]
+  return data.split(b'\n', 1)[0].decode('utf-8', errors='replace')
+
+
 # ----------------------------------------------------------------------
 # Pandas wrappers for doing chunking.
 
@@ -137,6 +202,33 @@ def read_csv_fast(file: str,
   return concat_df
 
 
+def iter_csv_chunks(file,
+                    columns: List[str],
+                    chunksize: int,
+                    sep: str = ",",
+                    parse_dates: List[str] = None) -> Iterator[pd.DataFrame]:
+  """
+  Same as read_csv_fast, but yields the data frame in chunks of chunksize
+  rows instead of concatenating them, so that only one chunk is in memory at
+  a time.
+  """
+  iterator = pd.read_csv(
+    file,
+    header=0,
+    dtype=str,
+    keep_default_na=False,
+    chunksize=chunksize,
+    iterator=True,
+    usecols=columns,
+    sep=sep,
+  )
+
+  for chunk in iterator:
+    for col in parse_dates or []:
+      chunk[col] = pd.to_datetime(chunk[col], errors='coerce')
+    yield chunk
+
+
 def _concat_df(iterator,
                filter_column_values: Set[str],
                filter_column_name: str) -> pd.DataFrame:
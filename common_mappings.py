@@ -1,7 +1,8 @@
+from __future__ import annotations
+
 from decimal import Decimal
-from typing import List, Optional, Type
+from typing import List, Optional, Type, TYPE_CHECKING
 
-from pandas import DataFrame
 import common
 from patient_struct import PatientStruct
 from common import row_value
@@ -17,6 +18,9 @@ import time
 from datetime import datetime, date
 from external_appointment_struct import ExternalAppointmentStruct
 
+if TYPE_CHECKING:
+  from pandas import DataFrame
+
 class Mapping:
 
   # The file type that this mapping will recognize. This file type is useful
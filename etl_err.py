@@ -1,8 +1,9 @@
 
 # Unable to parse date
 import inspect
+import re
 
-from typing import List
+from typing import List, Optional
 
 
 class Err:
@@ -207,6 +208,18 @@ def _etl_message(level: str,
 # -------------------------------------------------------------------
 # Fancier logging based on error message
 
+# Matches the code in the messages returned by display().
+ERR_CODE = re.compile(r'\b([EWI]\d{3}_[A-Z0-9_]+)')
+
+
+def code_of(message: str) -> Optional[str]:
+  """
+  Returns the error code of a message returned by display(), if any.
+  """
+  match = ERR_CODE.search(message)
+  return match.group(1) if match else None
+
+
 def display(err: Err, message: str, scope: str = None, action: str = None):
   """
   Returns a string to display an error. If scope and action are passed in, they
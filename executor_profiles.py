@@ -0,0 +1,77 @@
+"""
+Named executor profiles for our flows.
+
+Posting to the SFE is blocking I/O and runs well on threads, but building
+structs and dumping them through marshmallow is CPU bound and does not scale
+past one core on threads because of the GIL. A profile picks the executor that
+suits the flow:
+
++ threads: a local Dask scheduler on threads. The default, good for I/O.
++ processes: a local Dask scheduler on processes, for CPU bound stages.
++ hybrid: a local Dask cluster with one worker process per core, each with a
+  few threads, so CPU bound stages spread across processes while the I/O
+  bound ones overlap on threads.
+
+The profile is picked with the ETL_EXECUTOR_PROFILE environment variable, both
+when registering a flow and when the agent loads it for a run (our flows use
+script based storage, so the flow module runs again at run time).
+
+Tasks are tagged with the kind of work that they do (IO_BOUND or CPU_BOUND),
+which shows up in the Prefect UI and can be used for task concurrency limits.
+"""
+import os
+from typing import Callable, Dict
+
+from prefect.executors.base import Executor
+
+
+PROFILE_THREADS = 'threads'
+PROFILE_PROCESSES = 'processes'
+PROFILE_HYBRID = 'hybrid'
+DEFAULT_PROFILE = PROFILE_THREADS
+
+# Tags for the tasks of the flows.
+IO_BOUND = 'io-bound'
+CPU_BOUND = 'cpu-bound'
+
+# Threads per worker process, for the hybrid profile.
+HYBRID_THREADS_PER_WORKER = 4
+
+
+def _threads_executor() -> Executor:
+  from prefect.executors.dask import LocalDaskExecutor
+  return LocalDaskExecutor(scheduler='threads')
+
+
+def _processes_executor() -> Executor:
+  from prefect.executors.dask import LocalDaskExecutor
+  return LocalDaskExecutor(scheduler='processes')
+
+
+def _hybrid_executor() -> Executor:
+  from prefect.executors.dask import DaskExecutor
+  return DaskExecutor(cluster_kwargs={
+    'n_workers': os.cpu_count() or 1,
+    'threads_per_worker': HYBRID_THREADS_PER_WORKER,
+    'processes': True,
+  })
+
+
+EXECUTOR_PROFILES: Dict[str, Callable[[], Executor]] = {
+  PROFILE_THREADS: _threads_executor,
+  PROFILE_PROCESSES: _processes_executor,
+  PROFILE_HYBRID: _hybrid_executor,
+}
+
+
+def get_executor(profile: str = None) -> Executor:
+  """
+  Returns the executor for the profile passed in, or for the profile in the
+  ETL_EXECUTOR_PROFILE environment variable, or for the default profile.
+  """
+  profile = profile or os.environ.get('ETL_EXECUTOR_PROFILE') or DEFAULT_PROFILE
+  if profile not in EXECUTOR_PROFILES:
+    raise ValueError(f"Unknown executor profile [{profile}], expected one of "
+                     f"{sorted(EXECUTOR_PROFILES)}")
+
+  return EXECUTOR_PROFILES[profile]()
@@ -0,0 +1,526 @@
+"""
+A small, vectorized engine for Great Expectations suites.
+
+Running a suite through Great Expectations wraps the whole DataFrame in a
+PandasDataset, writes the validation stores and rebuilds the data docs on every
+run. This engine reads the same suite JSON, evaluates the expectations that it
+supports with vectorized pandas operations, one chunk of rows at a time, and
+returns a result with the layout of a GE ExpectationSuiteValidationResult:
+
+    validator = SuiteValidator(load_suite(ge_ctx_root, suite_name))
+    for chunk in chunks:
+      validator.update(chunk)
+    result = validator.result()
+
+Supported expectations:
+
++ expect_table_row_count_to_be_between, expect_table_row_count_to_equal
++ expect_column_to_exist
++ expect_column_values_to_not_be_null, expect_column_values_to_be_null
++ expect_column_values_to_be_in_set, expect_column_values_to_not_be_in_set
++ expect_column_values_to_match_regex, expect_column_values_to_not_match_regex
++ expect_column_value_lengths_to_be_between,
+  expect_column_value_lengths_to_equal
+
+As in GE, the column expectations other than the null ones only look at the
+values that are not null, and take `mostly`. Any other expectation of the
+suite fails with an exception_info that says it is not supported: run those
+suites with the great_expectations validation mode.
+
+With a sample_size, the validator only keeps a uniform sample of that many
+rows of all the chunks, and evaluates the column expectations on the sample,
+while the table expectations, such as the row count, are still exact. The
+counts in the result of a sampled expectation are the ones of the sample,
+and it also has the number of rows it was sampled from, and the Wilson score
+interval of its unexpected_percent at the confidence of the validator:
+
+    validator = SuiteValidator(suite, sample_size=10000, confidence=0.95)
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+  from pandas import DataFrame, Series
+
+
+# The validation modes of the appointments flows.
+VALIDATION_MODE_VECTORIZED = 'vectorized'
+VALIDATION_MODE_SAMPLED = 'sampled'
+VALIDATION_MODE_GREAT_EXPECTATIONS = 'great_expectations'
+VALIDATION_MODES = [VALIDATION_MODE_VECTORIZED, VALIDATION_MODE_SAMPLED,
+                    VALIDATION_MODE_GREAT_EXPECTATIONS]
+
+DEFAULT_SUITE_NAME = "STLUKES_DEV_6K_APPTS.warning"
+
+# As many unexpected values as GE lists in partial_unexpected_list.
+PARTIAL_UNEXPECTED_COUNT = 20
+
+DEFAULT_SAMPLE_SIZE = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+
+def load_suite(ge_ctx_root: str, expectation_suite_name: str) -> dict:
+  """
+  Reads a suite from the expectations store of a GE context, where the suite
+  "NAME.warning" is in expectations/NAME/warning.json.
+  """
+  path = os.path.join(ge_ctx_root, "expectations",
+                      *expectation_suite_name.split(".")) + ".json"
+  with open(path) as f:
+    return json.load(f)
+
+
+def _exception_info(message: str = None) -> dict:
+  return {
+    'raised_exception': message is not None,
+    'exception_message': message,
+    'exception_traceback': None,
+  }
+
+
+def _percent(count: int, total: int) -> Optional[float]:
+  return count / total * 100 if total else None
+
+
+def wilson_interval(count: int, total: int,
+                    confidence: float = DEFAULT_CONFIDENCE) -> Tuple[float, float]:
+  """
+  Returns the Wilson score interval of the proportion count / total, which
+  unlike the normal approximation stays within [0, 1] and does not collapse
+  when count is 0 or total.
+  """
+  if not total:
+    return 0.0, 1.0
+  z = NormalDist().inv_cdf((1 + confidence) / 2)
+  p = count / total
+  denominator = 1 + z * z / total
+  center = (p + z * z / (2 * total)) / denominator
+  margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / \
+    denominator
+  return max(0.0, center - margin), min(1.0, center + margin)
+
+
+# ----------------------------------------------------------------------
+# Expectations
+
+class Expectation(ABC):
+  """
+  The state of one expectation of the suite over the chunks seen so far.
+  """
+
+  def __init__(self, config: dict):
+    self.config = config
+    self.kwargs = config.get('kwargs', {})
+    self.exception: Optional[str] = None
+
+  @property
+  def columns(self) -> List[str]:
+    column = self.kwargs.get('column')
+    return [column] if column else []
+
+  @abstractmethod
+  def update(self, df: DataFrame):
+    """
+    Adds the rows of a chunk.
+    """
+
+  @abstractmethod
+  def success(self) -> bool:
+    """
+    Whether the rows seen so far meet the expectation.
+    """
+
+  @abstractmethod
+  def result(self) -> dict:
+    """
+    The `result` of the expectation in a GE validation result.
+    """
+
+  def to_dict(self) -> dict:
+    return {
+      'expectation_config': {
+        'expectation_type': self.config['expectation_type'],
+        'kwargs': self.kwargs,
+        'meta': self.config.get('meta', {}),
+      },
+      'success': False if self.exception else self.success(),
+      'result': {} if self.exception else self.result(),
+      'exception_info': _exception_info(self.exception),
+      'meta': {},
+    }
+
+
+class _Unsupported(Expectation):
+
+  def __init__(self, config: dict):
+    super().__init__(config)
+    self.exception = (
+      f"{config['expectation_type']} is not supported by the vectorized "
+      f"engine, validate with the '{VALIDATION_MODE_GREAT_EXPECTATIONS}' mode")
+
+  @property
+  def columns(self) -> List[str]:
+    return []
+
+  def update(self, df: DataFrame):
+    pass
+
+  def success(self) -> bool:
+    return False
+
+  def result(self) -> dict:
+    return {}
+
+
+class _RowCount(Expectation):
+
+  def __init__(self, config: dict):
+    super().__init__(config)
+    self.row_count = 0
+
+  @property
+  def columns(self) -> List[str]:
+    return []
+
+  def update(self, df: DataFrame):
+    self.row_count += len(df)
+
+  def success(self) -> bool:
+    if self.config['expectation_type'] == 'expect_table_row_count_to_equal':
+      return self.row_count == self.kwargs['value']
+    min_value = self.kwargs.get('min_value')
+    max_value = self.kwargs.get('max_value')
+    return (min_value is None or self.row_count >= min_value) and \
+      (max_value is None or self.row_count <= max_value)
+
+  def result(self) -> dict:
+    return {'observed_value': self.row_count}
+
+
+class _ColumnExists(Expectation):
+
+  def __init__(self, config: dict):
+    super().__init__(config)
+    self.exists = None
+
+  def update(self, df: DataFrame):
+    if self.exists is None:
+      self.exists = self.kwargs['column'] in df.columns
+
+  def success(self) -> bool:
+    return bool(self.exists)
+
+  def result(self) -> dict:
+    return {}
+
+
+class _ColumnMap(Expectation):
+  """
+  An expectation on each value of a column, that GE counts the unexpected
+  values of. Subclasses return which of the values are unexpected.
+  """
+
+  # Whether the expectation is about the nulls, in which case it looks at all
+  # the values, and not only the ones that are not null.
+  ABOUT_NULLS = False
+
+  def __init__(self, config: dict):
+    super().__init__(config)
+    self.element_count = 0
+    self.missing_count = 0
+    self.unexpected_count = 0
+    self.partial_unexpected_list = []
+
+  @abstractmethod
+  def unexpected(self, values: Series) -> Series:
+    """
+    Returns a boolean Series, True for the values that are unexpected.
+    """
+
+  def update(self, df: DataFrame):
+    column = df[self.kwargs['column']]
+    self.element_count += len(column)
+    if self.ABOUT_NULLS:
+      values = column
+    else:
+      null = column.isna()
+      self.missing_count += int(null.sum())
+      values = column[~null]
+
+    unexpected = self.unexpected(values)
+    self.unexpected_count += int(unexpected.sum())
+    room = PARTIAL_UNEXPECTED_COUNT - len(self.partial_unexpected_list)
+    if room > 0:
+      self.partial_unexpected_list.extend(
+        None if v != v else v for v in values[unexpected].head(room).tolist())
+
+  def _nonmissing_count(self) -> int:
+    return self.element_count - self.missing_count
+
+  def success(self) -> bool:
+    total = self._nonmissing_count()
+    if not total:
+      return True
+    mostly = self.kwargs.get('mostly')
+    mostly = 1 if mostly is None else mostly
+    return (total - self.unexpected_count) / total >= mostly
+
+  def result(self) -> dict:
+    nonmissing = self._nonmissing_count()
+    result = {
+      'element_count': self.element_count,
+      'unexpected_count': self.unexpected_count,
+      'unexpected_percent': _percent(self.unexpected_count, nonmissing),
+      'partial_unexpected_list': self.partial_unexpected_list,
+    }
+    if not self.ABOUT_NULLS:
+      result.update({
+        'missing_count': self.missing_count,
+        'missing_percent': _percent(self.missing_count, self.element_count),
+        'unexpected_percent_nonmissing': _percent(self.unexpected_count,
+                                                  nonmissing),
+      })
+    return result
+
+
+class _NotNull(_ColumnMap):
+  ABOUT_NULLS = True
+
+  def unexpected(self, values: Series) -> Series:
+    return values.isna()
+
+
+class _Null(_ColumnMap):
+  ABOUT_NULLS = True
+
+  def unexpected(self, values: Series) -> Series:
+    return values.notna()
+
+
+class _InSet(_ColumnMap):
+
+  def unexpected(self, values: Series) -> Series:
+    return ~values.isin(self.kwargs['value_set'])
+
+
+class _NotInSet(_ColumnMap):
+
+  def unexpected(self, values: Series) -> Series:
+    return values.isin(self.kwargs['value_set'])
+
+
+class _MatchRegex(_ColumnMap):
+
+  def unexpected(self, values: Series) -> Series:
+    # GE searches for the regex anywhere in the value, as re.search does.
+    return ~values.astype(str).str.contains(self.kwargs['regex'], regex=True)
+
+
+class _NotMatchRegex(_ColumnMap):
+
+  def unexpected(self, values: Series) -> Series:
+    return values.astype(str).str.contains(self.kwargs['regex'], regex=True)
+
+
+class _LengthsBetween(_ColumnMap):
+
+  def unexpected(self, values: Series) -> Series:
+    lengths = values.astype(str).str.len()
+    if self.config['expectation_type'] == 'expect_column_value_lengths_to_equal':
+      return lengths != self.kwargs['value']
+
+    ok = lengths == lengths
+    min_value = self.kwargs.get('min_value')
+    max_value = self.kwargs.get('max_value')
+    if min_value is not None:
+      ok &= lengths > min_value if self.kwargs.get('strict_min') else \
+        lengths >= min_value
+    if max_value is not None:
+      ok &= lengths < max_value if self.kwargs.get('strict_max') else \
+        lengths <= max_value
+    return ~ok
+
+
+EXPECTATIONS: Dict[str, Type[Expectation]] = {
+  'expect_table_row_count_to_be_between': _RowCount,
+  'expect_table_row_count_to_equal': _RowCount,
+  'expect_column_to_exist': _ColumnExists,
+  'expect_column_values_to_not_be_null': _NotNull,
+  'expect_column_values_to_be_null': _Null,
+  'expect_column_values_to_be_in_set': _InSet,
+  'expect_column_values_to_not_be_in_set': _NotInSet,
+  'expect_column_values_to_match_regex': _MatchRegex,
+  'expect_column_values_to_not_match_regex': _NotMatchRegex,
+  'expect_column_value_lengths_to_be_between': _LengthsBetween,
+  'expect_column_value_lengths_to_equal': _LengthsBetween,
+}
+
+
+# ----------------------------------------------------------------------
+# Sampling
+
+class _Reservoir:
+  """
+  A uniform sample of sample_size rows of all the chunks passed to update: it
+  gives each row a random key and keeps the rows with the smallest keys, so
+  that a chunk is sampled with a few vectorized operations rather than row by
+  row.
+  """
+
+  def __init__(self, sample_size: int, columns: List[str], seed: int = None):
+    import numpy as np
+
+    self.sample_size = sample_size
+    self.columns = columns
+    self.num_rows = 0
+    self.sample: Optional[DataFrame] = None
+    self._keys = None
+    self._rng = np.random.default_rng(seed)
+
+  def update(self, df: DataFrame):
+    import numpy as np
+    import pandas as pd
+
+    self.num_rows += len(df)
+    keys = self._rng.random(len(df))
+    df = df[[c for c in self.columns if c in df.columns]]
+    if self.sample is None:
+      self.sample, self._keys = df.iloc[:0], keys[:0]
+    elif len(self.sample) >= self.sample_size:
+      # Only the rows whose keys beat the largest kept key can get in.
+      keep = keys < self._keys.max()
+      df, keys = df[keep], keys[keep]
+    if not len(df):
+      return
+
+    sample = pd.concat([self.sample, df], ignore_index=True)
+    keys = np.concatenate([self._keys, keys])
+    if len(sample) > self.sample_size:
+      kept = np.argpartition(keys, self.sample_size)[:self.sample_size]
+      sample, keys = sample.iloc[kept].reset_index(drop=True), keys[kept]
+    self.sample, self._keys = sample, keys
+
+
+# ----------------------------------------------------------------------
+# Suites
+
+class SuiteValidator:
+
+  def __init__(self,
+               suite: dict,
+               sample_size: int = None,
+               confidence: float = DEFAULT_CONFIDENCE,
+               seed: int = None):
+    self.suite = suite
+    self.confidence = confidence
+    self.expectations: List[Expectation] = [
+      EXPECTATIONS.get(config['expectation_type'], _Unsupported)(config)
+      for config in suite.get('expectations', [])
+    ]
+    self._reservoir = _Reservoir(
+      sample_size,
+      sorted({c for e in self.expectations if isinstance(e, _ColumnMap)
+              for c in e.columns}),
+      seed) if sample_size else None
+
+  def _sampled(self, expectation: Expectation) -> bool:
+    return self._reservoir is not None and isinstance(expectation, _ColumnMap)
+
+  @property
+  def columns(self) -> List[str]:
+    """
+    The columns that the expectations look at, so that only those need to be
+    loaded.
+    """
+    columns = []
+    for expectation in self.expectations:
+      columns.extend(c for c in expectation.columns if c not in columns)
+    return columns
+
+  def update(self, df: DataFrame):
+    """
+    Adds the rows of a chunk to the expectations, or to the sample.
+    """
+    if self._reservoir:
+      self._reservoir.update(df)
+    for expectation in self.expectations:
+      if expectation.exception or self._sampled(expectation):
+        continue
+      _update(expectation, df)
+
+  def _sampled_result(self, expectation: _ColumnMap) -> dict:
+    # A new expectation each time, so that result can be called again after
+    # more chunks.
+    sampled = type(expectation)(expectation.config)
+    sample = self._reservoir.sample
+    if sample is not None:
+      _update(sampled, sample)
+    result = sampled.to_dict()
+    if sampled.exception:
+      return result
+
+    total = sampled.element_count if sampled.ABOUT_NULLS else \
+      sampled._nonmissing_count()
+    if self._reservoir.num_rows <= self._reservoir.sample_size:
+      # The sample is all the rows.
+      low = high = sampled.unexpected_count / total if total else 0.0
+    else:
+      low, high = wilson_interval(sampled.unexpected_count, total,
+                                  self.confidence)
+    result['result'].update({
+      'sampled_from': self._reservoir.num_rows,
+      'confidence': self.confidence,
+      'unexpected_percent_bounds': [low * 100, high * 100],
+    })
+    return result
+
+  def result(self) -> dict:
+    results = [
+      self._sampled_result(expectation) if self._sampled(expectation)
+      else expectation.to_dict()
+      for expectation in self.expectations
+    ]
+    successful = sum(1 for r in results if r['success'])
+    return {
+      'success': successful == len(results),
+      'results': results,
+      'statistics': {
+        'evaluated_expectations': len(results),
+        'successful_expectations': successful,
+        'unsuccessful_expectations': len(results) - successful,
+        'success_percent': _percent(successful, len(results)),
+      },
+      'evaluation_parameters': {},
+      'meta': {
+        'expectation_suite_name': self.suite.get('expectation_suite_name'),
+        'validation_time': datetime.now(timezone.utc).strftime(
+          "%Y%m%dT%H%M%S.%fZ"),
+        'engine': VALIDATION_MODE_SAMPLED if self._reservoir
+        else VALIDATION_MODE_VECTORIZED,
+        'sample_size': self._reservoir.sample_size if self._reservoir else None,
+      },
+    }
+
+
+def _update(expectation: Expectation, df: DataFrame):
+  """
+  An expectation that raises, e.g. on a column that is not there, fails with
+  its exception_info.
+  """
+  try:
+    expectation.update(df)
+  except Exception as e:
+    expectation.exception = f"{type(e).__name__}: {e}"
+
+
+def validate(df: DataFrame, suite: dict, sample_size: int = None) -> dict:
+  validator = SuiteValidator(suite, sample_size)
+  validator.update(df)
+  return validator.result()
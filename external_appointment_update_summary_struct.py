@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from marshmallow import Schema, fields, post_load
 
@@ -15,13 +15,17 @@ class ExternalAppointmentUpdateSummaryStruct:
                num_new_appointments: int = 0,
                num_existing_appointments: int = 0,
                num_dropped_appointments: int = 0,
-               details: List[str] = None) -> None:
+               details: List[str] = None,
+               error_counts: Dict[str, int] = None) -> None:
 
     self.num_valid_appointments = num_valid_appointments
     self.num_new_appointments = num_new_appointments
     self.num_existing_appointments = num_existing_appointments
     self.num_dropped_appointments = num_dropped_appointments
     self.details = details or []
+    # Number of details by etl_err code, when details only holds a sample of
+    # them - see summary_accumulator.py.
+    self.error_counts = error_counts or {}
 
 
 class ExternalAppointmentUpdateSummaryStructSchema(Schema):
@@ -30,6 +34,8 @@ class ExternalAppointmentUpdateSummaryStructSchema(Schema):
   num_existing_appointments = fields.Int()
   num_dropped_appointments = fields.Int()
   details = fields.List(fields.Str(), allow_none=True)
+  error_counts = fields.Dict(keys=fields.Str(), values=fields.Int(),
+                             allow_none=True)
 
   @post_load
   def make_external_appointment_summary_struct(self, data, *args, **kwargs):
@@ -1,20 +1,12 @@
-from prefect import Parameter, utilities
+from prefect import Parameter, utilities, unmapped
 from prefect.core.flow import Flow
-import logging
-from tasks.appointment_tasks import  build_graphs, post_graph,\
-  aggregate_summaries, extract_data_frame, extract_nodes
-from prefect.engine.results.prefect_result import PrefectResult
-from prefect.tasks.great_expectations.checkpoints import RunGreatExpectationsValidation
-from prefect.engine.signals import VALIDATIONFAIL, FAIL
-from prefect.triggers import manual_only
-from prefect.environments.execution.local import LocalEnvironment
-from prefect.run_configs.base import UniversalRun
-from prefect.environments.storage.github import GitHub
-from prefect.storage.docker import Docker
-from prefect.executors.dask import LocalDaskExecutor
+from tasks.appointment_tasks import  build_graphs, post_batch,\
+  aggregate_summaries, extract_data_frame, extract_nodes, retry_failed_posts,\
+  partition_appointments, validate_appointments, summary_ranges,\
+  merge_summaries, delete_frame, reset_profiling
+from executor_profiles import get_executor
 
 log = utilities.logging.get_logger()
-validation_task = RunGreatExpectationsValidation()
 
 with Flow("St. Lukes Appointments ETL") as flow:
   #input_file_path = Parameter("input_file_path", default="/Users/alex/development/projects/prefect_etl/St_Lukes_Sample_Appointments_20201207.txt")
@@ -22,31 +14,94 @@ with Flow("St. Lukes Appointments ETL") as flow:
 
   input_file_path = Parameter("input_file_path", default="/app/6K.csv")
   ge_ctx_root = Parameter("ge_ctx_root", default="/app/great_expectations")
+  # 'vectorized' checks the expectation suite with expectations.py, 'sampled'
+  # only checks the column expectations on validation_sample_size rows, and
+  # 'great_expectations' runs it through Great Expectations.
+  validation_mode = Parameter("validation_mode", default="vectorized")
+  validation_sample_size = Parameter("validation_sample_size", default=10000)
 
   sftp_password = Parameter('sftp_password', default=None)
   sftp_file_path = Parameter('sftp_file_path', default=None)
+  # SFTP files are downloaded here, and read from here on retries and
+  # backfills while they do not change - see sftp_mirror.py.
+  sftp_mirror_dir = Parameter('sftp_mirror_dir', default=None)
 
-  df = extract_data_frame(input_file_path, sftp_password, sftp_file_path)
-  validation_task(
-    batch_kwargs={"dataset": df, "datasource": "appts"},
-    expectation_suite_name="STLUKES_DEV_6K_APPTS.warning",
-    context_root_dir=ge_ctx_root
-                  )
-  nodes = extract_nodes(df)
+  # Failed posts are kept here and retried with backoff on the next runs, see
+  # retry_queue.py.
+  retry_queue_path = Parameter('retry_queue_path', default=None)
+
+  # Appointments that did not change since they were last posted successfully
+  # are skipped, see appointment_state_store.py. The retried posts that
+  # succeed are recorded in it too.
+  appointment_state_path = Parameter('appointment_state_path', default=None)
+
+  # The performance report only has the stages of this run, see profiling.py.
+  profiling_reset = reset_profiling()
+  retried = retry_failed_posts(retry_queue_path, appointment_state_path,
+                               upstream_tasks=[profiling_reset])
+
+  # One of common.CONTENT_ENCODINGS, used to compress the posted bodies.
+  sfe_content_encoding = Parameter('sfe_content_encoding', default=None)
+
+  # Appointments are posted in batches of this size, one task run per batch.
+  post_batch_size = Parameter('post_batch_size', default=100)
+
+  # The summaries of the batches are merged this many at a time, and the
+  # merged summaries all at once - a two-level reduction.
+  summary_fan_in = Parameter('summary_fan_in', default=32)
+
+  # The performance report of the run is written here as JSON, see
+  # profiling.py.
+  performance_report_path = Parameter('performance_report_path', default=None)
+
+  # Only a handle to the stored DataFrame is passed between tasks.
+  frame = extract_data_frame(input_file_path, sftp_password, sftp_file_path,
+                             sftp_mirror_dir, upstream_tasks=[profiling_reset])
+  validation = validate_appointments(
+    frame, ge_ctx_root, validation_mode=validation_mode,
+    validation_sample_size=validation_sample_size)
+  # The rows that are dropped as invalid are counted in the summary.
+  nodes, extract_summary = extract_nodes(frame, appointment_state_path)
   graphs = build_graphs(nodes)
-  post_summaries = post_graph.map(graphs)
-  aggregate_summaries(post_summaries)
+  batches = partition_appointments(graphs, post_batch_size)
+  post_summaries = post_batch.map(batches,
+                                  unmapped(retry_queue_path),
+                                  unmapped(sfe_content_encoding),
+                                  unmapped(appointment_state_path))
+  summary = aggregate_summaries(
+    merge_summaries.map(summary_ranges(batches, summary_fan_in),
+                        unmapped(post_summaries)),
+    performance_report_path, extract_summary)
+
+  # The frame is checkpointed, so it is only deleted once everything else
+  # succeeded: a restart of a failed run reads it back.
+  delete_frame(frame, upstream_tasks=[retried, validation, summary])
+
+  # A delete_frame that did not run does not fail the run, its state is the
+  # one of the other tasks that end the flow.
+  flow.set_reference_tasks([retried, validation, summary])
   
-#flow.run() # Debugging
-flow.run_config = UniversalRun(labels=["st_lukes"])
-#flow.storage = Docker("stellaralex", files={"/Users/alex/development/projects/prefect_etl": "modules/prefect_etl"}, env_vars={"PYTHONPATH": "$PYTHONPATH:modules/prefect_etl"},
-#                     python_dependencies=["pandas", "paramiko"])
-
-flow.storage = GitHub(
-    repo="paperstack/etl-poc",                 # name of repo
-    path="flows/appointments.py"
-)
-
-flow.executor = LocalDaskExecutor() # Runs local Dask cluster
-flow.register(project_name="PoC")
-#flow.run_agent(token="Go-8i0PtDRX-PYH24Gz92Q") # Starts an agent that connects to our cloud
+# Threads by default, see executor_profiles.py for the other profiles. The
+# executor is not stored with the flow, so it is set whenever the module loads.
+flow.executor = get_executor()
+
+# The agent loads this module to get the flow, so registering, and the storage
+# and run config that only matter when registering, only happen when the
+# module is run as a script:
+#
+#     python flows/appointments.py
+if __name__ == "__main__":
+  from prefect.run_configs.base import UniversalRun
+  from prefect.storage.github import GitHub
+
+  #flow.run() # Debugging
+  flow.run_config = UniversalRun(labels=["st_lukes"])
+  #flow.storage = Docker("stellaralex", files={"/Users/alex/development/projects/prefect_etl": "modules/prefect_etl"}, env_vars={"PYTHONPATH": "$PYTHONPATH:modules/prefect_etl"},
+  #                     python_dependencies=["pandas", "paramiko"])
+
+  flow.storage = GitHub(
+      repo="paperstack/etl-poc",                 # name of repo
+      path="flows/appointments.py"
+  )
+  flow.register(project_name="PoC")
+  #flow.run_agent(token="Go-8i0PtDRX-PYH24Gz92Q") # Starts an agent that connects to our cloud
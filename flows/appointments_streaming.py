@@ -0,0 +1,71 @@
+from prefect import Parameter, utilities
+from prefect.core.flow import Flow
+from tasks.appointment_tasks import retry_failed_posts, stream_appointments, \
+  reset_profiling
+from executor_profiles import get_executor
+
+log = utilities.logging.get_logger()
+
+# The same ETL as flows/appointments.py, but extract, validate, transform and
+# post run as one streaming pipeline with bounded queues between the stages,
+# so that memory stays flat whatever the size of the file - see streaming.py.
+with Flow("St. Lukes Appointments ETL (streaming)") as flow:
+  input_file_path = Parameter("input_file_path", default="/app/6K.csv")
+  # The chunks are checked against the expectation suite of this context as
+  # they stream, see expectations.py. None, the default, skips the check: the
+  # suite fails the task once everything was posted, and its row count is the
+  # one of the 6K file, not of the large files that this flow is for. The
+  # 'sampled' mode only checks the column expectations on
+  # validation_sample_size rows.
+  ge_ctx_root = Parameter("ge_ctx_root", default=None)
+  validation_mode = Parameter("validation_mode", default="vectorized")
+  validation_sample_size = Parameter("validation_sample_size", default=10000)
+
+  sftp_password = Parameter('sftp_password', default=None)
+  sftp_file_path = Parameter('sftp_file_path', default=None)
+
+  retry_queue_path = Parameter('retry_queue_path', default=None)
+  sfe_content_encoding = Parameter('sfe_content_encoding', default=None)
+  appointment_state_path = Parameter('appointment_state_path', default=None)
+
+  # Rows are read this many at a time, and posted in batches of
+  # post_batch_size by post_workers threads.
+  chunksize = Parameter('chunksize', default=1000)
+  post_batch_size = Parameter('post_batch_size', default=100)
+  post_workers = Parameter('post_workers', default=4)
+
+  # The performance report of the run is written here as JSON, see
+  # profiling.py.
+  performance_report_path = Parameter('performance_report_path', default=None)
+
+  # The performance report only has the stages of this run, see profiling.py.
+  retried = retry_failed_posts(retry_queue_path, appointment_state_path,
+                               upstream_tasks=[reset_profiling()])
+  stream_appointments(input_file_path,
+                      sftp_password,
+                      sftp_file_path,
+                      retry_queue_path,
+                      sfe_content_encoding,
+                      appointment_state_path,
+                      chunksize,
+                      post_batch_size,
+                      post_workers,
+                      performance_report_path=performance_report_path,
+                      ge_ctx_root=ge_ctx_root,
+                      validation_mode=validation_mode,
+                      validation_sample_size=validation_sample_size,
+                      upstream_tasks=[retried])
+
+flow.executor = get_executor()
+
+# See flows/appointments.py.
+if __name__ == "__main__":
+  from prefect.run_configs.base import UniversalRun
+  from prefect.storage.github import GitHub
+
+  flow.run_config = UniversalRun(labels=["st_lukes"])
+  flow.storage = GitHub(
+      repo="paperstack/etl-poc",
+      path="flows/appointments_streaming.py"
+  )
+  flow.register(project_name="PoC")
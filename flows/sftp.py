@@ -1,7 +1,11 @@
-from prefect import Flow, utilities
+from prefect import Flow, Parameter, unmapped, utilities
+
+from prefect.executors import LocalDaskExecutor
 
 from tasks import sftp_tasks as tasks
 
+SFTP_MAX_WORKERS = 8
+
 with Flow('SFTP') as flow:
   # TODO: Get these from Prefect context
   hostname = ''
@@ -10,19 +14,51 @@ with Flow('SFTP') as flow:
   password = ''
   path = '/home/tsxmdpyhcbwfolqu/sftp'
 
+  # Files that were already processed, and did not change since, are not
+  # queued again - see sftp_index.py.
+  index_path = Parameter('index_path', default=None)
+
   directories, files = tasks.extract_directories(
     hostname,
     port,
     username,
     password,
     path,
+    index_path,
   )
-  # TODO: process zip files
+  # Each file is matched to a mapping, downloaded and processed in its own
+  # task run. How many run at once is bounded by the executor, and the
+  # SFTP channels to the host by sftp_pool.MAX_CHANNELS.
+  download_dir = Parameter('download_dir', default=None)
+  # Downloaded files are kept here, and served from it on retries and
+  # backfills while they do not change - see sftp_mirror.py.
+  mirror_dir = Parameter('mirror_dir', default=None)
+  # Appointments that fail to post are queued here, see retry_queue.py.
+  # Without it, a file some of whose rows failed to post is processed again
+  # on the next run.
+  retry_queue_path = Parameter('retry_queue_path', default=None)
+  results = tasks.process_file.map(
+    files,
+    unmapped(hostname),
+    unmapped(port),
+    unmapped(username),
+    unmapped(password),
+    unmapped(download_dir),
+    unmapped(True),
+    unmapped(index_path),
+    unmapped(mirror_dir),
+    unmapped(retry_queue_path),
+  )
+  tasks.summarize_files(results)
+
   new, monitoring, not_monitoring = tasks.get_existing_datasets(directories)
 
   # Create a new dataset for each new directory
-  for directory in new.keys():
-    tasks.post_dataset(directory, username)
+  tasks.post_dataset.map(new, unmapped(username))
 
+# At most SFTP_MAX_WORKERS files are processed at once.
+flow.executor = LocalDaskExecutor(scheduler='threads', num_workers=SFTP_MAX_WORKERS)
 
-flow.register(project_name='SFTP')
+# See flows/appointments.py.
+if __name__ == "__main__":
+  flow.register(project_name='SFTP')
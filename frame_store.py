@@ -0,0 +1,174 @@
+"""
+A local, columnar store for the DataFrames that we pass between tasks.
+
+With checkpointing on, Prefect pickles every task result, and a DataFrame that
+is returned by a task is then handed as-is to every downstream task. Instead,
+tasks that extract DataFrames write them to this store as Parquet and return a
+small FrameHandle. Downstream tasks load the handle lazily, and only the
+columns they need:
+
+    @task(result=ParquetResult())
+    def extract_data_frame(...) -> FrameHandle:
+      return frame_store.put(df)
+
+    @task
+    def extract_nodes(frame: FrameHandle):
+      df = frame_store.load(frame, columns=mapping.columns())
+
+The flow deletes its frame once the run succeeded, so that a restart of a
+failed run can still read the checkpointed frame, and sweeps the frames that
+failed or crashed runs left behind, once they are older than max_age_seconds.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import time
+import uuid
+from typing import Any, List, Union, TYPE_CHECKING
+
+from prefect import config
+from prefect.engine.result import Result
+
+
+# pandas is imported when a frame is loaded, so that tasks modules can import
+# this module without paying for it.
+if TYPE_CHECKING:
+  import pandas as pd
+
+DEFAULT_FRAME_STORE_DIR = os.path.join(config.home_dir, "frames")
+
+# Frames older than this are left behind by runs that did not delete them.
+DEFAULT_MAX_AGE_SECONDS = 2 * 24 * 60 * 60
+
+
+class FrameHandle:
+  """
+  A reference to a DataFrame stored as Parquet. Pickles to a few hundred bytes
+  no matter how large the DataFrame is.
+  """
+  def __init__(self, path: str, columns: List[str], num_rows: int):
+    self.path = path
+    self.columns = columns
+    self.num_rows = num_rows
+
+  def __len__(self):
+    return self.num_rows
+
+  def __repr__(self):
+    return f"FrameHandle({self.path!r}, rows={self.num_rows})"
+
+  def load(self, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the DataFrame back, with only the columns passed in if any.
+    """
+    import pandas as pd
+    return pd.read_parquet(self.path, columns=columns)
+
+  def delete(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+
+def put(df: pd.DataFrame, directory: str = None) -> FrameHandle:
+  """
+  Writes the DataFrame to the store and returns its handle.
+  """
+  directory = os.path.abspath(os.path.expanduser(directory or DEFAULT_FRAME_STORE_DIR))
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, f"frame-{uuid.uuid4().hex}.parquet")
+
+  # The index of the frames we read from CSVs is a meaningless range index, so
+  # we don't spend time and space storing it.
+  df.to_parquet(path, index=False)
+  return FrameHandle(path, list(df.columns), len(df))
+
+
+def sweep(max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+          directory: str = None) -> int:
+  """
+  Deletes the frames of the store that were written more than max_age_seconds
+  ago, and returns how many were deleted.
+  """
+  directory = os.path.abspath(os.path.expanduser(directory or DEFAULT_FRAME_STORE_DIR))
+  if not os.path.isdir(directory):
+    return 0
+
+  deleted = 0
+  cutoff = time.time() - max_age_seconds
+  for entry in os.scandir(directory):
+    if not (entry.name.startswith("frame-") and entry.name.endswith(".parquet")):
+      continue
+    try:
+      if entry.stat().st_mtime < cutoff:
+        os.remove(entry.path)
+        deleted += 1
+    except FileNotFoundError:
+      pass
+  return deleted
+
+
+def load(frame: Union[pd.DataFrame, FrameHandle],
+         columns: List[str] = None) -> pd.DataFrame:
+  """
+  Returns the DataFrame for a handle, or the DataFrame itself if that's what
+  was passed in - so that tasks work both with and without the store.
+  """
+  if isinstance(frame, FrameHandle):
+    return frame.load(columns)
+
+  return frame[columns] if columns else frame
+
+
+class ParquetResult(Result):
+  """
+  A Prefect Result for tasks that return DataFrames or FrameHandles.
+
+  DataFrames are written to the frame store in dir, and FrameHandles that are
+  stored elsewhere are moved there. In both cases the checkpointed location is
+  the Parquet file, and reading the result back gives a FrameHandle, without
+  loading the DataFrame.
+  """
+
+  def __init__(self, dir: str = None, **kwargs: Any):
+    self.dir = os.path.abspath(os.path.expanduser(dir or DEFAULT_FRAME_STORE_DIR))
+    super().__init__(**kwargs)
+
+  def read(self, location: str) -> Result:
+    new = self.copy()
+    new.location = location
+    new.value = _handle_for_path(location)
+    return new
+
+  def write(self, value_: Any, **kwargs: Any) -> Result:
+    if isinstance(value_, FrameHandle):
+      handle = _move(value_, self.dir)
+    else:
+      handle = put(value_, self.dir)
+
+    new = self.copy()
+    new.value = handle
+    new.location = handle.path
+    return new
+
+  def exists(self, location: str, **kwargs: Any) -> bool:
+    return os.path.exists(location.format(**kwargs))
+
+
+def _move(handle: FrameHandle, directory: str) -> FrameHandle:
+  if os.path.dirname(os.path.abspath(handle.path)) == directory:
+    return handle
+
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, os.path.basename(handle.path))
+  shutil.move(handle.path, path)
+  return FrameHandle(path, handle.columns, handle.num_rows)
+
+
+def _handle_for_path(path: str) -> FrameHandle:
+  # Reading the Parquet footer gives us the columns and rows without reading
+  # any of the data.
+  import pyarrow.parquet as pq
+  metadata = pq.read_metadata(path)
+  return FrameHandle(path, list(metadata.schema.names), metadata.num_rows)
+
@@ -1,4 +1,4 @@
-from typing import List, Set, DefaultDict
+from typing import Dict, List, Set, DefaultDict
 from datetime import datetime
 from collections import defaultdict
 
@@ -39,7 +39,9 @@ class PatientUpdateSummaryStruct:
       num_claims_with_new_diagnoses: int = 0,
       num_claims_with_new_drug_fills: int = 0,
       details: List[str] = None,
+      error_counts: Dict[str, int] = None,
       network_changes: List[StellarNetworkChangeStruct] = None,
+      num_network_changes: int = 0,
       all_member_numbers: List[str] = None,
       attributed_to_provider_member_numbers: List[str] = None,
       attributed_to_medical_group_member_numbers: List[str] = None,
@@ -90,7 +92,14 @@ class PatientUpdateSummaryStruct:
     # and this will hold a list of details that would capture those changes.
     self.details = details or []
 
+    # Number of details by etl_err code, when details only holds a sample of
+    # them - see summary_accumulator.py.
+    self.error_counts = error_counts or {}
+
+    # Only a sample of the network changes when the summary was merged by a
+    # PatientSummaryAccumulator, num_network_changes has their number.
     self.network_changes = network_changes or []
+    self.num_network_changes = num_network_changes or len(self.network_changes)
 
     self.all_member_numbers = all_member_numbers or []
     self.attributed_to_provider_member_numbers = attributed_to_provider_member_numbers or []
@@ -146,12 +155,17 @@ class PatientUpdateSummaryStructSchema(Schema):
   num_claims_with_new_drug_fills = fields.Int(allow_none=True)
 
   details = fields.List(fields.Str(), allow_none=True)
+  error_counts = fields.Dict(keys=fields.Str(), values=fields.Int(),
+                             allow_none=True)
 
   network_changes = fields.Nested(StellarNetworkChangeStructSchema, many=True)
+  num_network_changes = fields.Int()
 
   # List of all member numbers (valid and invalid) seen during processing of
   # data.
   all_member_numbers = fields.List(fields.Str(), allow_none=True)
+  attributed_to_provider_member_numbers = fields.List(fields.Str(), allow_none=True)
+  attributed_to_medical_group_member_numbers = fields.List(fields.Str(), allow_none=True)
   orphaned_member_numbers = fields.List(fields.Str())
   orphaned_count = fields.Int()
 
@@ -166,5 +180,5 @@ class PatientUpdateSummaryStructSchema(Schema):
                                   allow_none=True)
 
   @post_load
-  def make_patient_update_summary_struct(self, data):
+  def make_patient_update_summary_struct(self, data, **kwargs):
     return PatientUpdateSummaryStruct(**data)
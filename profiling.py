@@ -0,0 +1,233 @@
+"""
+Per-stage profiling for our tasks, and the performance report of a run.
+
+Stages record their wall time, CPU time, rows in and out, and the peak RSS of
+the process, and the posts to the SFE record their latency in a histogram by
+path:
+
+    with profiling.stage("read_csv") as s:
+      df = common_io.read_csv_fast(...)
+      s.rows_out = len(df)
+
+    with profiling.http_request(url) as request:
+      r = requests.post(url, ...)
+      request.status = r.status_code
+
+    @profiling.profiled("build_graphs")
+    def build_graphs(nodes): ...
+
+The numbers are added up per stage name for the whole process, until
+`profiling.reset()` - the flows reset them at the start of each run. And
+`profiling.report()` returns them as a dict that is JSON serializable, so
+that the reports of different runs can be compared. aggregate_summaries
+attaches it to the result of the appointments flow.
+
+Only the stages that ran in the current process are in a report: with the
+processes or hybrid executor profiles, the stages that ran in other worker
+processes are missing. Profile with the threads profile.
+"""
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Sized
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+
+# Upper bounds of the buckets of the HTTP latency histograms, in milliseconds.
+# The last bucket has no upper bound.
+HTTP_LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def peak_rss_mb() -> float:
+  # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class StageStats:
+
+  def __init__(self, name: str):
+    self.name = name
+    self.calls = 0
+    self.wall_seconds = 0.0
+    self.cpu_seconds = 0.0
+    self.rows_in = 0
+    self.rows_out = 0
+    self.peak_rss_mb = 0.0
+
+  def to_dict(self) -> dict:
+    return {
+      'calls': self.calls,
+      'wall_seconds': round(self.wall_seconds, 6),
+      'cpu_seconds': round(self.cpu_seconds, 6),
+      'rows_in': self.rows_in,
+      'rows_out': self.rows_out,
+      'rows_per_second': round(self.rows_in / self.wall_seconds, 1)
+      if self.wall_seconds else None,
+      'peak_rss_mb': round(self.peak_rss_mb, 1),
+    }
+
+
+class HttpStats:
+
+  def __init__(self):
+    self.count = 0
+    self.total_seconds = 0.0
+    self.max_seconds = 0.0
+    self.buckets = [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1)
+    self.statuses: Dict[str, int] = {}
+
+  def to_dict(self) -> dict:
+    labels = [f"le_{b}ms" for b in HTTP_LATENCY_BUCKETS_MS] + ['inf']
+    return {
+      'count': self.count,
+      'mean_ms': round(self.total_seconds / self.count * 1000, 3)
+      if self.count else None,
+      'max_ms': round(self.max_seconds * 1000, 3),
+      'histogram': dict(zip(labels, self.buckets)),
+      'statuses': dict(self.statuses),
+    }
+
+
+class StageTimer:
+  """
+  What `stage` yields. Set rows_in / rows_out on it when they are only known
+  inside the block.
+  """
+  def __init__(self, rows_in: int = 0):
+    self.rows_in = rows_in
+    self.rows_out = 0
+
+
+class HttpTimer:
+  """
+  What `http_request` yields. Set status on it once the response is known.
+  """
+  def __init__(self):
+    self.status = 'error'
+
+
+class Profiler:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.stages: Dict[str, StageStats] = {}
+    self.http: Dict[str, HttpStats] = {}
+
+  @contextmanager
+  def stage(self, name: str, rows_in: int = 0) -> Iterator[StageTimer]:
+    timer = StageTimer(rows_in)
+    # thread_time is the CPU time of this thread only, so that stages that run
+    # at the same time on other threads are not counted in.
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+      yield timer
+    finally:
+      wall = time.perf_counter() - wall_start
+      cpu = time.thread_time() - cpu_start
+      rss = peak_rss_mb()
+      with self._lock:
+        stats = self.stages.setdefault(name, StageStats(name))
+        stats.calls += 1
+        stats.wall_seconds += wall
+        stats.cpu_seconds += cpu
+        stats.rows_in += timer.rows_in or 0
+        stats.rows_out += timer.rows_out or 0
+        stats.peak_rss_mb = max(stats.peak_rss_mb, rss)
+
+  def record_http(self, url: str, seconds: float, status):
+    path = urlparse(url).path or url
+    bucket = bisect_left(HTTP_LATENCY_BUCKETS_MS, seconds * 1000)
+    with self._lock:
+      stats = self.http.setdefault(path, HttpStats())
+      stats.count += 1
+      stats.total_seconds += seconds
+      stats.max_seconds = max(stats.max_seconds, seconds)
+      stats.buckets[bucket] += 1
+      stats.statuses[str(status)] = stats.statuses.get(str(status), 0) + 1
+
+  @contextmanager
+  def http_request(self, url: str) -> Iterator[HttpTimer]:
+    timer = HttpTimer()
+    start = time.perf_counter()
+    try:
+      yield timer
+    finally:
+      self.record_http(url, time.perf_counter() - start, timer.status)
+
+  def report(self) -> dict:
+    with self._lock:
+      return {
+        'stages': {name: s.to_dict() for name, s in self.stages.items()},
+        'http': {path: s.to_dict() for path, s in self.http.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+      }
+
+  def reset(self):
+    with self._lock:
+      self.stages.clear()
+      self.http.clear()
+
+
+# The profiler of this process.
+PROFILER = Profiler()
+
+
+def stage(name: str, rows_in: int = 0):
+  return PROFILER.stage(name, rows_in)
+
+
+def record_http(url: str, seconds: float, status):
+  PROFILER.record_http(url, seconds, status)
+
+
+def http_request(url: str):
+  return PROFILER.http_request(url)
+
+
+def report() -> dict:
+  return PROFILER.report()
+
+
+def reset():
+  PROFILER.reset()
+
+
+def _len(value) -> int:
+  return len(value) if isinstance(value, Sized) else 0
+
+
+def profiled(name: str = None) -> Callable:
+  """
+  Decorator that runs the function as a stage. rows_in is the length of the
+  first argument, and rows_out the length of what the function returns,
+  when they have one.
+  """
+  def decorator(fn):
+    stage_name = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      with stage(stage_name, rows_in=_len(args[0]) if args else 0) as timer:
+        result = fn(*args, **kwargs)
+        timer.rows_out = _len(result)
+      return result
+    return wrapper
+  return decorator
+
+
+def write_report(path: str, performance: dict, extra: Optional[dict] = None):
+  """
+  Writes a performance report as JSON, along with anything in extra (e.g. the
+  parameters of the run) to tell the runs apart.
+  """
+  with open(path, 'w') as f:
+    json.dump(dict(extra or {}, performance=performance), f, indent=2,
+              sort_keys=True)
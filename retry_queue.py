@@ -0,0 +1,353 @@
+"""
+A durable, on-disk queue for SFE posts that failed.
+
+When a post to the SFE fails we record the payload, the error and the number
+of attempts in a local SQLite database, so that the record is not lost when
+the task fails. Pending posts are retried with exponential backoff and jitter,
+and after `max_attempts` failures they are moved to the dead letter table,
+which can be drained with:
+
+    python -m retry_queue replay /path/to/retry_queue.sqlite \
+      [--appointment-state-path /path/to/appointment_state.sqlite]
+
+A post can carry the row of the appointment state store (see
+appointment_state_store.py) to record once the SFE accepted it, so that the
+next run does not post it again.
+"""
+import argparse
+import json
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import common
+
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Delays are in seconds. The delay before attempt N is base * 2^N, capped at
+# max, and then jittered so that a batch of failures does not come back to
+# the SFE all at the same time.
+DEFAULT_BASE_DELAY = 30
+DEFAULT_MAX_DELAY = 60 * 60
+
+REPLAY_BATCH_SIZE = 100
+# The SFE takes one post per request, so the posts of a replay batch are sent
+# this many at a time.
+REPLAY_WORKERS = 8
+
+
+class QueuedPost:
+  """
+  A post to the SFE that failed, as stored in the retry queue.
+  """
+  def __init__(self,
+               id: int,
+               data_set_id: int,
+               update_path: str,
+               json_data: dict,
+               commit: bool,
+               attempts: int,
+               last_error: str,
+               state: Optional[list] = None):
+    self.id = id
+    self.data_set_id = data_set_id
+    self.update_path = update_path
+    self.json_data = json_data
+    self.commit = commit
+    self.attempts = attempts
+    self.last_error = last_error
+    # The (external id, digest, last modified date) to record in the
+    # appointment state store once the post succeeds, if any.
+    self.state = state
+
+
+class RetryQueue:
+  """
+  SQLite backed queue of failed posts, with a pending and a dead letter table.
+
+  We never store the api key with the payload, only the arguments that are
+  needed to call `common.post_to_endpoint` again.
+  """
+
+  _COLUMNS = "id, data_set_id, update_path, json_data, commit_flag, " \
+             "attempts, last_error, state"
+
+  def __init__(self,
+               path: str,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+               base_delay: float = DEFAULT_BASE_DELAY,
+               max_delay: float = DEFAULT_MAX_DELAY):
+    self.path = path
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+
+    # Mapped tasks run on several threads, each of them doing short
+    # transactions, so we let SQLite wait for the lock instead of failing.
+    self._conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    for table in ["pending", "dead_letter"]:
+      self._conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          data_set_id INTEGER,
+          update_path TEXT NOT NULL,
+          json_data TEXT NOT NULL,
+          commit_flag INTEGER NOT NULL,
+          attempts INTEGER NOT NULL,
+          last_error TEXT,
+          next_attempt_at REAL NOT NULL DEFAULT 0,
+          created_at REAL NOT NULL,
+          state TEXT
+        )""")
+      # Queues created before the state column.
+      columns = [row[1] for row in
+                 self._conn.execute(f"PRAGMA table_info({table})")]
+      if "state" not in columns:
+        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN state TEXT")
+    self._conn.execute("CREATE INDEX IF NOT EXISTS pending_next_attempt "
+                       "ON pending (next_attempt_at)")
+
+  def close(self):
+    self._conn.close()
+
+  def backoff(self, attempts: int) -> float:
+    """
+    Returns the number of seconds to wait before the next attempt, for a post
+    that has already been attempted `attempts` times.
+    """
+    delay = min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+    # "Equal jitter" - we always wait at least half of the delay.
+    return delay / 2 + random.uniform(0, delay / 2)
+
+  def enqueue(self,
+              data_set_id: int,
+              update_path: str,
+              json_data: dict,
+              commit: bool,
+              error: str,
+              state: Tuple = None) -> int:
+    """
+    Records a post that failed once, and schedules its first retry. state is
+    the row of the appointment state store to record once it succeeds, see
+    appointment_state_store.state.
+    """
+    now = time.time()
+    cursor = self._conn.execute(
+      "INSERT INTO pending (data_set_id, update_path, json_data, commit_flag, "
+      "attempts, last_error, next_attempt_at, created_at, state) "
+      "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)",
+      (data_set_id, update_path,
+       json.dumps(json_data, default=common._json_default), int(commit), error,
+       now + self.backoff(1), now, json.dumps(state) if state else None))
+    return cursor.lastrowid
+
+  def due(self, limit: int = 100, now: float = None) -> List[QueuedPost]:
+    """
+    Returns the pending posts whose next attempt time has passed.
+    """
+    now = now if now is not None else time.time()
+    rows = self._conn.execute(
+      f"SELECT {self._COLUMNS} FROM pending WHERE next_attempt_at <= ? "
+      "ORDER BY next_attempt_at LIMIT ?", (now, limit)).fetchall()
+    return [_queued_post(row) for row in rows]
+
+  def dead_letters(self, limit: int = None) -> List[QueuedPost]:
+    rows = self._conn.execute(
+      f"SELECT {self._COLUMNS} FROM dead_letter ORDER BY id LIMIT ?",
+      (limit if limit is not None else -1,)).fetchall()
+    return [_queued_post(row) for row in rows]
+
+  def record_success(self, post: QueuedPost, dead_letter: bool = False):
+    self.record_successes([post], dead_letter)
+
+  def record_successes(self, posts: List[QueuedPost], dead_letter: bool = False):
+    table = "dead_letter" if dead_letter else "pending"
+    with self._transaction():
+      self._conn.executemany(f"DELETE FROM {table} WHERE id = ?",
+                             [(post.id,) for post in posts])
+
+  def record_failure(self, post: QueuedPost, error: str) -> bool:
+    """
+    Records another failed attempt for a pending post. Once the post has been
+    attempted `max_attempts` times it is moved to the dead letter table.
+
+    :return: True if the post was moved to the dead letter table.
+    """
+    attempts = post.attempts + 1
+    if attempts < self.max_attempts:
+      self._conn.execute(
+        "UPDATE pending SET attempts = ?, last_error = ?, next_attempt_at = ? "
+        "WHERE id = ?",
+        (attempts, error, time.time() + self.backoff(attempts), post.id))
+      return False
+
+    with self._transaction():
+      self._conn.execute(
+        "INSERT INTO dead_letter (data_set_id, update_path, json_data, "
+        "commit_flag, attempts, last_error, created_at, state) "
+        "SELECT data_set_id, update_path, json_data, commit_flag, ?, ?, "
+        "created_at, state FROM pending WHERE id = ?", (attempts, error, post.id))
+      self._conn.execute("DELETE FROM pending WHERE id = ?", (post.id,))
+    return True
+
+  def counts(self) -> Tuple[int, int]:
+    """
+    Returns the number of pending and dead letter posts.
+    """
+    pending = self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+    dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+    return pending, dead
+
+  def _transaction(self):
+    return _Transaction(self._conn)
+
+
+class _Transaction:
+  def __init__(self, conn: sqlite3.Connection):
+    self.conn = conn
+
+  def __enter__(self):
+    self.conn.execute("BEGIN IMMEDIATE")
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _queued_post(row) -> QueuedPost:
+  return QueuedPost(id=row[0],
+                    data_set_id=row[1],
+                    update_path=row[2],
+                    json_data=json.loads(row[3]),
+                    commit=bool(row[4]),
+                    attempts=row[5],
+                    last_error=row[6],
+                    state=json.loads(row[7]) if row[7] else None)
+
+
+# ------------------------------------------------------------------------
+# Retrying and replaying.
+
+def retry_due(
+    queue: RetryQueue,
+    limit: int = 100,
+    on_success: Callable[[List[QueuedPost]], None] = None
+) -> Tuple[int, int, int]:
+  """
+  Retries all the pending posts that are due. on_success is called with the
+  posts that succeeded, e.g. to record them in the appointment state store.
+
+  :return: A tuple with the number of posts that succeeded, failed again, and
+      that were moved to the dead letter table.
+  """
+  succeeded, failed, dead = [], 0, 0
+  for post in queue.due(limit=limit):
+    err = _post(post)
+    if not err:
+      queue.record_success(post)
+      succeeded.append(post)
+    elif queue.record_failure(post, err):
+      dead += 1
+    else:
+      failed += 1
+
+  if on_success and succeeded:
+    on_success(succeeded)
+  return len(succeeded), failed, dead
+
+
+def replay_dead_letters(
+    queue: RetryQueue,
+    batch_size: int = REPLAY_BATCH_SIZE,
+    workers: int = REPLAY_WORKERS,
+    on_success: Callable[[List[QueuedPost]], None] = None
+) -> Tuple[int, List[str]]:
+  """
+  Drains the dead letter table in batches of `batch_size`. The SFE has no bulk
+  update endpoint, so the posts of a batch are sent `workers` at a time, and
+  the ones that succeeded are removed in a single transaction per batch, and
+  passed to on_success. Posts that fail again stay in the dead letter table.
+
+  :return: The number of posts replayed successfully and the list of errors.
+  """
+  succeeded = 0
+  errors = []
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for posts in common.batch(queue.dead_letters(), batch_size):
+      replayed = []
+      for post, err in zip(posts, executor.map(_post, posts)):
+        if err:
+          errors.append(f"dead letter id={post.id} {post.update_path}: {err}")
+        else:
+          replayed.append(post)
+
+      queue.record_successes(replayed, dead_letter=True)
+      if on_success and replayed:
+        on_success(replayed)
+      succeeded += len(replayed)
+
+  return succeeded, errors
+
+
+def mark_posted(
+    appointment_state_path: str) -> Callable[[List[QueuedPost]], None]:
+  """
+  Returns an on_success for retry_due and replay_dead_letters, that records
+  the posts that carry a state in the appointment state store.
+  """
+  from appointment_state_store import AppointmentStateStore
+
+  def on_success(posts: List[QueuedPost]):
+    states = [post.state for post in posts if post.state]
+    if not states:
+      return
+    store = AppointmentStateStore(appointment_state_path)
+    store.mark_states(states)
+    store.close()
+  return on_success
+
+
+def _post(post: QueuedPost) -> Optional[str]:
+  # We only care about whether the SFE accepted the post, so we do not need to
+  # deserialize the summary here.
+  _, errors = common.post_to_endpoint(post.data_set_id,
+                                      post.json_data,
+                                      post.update_path,
+                                      commit=post.commit)
+  return "; ".join(str(e) for e in errors) if errors else None
+
+
+def main(argv: List[str] = None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("command", choices=["retry", "replay", "status"])
+  parser.add_argument("path", help="Path to the retry queue SQLite file")
+  parser.add_argument("--batch-size", type=int, default=REPLAY_BATCH_SIZE)
+  parser.add_argument("--workers", type=int, default=REPLAY_WORKERS)
+  parser.add_argument("--appointment-state-path",
+                      help="Records the posts that succeed in this "
+                           "appointment state store")
+  args = parser.parse_args(argv)
+
+  queue = RetryQueue(args.path)
+  on_success = mark_posted(args.appointment_state_path) \
+    if args.appointment_state_path else None
+  if args.command == "retry":
+    succeeded, failed, dead = retry_due(queue, on_success=on_success)
+    print(f"succeeded={succeeded} failed={failed} dead_lettered={dead}")
+  elif args.command == "replay":
+    succeeded, errors = replay_dead_letters(queue, args.batch_size,
+                                            args.workers, on_success)
+    for err in errors:
+      print(err)
+    print(f"replayed={succeeded} failed={len(errors)}")
+  pending, dead = queue.counts()
+  print(f"pending={pending} dead_letter={dead}")
+  queue.close()
+
+
+if __name__ == "__main__":
+  main()
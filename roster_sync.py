@@ -0,0 +1,325 @@
+"""
+Diff based roster uploads.
+
+Setting the roster of a plan used to mean posting every member number of the
+plan in one JSON array. Here we keep the last roster that the SFE accepted for
+each plan (and medical group) in a local SQLite store, compute the member
+numbers that were added and removed since then, and only upload that diff, in
+size-bounded chunks. The progress of an upload is stored after each chunk, so
+an upload that failed half way resumes from the first chunk that was not
+accepted.
+
+The first upload for a plan has nothing to diff against, so it sets the whole
+roster, the same way we always did.
+
+The diffs go to <roster url>/diff, which the SFE has to provide: it takes the
+added_member_numbers or removed_member_numbers of a chunk, along with chunk
+and num_chunks, and answers like the roster endpoint. Until it does, the
+diff endpoint answers 404, and we fall back to setting the whole roster. The
+first 404 is remembered for the rest of the process, so later uploads to the
+same SFE go straight to setting the whole roster.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import common
+
+
+# Roughly the largest body we want to post in one request, in bytes.
+DEFAULT_MAX_CHUNK_BYTES = 256 * 1024
+
+ADD = 'add'
+REMOVE = 'remove'
+
+# The SFE urls that answered 404 on a diff endpoint, in this process.
+_NO_DIFF_ENDPOINT = set()
+
+
+def roster_url(plan_id: int, medical_group_id: Optional[int]) -> str:
+  """
+  Returns the url that sets the roster of a plan, restricted to a medical group
+  if there is one. Diffs are posted to the same url + '/diff'.
+  """
+  if medical_group_id:
+    return f"{common.SFE_URL}/api/medical_group/{medical_group_id}/plan/{plan_id}/roster"
+  return f"{common.SFE_URL}/api/plan/{plan_id}/roster"
+
+
+def sorted_difference(previous: List[str],
+                      current: List[str]) -> Tuple[List[str], List[str]]:
+  """
+  Walks two sorted lists of unique member numbers once, and returns the ones
+  that were added (only in current) and removed (only in previous).
+  """
+  added, removed = [], []
+  i, j = 0, 0
+  while i < len(previous) and j < len(current):
+    if previous[i] == current[j]:
+      i += 1
+      j += 1
+    elif previous[i] < current[j]:
+      removed.append(previous[i])
+      i += 1
+    else:
+      added.append(current[j])
+      j += 1
+
+  removed.extend(previous[i:])
+  added.extend(current[j:])
+  return added, removed
+
+
+def chunk_diff(added: List[str],
+               removed: List[str],
+               max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES) -> List[Tuple[str, List[str]]]:
+  """
+  Splits the diff into (operation, member_numbers) chunks, each of which
+  encodes to roughly at most max_chunk_bytes of JSON.
+  """
+  chunks = []
+  for operation, member_numbers in [(ADD, added), (REMOVE, removed)]:
+    chunk, chunk_bytes = [], 0
+    for member_number in member_numbers:
+      # The quotes and the comma around each member number.
+      size = len(member_number.encode('utf-8')) + 3
+      if chunk and chunk_bytes + size > max_chunk_bytes:
+        chunks.append((operation, chunk))
+        chunk, chunk_bytes = [], 0
+      chunk.append(member_number)
+      chunk_bytes += size
+    if chunk:
+      chunks.append((operation, chunk))
+
+  return chunks
+
+
+def _roster_digest(member_numbers: List[str]) -> str:
+  h = hashlib.blake2b(digest_size=16)
+  for member_number in member_numbers:
+    h.update(member_number.encode('utf-8') + b'\n')
+  return h.hexdigest()
+
+
+class RosterStore:
+  """
+  The last roster that the SFE accepted for each (plan, medical group), and the
+  progress of the diff upload that is currently under way, if any.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS roster_member (
+        plan_id INTEGER NOT NULL,
+        medical_group_id INTEGER NOT NULL,
+        member_number TEXT NOT NULL,
+        PRIMARY KEY (plan_id, medical_group_id, member_number)
+      )""")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS roster_sync (
+        plan_id INTEGER NOT NULL,
+        medical_group_id INTEGER NOT NULL,
+        synced_at REAL,
+        pending_digest TEXT,
+        pending_chunks TEXT,
+        next_chunk INTEGER,
+        pending_orphaned TEXT,
+        PRIMARY KEY (plan_id, medical_group_id)
+      )""")
+
+  def close(self):
+    self._conn.close()
+
+  def has_roster(self, plan_id: int, medical_group_id: Optional[int]) -> bool:
+    row = self._conn.execute(
+      "SELECT synced_at FROM roster_sync WHERE plan_id = ? AND medical_group_id = ?",
+      (plan_id, medical_group_id or 0)).fetchone()
+    return bool(row and row[0])
+
+  def roster(self, plan_id: int, medical_group_id: Optional[int]) -> List[str]:
+    """
+    Returns the sorted member numbers of the last roster the SFE accepted.
+    """
+    return [row[0] for row in self._conn.execute(
+      "SELECT member_number FROM roster_member "
+      "WHERE plan_id = ? AND medical_group_id = ? ORDER BY member_number",
+      (plan_id, medical_group_id or 0))]
+
+  def pending_upload(
+      self,
+      plan_id: int,
+      medical_group_id: Optional[int],
+      digest: str
+  ) -> Optional[Tuple[List[Tuple[str, List[str]]], int, List[str]]]:
+    """
+    Returns the chunks, the index of the next chunk to upload and the member
+    numbers orphaned so far, if an upload of the roster with this digest was
+    started but did not finish.
+    """
+    row = self._conn.execute(
+      "SELECT pending_digest, pending_chunks, next_chunk, pending_orphaned "
+      "FROM roster_sync WHERE plan_id = ? AND medical_group_id = ?",
+      (plan_id, medical_group_id or 0)).fetchone()
+    if not row or row[0] != digest:
+      return None
+
+    chunks = [(operation, member_numbers)
+              for operation, member_numbers in json.loads(row[1])]
+    return chunks, row[2], json.loads(row[3] or '[]')
+
+  def start_upload(self,
+                   plan_id: int,
+                   medical_group_id: Optional[int],
+                   digest: str,
+                   chunks: List[Tuple[str, List[str]]]):
+    self._conn.execute(
+      "INSERT INTO roster_sync (plan_id, medical_group_id, pending_digest, "
+      "pending_chunks, next_chunk, pending_orphaned) VALUES (?, ?, ?, ?, 0, '[]') "
+      "ON CONFLICT (plan_id, medical_group_id) DO UPDATE SET "
+      "pending_digest = excluded.pending_digest, "
+      "pending_chunks = excluded.pending_chunks, next_chunk = 0, "
+      "pending_orphaned = '[]'",
+      (plan_id, medical_group_id or 0, digest, json.dumps(chunks)))
+
+  def chunk_done(self,
+                 plan_id: int,
+                 medical_group_id: Optional[int],
+                 index: int,
+                 orphaned_so_far: List[str]):
+    self._conn.execute(
+      "UPDATE roster_sync SET next_chunk = ?, pending_orphaned = ? "
+      "WHERE plan_id = ? AND medical_group_id = ?",
+      (index + 1, json.dumps(orphaned_so_far), plan_id, medical_group_id or 0))
+
+  def finish_upload(self,
+                    plan_id: int,
+                    medical_group_id: Optional[int],
+                    member_numbers: Iterable[str]):
+    """
+    Replaces the stored roster with the one that was just uploaded, and clears
+    the upload progress.
+    """
+    mg_id = medical_group_id or 0
+    self._conn.execute("BEGIN IMMEDIATE")
+    try:
+      self._conn.execute(
+        "DELETE FROM roster_member WHERE plan_id = ? AND medical_group_id = ?",
+        (plan_id, mg_id))
+      self._conn.executemany(
+        "INSERT INTO roster_member (plan_id, medical_group_id, member_number) "
+        "VALUES (?, ?, ?)",
+        ((plan_id, mg_id, member_number) for member_number in member_numbers))
+      self._conn.execute(
+        "INSERT INTO roster_sync (plan_id, medical_group_id, synced_at) "
+        "VALUES (?, ?, ?) ON CONFLICT (plan_id, medical_group_id) DO UPDATE SET "
+        "synced_at = excluded.synced_at, pending_digest = NULL, "
+        "pending_chunks = NULL, next_chunk = NULL, pending_orphaned = NULL",
+        (plan_id, mg_id, time.time()))
+    except Exception:
+      self._conn.execute("ROLLBACK")
+      raise
+    self._conn.execute("COMMIT")
+
+
+# ------------------------------------------------------------------------
+# Uploading.
+
+def sync_roster(store: Optional[RosterStore],
+                plan_id: int,
+                roster_member_numbers: Iterable[str],
+                medical_group_id: Optional[int],
+                commit: bool,
+                max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES
+) -> Tuple[Optional[List[str]], int, List[str]]:
+  """
+  Uploads the roster of a plan to the SFE, as a diff against the last roster
+  the SFE accepted when we have one.
+
+  Validation runs (commit=False) never touch the store, so that they can not
+  make the next committed upload skip member numbers.
+
+  :return: The same as common._post_roster_to_endpoint - the orphaned member
+      numbers, their count, and the list of errors.
+  """
+  current = sorted(set(roster_member_numbers))
+  url = roster_url(plan_id, medical_group_id)
+
+  if store is None or not store.has_roster(plan_id, medical_group_id) \
+      or common.SFE_URL in _NO_DIFF_ENDPOINT:
+    orphaned, count, errors, _ = _post_roster(
+      url, {'all_member_numbers': current}, commit)
+    if store is not None and commit and not errors:
+      store.finish_upload(plan_id, medical_group_id, current)
+    return orphaned, count, errors
+
+  digest = _roster_digest(current)
+  pending = store.pending_upload(plan_id, medical_group_id, digest) \
+    if commit else None
+  if pending:
+    chunks, next_chunk, all_orphaned = pending
+  else:
+    added, removed = sorted_difference(store.roster(plan_id, medical_group_id),
+                                       current)
+    chunks, next_chunk = chunk_diff(added, removed, max_chunk_bytes), 0
+    all_orphaned = []
+    if commit:
+      store.start_upload(plan_id, medical_group_id, digest, chunks)
+
+  for index in range(next_chunk, len(chunks)):
+    operation, member_numbers = chunks[index]
+    key = 'added_member_numbers' if operation == ADD else 'removed_member_numbers'
+    orphaned, count, errors, status = _post_roster(url + '/diff', {
+      key: member_numbers,
+      'chunk': index,
+      'num_chunks': len(chunks),
+    }, commit)
+    if status == 404:
+      # The SFE has no diff endpoint.
+      _NO_DIFF_ENDPOINT.add(common.SFE_URL)
+      orphaned, count, errors, _ = _post_roster(
+        url, {'all_member_numbers': current}, commit)
+      if commit and not errors:
+        store.finish_upload(plan_id, medical_group_id, current)
+      return orphaned, count, errors
+    if errors:
+      return None, 0, [f"roster chunk {index + 1}/{len(chunks)}: {e}"
+                       for e in errors]
+
+    all_orphaned += orphaned or []
+    if commit:
+      store.chunk_done(plan_id, medical_group_id, index, all_orphaned)
+
+  if commit:
+    store.finish_upload(plan_id, medical_group_id, current)
+  return all_orphaned, len(all_orphaned), []
+
+
+def _post_roster(
+    url: str,
+    json_dict: dict,
+    commit: bool
+) -> Tuple[Optional[List[str]], int, List[str], Optional[int]]:
+  """
+  :return: The orphaned member numbers, their count, the list of errors, and
+      the HTTP status of the response.
+  """
+  json_dict['commit'] = commit
+  json_dict['api_key'] = common.SFE_API_KEY
+  status, err, content = common.requests_post_with_status(url,
+                                                          json_dict=json_dict)
+  if err:
+    return None, 0, [err], status
+
+  response = json.loads(content)
+  if not response['success']:
+    return None, 0, response['errors'], status
+
+  orphaned_member_numbers = json.loads(response['orphaned_member_numbers'])
+  orphaned_count = int(response['orphaned_count'])
+  return orphaned_member_numbers, orphaned_count, [], status
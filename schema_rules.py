@@ -0,0 +1,131 @@
+"""
+Column rules derived from the marshmallow schemas of the structs, checked on
+whole chunks of rows before they become structs.
+
+The schemas only enforce their constraints when a struct is loaded, one row at
+a time, or by the SFE after the round trip of a post. The rules take the same
+constraints from the fields of the schema - required, allow_none, the max of
+validate.Length and the date types - for the fields that the mapping reads
+from a column, and check them with vectorized operations:
+
+    rules = column_rules(ExternalAppointmentStructSchema, mapping)
+    violations = rule_violations(df, rules, na_values=mapping.NA_VALUES)
+
+where violations has, for each rule that some rows break, the reason why and
+a mask of those rows.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Type, TYPE_CHECKING
+
+from marshmallow import Schema, fields, validate
+
+if TYPE_CHECKING:
+  from pandas import DataFrame, Series
+  from common_mappings import Mapping
+
+
+class ColumnRule:
+  """
+  The constraints of a schema field, on the column that the mapping reads it
+  from.
+  """
+
+  def __init__(self,
+               field_name: str,
+               column: str,
+               allow_missing: bool = True,
+               max_length: Optional[int] = None,
+               is_date: bool = False):
+    self.field_name = field_name
+    self.column = column
+    # Whether the column can be empty: the field is not required and
+    # allow_none.
+    self.allow_missing = allow_missing
+    self.max_length = max_length
+    self.is_date = is_date
+
+  def __repr__(self):
+    return f"ColumnRule({self.field_name!r}, {self.column!r}, " \
+      f"allow_missing={self.allow_missing}, max_length={self.max_length}, " \
+      f"is_date={self.is_date})"
+
+
+def _max_length(field: fields.Field) -> Optional[int]:
+  lengths = [v.max for v in field.validators
+             if isinstance(v, validate.Length) and v.max is not None]
+  return min(lengths) if lengths else None
+
+
+def column_rules(schema: Type[Schema],
+                 mapping: Mapping,
+                 exclude: Iterable[str] = ()) -> List[ColumnRule]:
+  """
+  Returns the rules of the fields of the schema that the mapping has a column
+  for, i.e. whose name is an attribute of the mapping that is set. Fields
+  whose value the mapping derives from the column rather than copies, e.g. a
+  gender, go in exclude.
+  """
+  rules = []
+  for name, field in schema._declared_fields.items():
+    column = getattr(mapping, name, None)
+    if not column or name in exclude:
+      continue
+
+    rules.append(ColumnRule(
+      name,
+      column,
+      allow_missing=not field.required and field.allow_none,
+      max_length=_max_length(field),
+      is_date=isinstance(field, (fields.Date, fields.DateTime)),
+    ))
+  return rules
+
+
+def _is_text(column: Series) -> bool:
+  import pandas as pd
+  return not (pd.api.types.is_datetime64_any_dtype(column) or
+              pd.api.types.is_numeric_dtype(column))
+
+
+def _missing(column: Series, na_values: List[str]) -> Series:
+  missing = column.isna()
+  if _is_text(column):
+    missing |= column.isin(na_values) | (column.astype(str).str.strip() == '')
+  return missing
+
+
+def rule_violations(df: DataFrame,
+                    rules: List[ColumnRule],
+                    na_values: List[str] = None) -> Dict[str, Series]:
+  """
+  Returns, for each rule that some rows break, a mask of those rows and the
+  reason why, as {reason: mask}.
+  """
+  import pandas as pd
+
+  violations = {}
+  for rule in rules:
+    column = df[rule.column]
+    missing = _missing(column, na_values or [])
+
+    if not rule.allow_missing and missing.any():
+      violations[f"{rule.column} is missing, {rule.field_name} is required"] = \
+        missing
+
+    if rule.max_length is not None and _is_text(column):
+      too_long = ~missing & (column.astype(str).str.len() > rule.max_length)
+      if too_long.any():
+        violations[f"{rule.column} is longer than {rule.max_length} characters"] = \
+          too_long
+
+    if rule.is_date and _is_text(column):
+      # Columns in parse_dates are already dates, and NaT where they did not
+      # parse, which the missing check catches.
+      not_date = ~missing & pd.to_datetime(column.where(~missing),
+                                           errors='coerce').isna()
+      if not_date.any():
+        violations[f"{rule.column} is not a date"] = not_date
+
+  return violations
+
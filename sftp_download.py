@@ -0,0 +1,176 @@
+"""
+Resumable downloads of large files from SFTP hosts, in parallel byte ranges.
+
+The file is split in parts of part_size bytes, which are downloaded at the
+same time over SFTP channels from sftp_pool.py, and written in place into
+<local_path>.part. Each part that is complete is recorded in a sidecar file,
+<local_path>.progress, with the number of bytes that were written for it and
+the size and mtime of the remote file:
+
+    sftp_download.download(hostname, port, username, password, remote_path,
+                           local_path)
+
+When the connection drops partway, the parts are retried a few times, and if
+the download still fails, the next call for the same local_path only
+downloads the parts that are missing, as long as the remote file did not
+change. The file is moved to local_path only once the bytes written for its
+parts add up to the size of the remote file, and the remote file did not
+change meanwhile.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import sftp_pool
+
+
+PART_SIZE = 32 * 1024 * 1024
+WORKERS = 4
+RETRIES = 2
+
+PART_SUFFIX = '.part'
+PROGRESS_SUFFIX = '.progress'
+
+# paramiko asks for at most this much in one SFTP read request. The requests
+# of a part are all sent at once, and written as they come back.
+_MAX_REQUEST_SIZE = 32768
+
+
+def _load_progress(progress_path: str, size: int, mtime: int,
+                   part_size: int) -> Dict[int, int]:
+  """
+  Returns {part: bytes written} for the parts that were downloaded by a
+  previous call, if it was for the same remote file and parts.
+  """
+  try:
+    with open(progress_path) as f:
+      progress = json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+  if (progress.get('size'), progress.get('mtime'),
+      progress.get('part_size')) != (size, mtime, part_size):
+    return {}
+  done = progress.get('done')
+  if not isinstance(done, dict):
+    return {}
+  return {int(part): written for part, written in done.items()}
+
+
+def _save_progress(progress_path: str, size: int, mtime: int, part_size: int,
+                   done: Dict[int, int]):
+  tmp_path = progress_path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump({'size': size, 'mtime': mtime, 'part_size': part_size,
+               'done': {str(part): written
+                        for part, written in sorted(done.items())}}, f)
+  os.replace(tmp_path, progress_path)
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> int:
+  """
+  Writes all of data at offset, and returns the number of bytes written.
+  """
+  written = 0
+  view = memoryview(data)
+  while written < len(data):
+    n = os.pwrite(fd, view[written:], offset + written)
+    if n == 0:
+      break
+    written += n
+  return written
+
+
+def _stat(hostname, port, username, password,
+          remote_path: str) -> Tuple[int, int]:
+  with sftp_pool.sftp(hostname, port, username, password) as sftp_client:
+    attrs = sftp_client.stat(remote_path)
+  return attrs.st_size, attrs.st_mtime
+
+
+def download(hostname: str,
+             port: int,
+             username: str,
+             password: str,
+             remote_path: str,
+             local_path: str,
+             size: Optional[int] = None,
+             mtime: Optional[int] = None,
+             part_size: int = PART_SIZE,
+             workers: int = WORKERS,
+             retries: int = RETRIES) -> int:
+  """
+  Downloads the remote file to local_path, resuming a previous download to
+  the same local_path, and returns its size. The size and mtime of the remote
+  file are looked up when they are not passed in.
+
+  Raises IOError if the assembled file does not have the size of the remote
+  file, or the remote file changed during the download.
+  """
+  if size is None or mtime is None:
+    size, mtime = _stat(hostname, port, username, password, remote_path)
+
+  part_path = local_path + PART_SUFFIX
+  progress_path = local_path + PROGRESS_SUFFIX
+  num_parts = max(1, -(-size // part_size))
+
+  done = _load_progress(progress_path, size, mtime, part_size)
+  if not done or not os.path.exists(part_path) or \
+      os.path.getsize(part_path) != size:
+    done = {}
+    with open(part_path, 'wb') as f:
+      f.truncate(size)
+
+  lock = threading.Lock()
+  fd = os.open(part_path, os.O_RDWR)
+
+  def fetch_part(part: int):
+    start = part * part_size
+    end = min(start + part_size, size)
+    for attempt in range(retries + 1):
+      written = 0
+      try:
+        ranges = [(offset, min(_MAX_REQUEST_SIZE, end - offset))
+                  for offset in range(start, end, _MAX_REQUEST_SIZE)]
+        with sftp_pool.sftp(hostname, port, username, password) as sftp_client, \
+            sftp_client.open(remote_path, 'rb') as f:
+          for (offset, length), data in zip(ranges, f.readv(ranges)):
+            if len(data) != length:
+              raise IOError(f"Short read of {remote_path} at {offset}: "
+                            f"{len(data)} of {length} bytes")
+            written += _pwrite_all(fd, data, offset)
+        break
+      except Exception:
+        if attempt == retries:
+          raise
+
+    with lock:
+      done[part] = written
+      # A file of one part is not worth resuming.
+      if num_parts > 1:
+        _save_progress(progress_path, size, mtime, part_size, done)
+
+  try:
+    missing = [part for part in range(num_parts) if part not in done]
+    with ThreadPoolExecutor(max_workers=min(workers, len(missing) or 1)) as executor:
+      list(executor.map(fetch_part, missing))
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+  # What was actually written for each part, not the sizes of the parts.
+  downloaded = sum(done.get(part, 0) for part in range(num_parts))
+  if downloaded != size or os.path.getsize(part_path) != size:
+    raise IOError(f"Downloaded {downloaded} bytes of {remote_path}, "
+                  f"expected {size}")
+  if _stat(hostname, port, username, password, remote_path) != (size, mtime):
+    # The parts may come from different versions of the file.
+    if os.path.exists(progress_path):
+      os.remove(progress_path)
+    raise IOError(f"{remote_path} changed during the download")
+  os.replace(part_path, local_path)
+  if os.path.exists(progress_path):
+    os.remove(progress_path)
+  return size
@@ -0,0 +1,99 @@
+"""
+A watermark index of the files that were processed from SFTP hosts.
+
+extract_directories lists every file on the host on every run. The index keeps,
+for each file that was processed, the size and mtime that `listdir_attr`
+returned for it, and optionally a hash of its content. On the next run, only
+the files that are new, or whose size or mtime changed, are queued.
+
+When a file is touched without changing (e.g. it was uploaded again), its
+mtime changes and it is downloaded again; if its content hash is the same as
+the one we processed, the processing itself is skipped.
+"""
+import hashlib
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+
+# SQLite limits the number of variables in a single statement.
+_QUERY_BATCH_SIZE = 500
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_hash(local_path: str) -> str:
+  h = hashlib.blake2b(digest_size=16)
+  with open(local_path, 'rb') as f:
+    for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+class SftpIndex:
+  """
+  SQLite backed map of (host, path) -> (size, mtime, content hash) for the
+  files that were processed.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS sftp_file (
+        host TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        content_hash TEXT,
+        processed_at REAL NOT NULL,
+        PRIMARY KEY (host, path)
+      )""")
+
+  def close(self):
+    self._conn.close()
+
+  def entries(self, host: str, paths: Iterable[str]) -> Dict[str, Tuple[int, int, Optional[str]]]:
+    """
+    Returns the (size, mtime, content hash) that we processed for each of the
+    paths passed in. Paths that were never processed are not in the result.
+    """
+    paths = list(set(paths))
+    result = {}
+    for start in range(0, len(paths), _QUERY_BATCH_SIZE):
+      batch = paths[start:start + _QUERY_BATCH_SIZE]
+      placeholders = ",".join("?" * len(batch))
+      for row in self._conn.execute(
+          "SELECT path, size, mtime, content_hash FROM sftp_file "
+          f"WHERE host = ? AND path IN ({placeholders})",
+          [host] + batch):
+        result[row[0]] = (row[1], row[2], row[3])
+    return result
+
+  def changed(self, host: str, files: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[int, int]]:
+    """
+    Takes the {path: (size, mtime)} of the files listed on the host, and
+    returns the ones that are new or changed since they were processed.
+    """
+    entries = self.entries(host, files.keys())
+    return {
+      path: attrs for path, attrs in files.items()
+      if path not in entries or entries[path][:2] != tuple(attrs)
+    }
+
+  def mark_processed(self,
+                     host: str,
+                     path: str,
+                     size: int,
+                     mtime: int,
+                     content_hash: str = None):
+    """
+    Records the file as processed. Only call this once the file was processed
+    successfully, otherwise it would be skipped on the next run.
+    """
+    self._conn.execute(
+      "INSERT OR REPLACE INTO sftp_file (host, path, size, mtime, content_hash, "
+      "processed_at) VALUES (?, ?, ?, ?, ?, ?)",
+      (host, path, size, mtime, content_hash, time.time()))
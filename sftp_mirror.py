@@ -0,0 +1,299 @@
+"""
+A local mirror of the files that were downloaded from SFTP hosts.
+
+Flow retries and backfills download the same files again. The mirror keeps the
+downloaded files in a directory, keyed by the host and remote path of the
+file, along with the size and mtime that the host reported for it and a hash
+of its content:
+
+    mirror = SftpMirror(mirror_dir)
+    local_path, checksum = mirror.fetch(sftp_client, host, remote_path)
+    mirror.close()
+
+A file whose size and mtime did not change on the host is served from the
+mirror, once its content was checked against the hash (pass verify=False to
+only check its size). When the files of the mirror add up to more than
+max_bytes, the ones that were used the longest time ago are removed.
+
+The files of the mirror are read in place: do not modify or delete them. A
+file returned by fetch is leased until the mirror is closed, and is not
+evicted or replaced while a lease on it is live, so that the tasks that share
+the mirror do not delete the files that the others are reading. Leases older
+than LEASE_SECONDS, e.g. of a process that died, are ignored.
+
+Downloads that were left behind in the directory (.tmp-* files and their
+.part and .progress files) are removed once they were not written to for
+STALE_TMP_SECONDS.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from sftp_index import content_hash
+
+if TYPE_CHECKING:
+  import paramiko
+
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+# A lease on a file of the mirror is ignored after this long.
+LEASE_SECONDS = 24 * 60 * 60
+
+# Partial downloads that were not written to for this long are removed.
+STALE_TMP_SECONDS = 6 * 60 * 60
+
+# Files that are not in the mirror are only removed this long after they were
+# written, so that a file that is being put in it is not removed.
+_ORPHAN_GRACE_SECONDS = 10 * 60
+
+_INDEX_NAME = "mirror.db"
+_TMP_PREFIX = ".tmp-"
+
+
+class SftpMirror:
+
+  def __init__(self,
+               directory: str,
+               max_bytes: int = DEFAULT_MAX_BYTES,
+               verify: bool = True):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.verify = verify
+    # For the benchmarks: how many files were served from the mirror, and
+    # how many were downloaded.
+    self.hits = 0
+    self.misses = 0
+
+    os.makedirs(directory, exist_ok=True)
+    self._conn = sqlite3.connect(os.path.join(directory, _INDEX_NAME),
+                                 timeout=60, isolation_level=None,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS mirror_file (
+        host TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        local_name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (host, path)
+      )""")
+    self._conn.execute("""
+      CREATE TABLE IF NOT EXISTS mirror_lease (
+        id INTEGER PRIMARY KEY,
+        local_name TEXT NOT NULL,
+        leased_at REAL NOT NULL
+      )""")
+    # The ids of the leases of this instance.
+    self._leases: List[int] = []
+
+  def close(self):
+    """
+    Releases the leases of this instance, and closes the index.
+    """
+    self.release()
+    self._conn.close()
+
+  def lease(self, local_name: str):
+    """
+    Pins the file of the mirror with this local name until release() or
+    close(), so that it is not evicted or replaced meanwhile.
+    """
+    cursor = self._conn.execute(
+      "INSERT INTO mirror_lease (local_name, leased_at) VALUES (?, ?)",
+      (local_name, time.time()))
+    self._leases.append(cursor.lastrowid)
+
+  def release(self):
+    """
+    Releases the leases of this instance.
+    """
+    for lease_id in self._leases:
+      self._conn.execute("DELETE FROM mirror_lease WHERE id = ?", (lease_id,))
+    self._leases = []
+
+  def _leased(self) -> Set[str]:
+    """
+    Returns the local names of the files that have a live lease.
+    """
+    return {row[0] for row in self._conn.execute(
+      "SELECT local_name FROM mirror_lease WHERE leased_at > ?",
+      (time.time() - LEASE_SECONDS,))}
+
+  def _local_path(self, local_name: str) -> str:
+    return os.path.join(self.directory, local_name)
+
+  def get(self, host: str, path: str, size: int,
+          mtime: int) -> Optional[Tuple[str, str]]:
+    """
+    Returns the (local path, checksum) of the file, if the mirror has it with
+    this size and mtime and it passes the integrity check. A file that fails
+    the check is removed from the mirror.
+    """
+    row = self._conn.execute(
+      "SELECT size, mtime, local_name, checksum FROM mirror_file "
+      "WHERE host = ? AND path = ?", (host, path)).fetchone()
+    if not row:
+      return None
+
+    local_path = self._local_path(row[2])
+    if (row[0], row[1]) != (size, mtime) or not self._intact(local_path, size,
+                                                              row[3]):
+      self._remove(host, path, row[2])
+      return None
+
+    self._conn.execute(
+      "UPDATE mirror_file SET last_used = ? WHERE host = ? AND path = ?",
+      (time.time(), host, path))
+    return local_path, row[3]
+
+  def _intact(self, local_path: str, size: int, checksum: str) -> bool:
+    try:
+      if os.path.getsize(local_path) != size:
+        return False
+    except OSError:
+      return False
+    return not self.verify or content_hash(local_path) == checksum
+
+  def put(self, host: str, path: str, size: int, mtime: int,
+          local_path: str) -> Tuple[str, str]:
+    """
+    Moves the downloaded file at local_path into the mirror, and returns its
+    (local path, checksum) in the mirror. local_path must be on the same file
+    system as the mirror, e.g. from download_path. The file is leased until
+    the mirror is closed.
+    """
+    checksum = content_hash(local_path)
+    local_name = _local_name(host, path, size, mtime)
+    self.lease(local_name)
+    os.replace(local_path, self._local_path(local_name))
+
+    old = self._conn.execute(
+      "SELECT local_name FROM mirror_file WHERE host = ? AND path = ?",
+      (host, path)).fetchone()
+    self._conn.execute(
+      "INSERT OR REPLACE INTO mirror_file (host, path, size, mtime, local_name, "
+      "checksum, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+      (host, path, size, mtime, local_name, checksum, time.time()))
+    # A leased old version is removed by the sweep once it is released.
+    if old and old[0] != local_name and old[0] not in self._leased():
+      _unlink(self._local_path(old[0]))
+
+    self.evict(keep=(host, path))
+    return self._local_path(local_name), checksum
+
+  def download_path(self, host: str, path: str, size: int, mtime: int) -> str:
+    """
+    Returns the path in the mirror directory to download a file to, before it
+    is put in the mirror. It is the same for the same version of the file, so
+    that a download that failed can be resumed.
+    """
+    return os.path.join(self.directory,
+                        _TMP_PREFIX + _local_name(host, path, size, mtime))
+
+  def fetch(self,
+            sftp_client: Optional[paramiko.SFTPClient],
+            host: str,
+            path: str,
+            attrs: paramiko.SFTPAttributes = None,
+            download: Callable[[str, str], None] = None) -> Tuple[str, str]:
+    """
+    Returns the (local path, checksum) of the remote file, from the mirror if
+    it did not change, or else downloads it into the mirror first, with
+    download(remote_path, local_path) (sftp_client.get by default).
+
+    sftp_client is only used when attrs or download are not passed in. The
+    file is leased until the mirror is closed.
+    """
+    attrs = attrs or sftp_client.stat(path)
+    # Leased first, so that the file is not evicted between the lookup and
+    # the use.
+    self.lease(_local_name(host, path, attrs.st_size, attrs.st_mtime))
+    mirrored = self.get(host, path, attrs.st_size, attrs.st_mtime)
+    if mirrored:
+      self.hits += 1
+      return mirrored
+
+    self.misses += 1
+    download_path = self.download_path(host, path, attrs.st_size, attrs.st_mtime)
+    (download or sftp_client.get)(path, download_path)
+    return self.put(host, path, attrs.st_size, attrs.st_mtime, download_path)
+
+  def total_bytes(self) -> int:
+    return self._conn.execute(
+      "SELECT COALESCE(SUM(size), 0) FROM mirror_file").fetchone()[0]
+
+  def evict(self, keep: Tuple[str, str] = None):
+    """
+    Removes the files that were used the longest time ago until the mirror is
+    within max_bytes, except for keep, a (host, path), and the leased ones.
+    Then sweeps the directory, see sweep.
+    """
+    total = self.total_bytes()
+    leased = self._leased()
+    for host, path, size, local_name in self._conn.execute(
+        "SELECT host, path, size, local_name FROM mirror_file "
+        "ORDER BY last_used").fetchall():
+      if total <= self.max_bytes:
+        break
+      if (host, path) == keep or local_name in leased:
+        continue
+      self._remove(host, path, local_name)
+      total -= size
+
+    self.sweep()
+
+  def sweep(self):
+    """
+    Removes the expired leases, the partial downloads that were not written to
+    for STALE_TMP_SECONDS, and the files that are no longer in the mirror and
+    not leased, e.g. an old version that was leased when it was replaced, once
+    they were not written to for _ORPHAN_GRACE_SECONDS.
+    """
+    now = time.time()
+    self._conn.execute("DELETE FROM mirror_lease WHERE leased_at <= ?",
+                       (now - LEASE_SECONDS,))
+    mirrored = {row[0] for row in self._conn.execute(
+      "SELECT local_name FROM mirror_file")}
+    leased = self._leased()
+
+    for entry in os.scandir(self.directory):
+      if not entry.is_file() or entry.name.startswith(_INDEX_NAME):
+        continue
+      if entry.name.startswith(_TMP_PREFIX):
+        max_age = STALE_TMP_SECONDS
+      elif entry.name not in mirrored and entry.name not in leased:
+        max_age = _ORPHAN_GRACE_SECONDS
+      else:
+        continue
+      try:
+        if now - entry.stat().st_mtime > max_age:
+          _unlink(entry.path)
+      except FileNotFoundError:
+        pass
+
+  def _remove(self, host: str, path: str, local_name: str):
+    self._conn.execute(
+      "DELETE FROM mirror_file WHERE host = ? AND path = ?", (host, path))
+    if local_name not in self._leased():
+      _unlink(self._local_path(local_name))
+
+
+def _local_name(host: str, path: str, size: int, mtime: int) -> str:
+  key = f"{host}\0{path}\0{size}\0{mtime}".encode('utf-8')
+  return hashlib.blake2b(key, digest_size=16).hexdigest() + \
+    os.path.splitext(path)[1]
+
+
+def _unlink(path: str):
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    pass
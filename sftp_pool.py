@@ -0,0 +1,228 @@
+"""
+A pool of SFTP sessions, shared by the tasks that run in the same process.
+
+Connecting to an SFTP host takes a full SSH handshake and authentication,
+which is several round trips and a key exchange. The pool keeps the
+authenticated SSH connections, keyed by (host, port, username), and the SFTP
+channels opened over them, so that the tasks that follow reuse them:
+
+    with sftp_pool.sftp(hostname, port, username, password) as sftp_client:
+      sftp_client.get(remote_path, local_path)
+
+At most max_channels SFTP channels are open at once per key - SFTP servers
+limit the number of sessions per user - and the callers wait for a free one.
+The channels are spread over SSH connections of at most channels_per_transport
+channels each, as the channels of a connection share its encryption thread.
+
+A channel that was idle for more than health_check_seconds is checked with a
+round trip before it is handed out again, and closed instead if it does not
+answer or was idle for more than max_idle_seconds.
+
+The pool is per process: with the processes executor profile, each worker
+process has its own.
+"""
+from __future__ import annotations
+
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+
+# paramiko is imported on the first connection, so that the flows import
+# quickly.
+if TYPE_CHECKING:
+  import paramiko
+
+
+MAX_CHANNELS = 8
+CHANNELS_PER_TRANSPORT = 4
+HEALTH_CHECK_SECONDS = 30
+MAX_IDLE_SECONDS = 300
+
+_Key = Tuple[str, int, str]
+
+
+class _Connection:
+  """
+  An SSH connection and the number of SFTP channels open over it.
+  """
+  def __init__(self, ssh_client: paramiko.SSHClient):
+    self.ssh_client = ssh_client
+    self.channels = 0
+
+  def is_active(self) -> bool:
+    transport = self.ssh_client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class _Channel:
+  """
+  An SFTP channel, the connection it is open over, and when it was last
+  checked in.
+  """
+  def __init__(self, sftp_client: paramiko.SFTPClient, connection: _Connection):
+    self.sftp_client = sftp_client
+    self.connection = connection
+    self.last_used = time.monotonic()
+
+  def is_open(self) -> bool:
+    return (self.connection.is_active()
+            and not self.sftp_client.get_channel().closed)
+
+
+class _HostPool:
+
+  def __init__(self, max_channels: int):
+    self.semaphore = threading.BoundedSemaphore(max_channels)
+    # Held while connecting, so that the callers that wait for it use the new
+    # connection instead of all connecting at once.
+    self.connect_lock = threading.Lock()
+    self.connections: List[_Connection] = []
+    self.idle: List[_Channel] = []
+
+
+class SftpPool:
+
+  def __init__(self,
+               max_channels: int = MAX_CHANNELS,
+               channels_per_transport: int = CHANNELS_PER_TRANSPORT,
+               health_check_seconds: float = HEALTH_CHECK_SECONDS,
+               max_idle_seconds: float = MAX_IDLE_SECONDS):
+    self.max_channels = max_channels
+    self.channels_per_transport = channels_per_transport
+    self.health_check_seconds = health_check_seconds
+    self.max_idle_seconds = max_idle_seconds
+    self._lock = threading.Lock()
+    self._hosts: Dict[_Key, _HostPool] = {}
+    # For the benchmarks: how many SSH connections and SFTP channels were
+    # opened, and how many times a channel was handed out.
+    self.connects = 0
+    self.channels_opened = 0
+    self.checkouts = 0
+
+  def _host(self, key: _Key) -> _HostPool:
+    with self._lock:
+      if key not in self._hosts:
+        self._hosts[key] = _HostPool(self.max_channels)
+      return self._hosts[key]
+
+  @contextmanager
+  def sftp(self, hostname: str, port: int, username: str,
+           password: str = None) -> Iterator[paramiko.SFTPClient]:
+    """
+    Checks out an SFTP channel to the host, waiting for a free one if
+    max_channels are in use. The channel is checked back in at the end of the
+    block, or closed if the block raised.
+    """
+    host = self._host((hostname, port, username))
+    with host.semaphore:
+      channel = self._checkout(host, hostname, port, username, password)
+      try:
+        yield channel.sftp_client
+      except BaseException:
+        self._discard(host, channel)
+        raise
+      channel.last_used = time.monotonic()
+      with self._lock:
+        host.idle.append(channel)
+
+  def _checkout(self, host: _HostPool, hostname, port, username,
+                password) -> _Channel:
+    with self._lock:
+      self.checkouts += 1
+    while True:
+      with self._lock:
+        channel = host.idle.pop() if host.idle else None
+      if channel is None:
+        break
+      if self._is_healthy(channel):
+        return channel
+      self._discard(host, channel)
+
+    connection = self._connection(host, hostname, port, username, password)
+    try:
+      sftp_client = connection.ssh_client.open_sftp()
+    except BaseException:
+      self._release(host, connection)
+      raise
+    with self._lock:
+      self.channels_opened += 1
+    return _Channel(sftp_client, connection)
+
+  def _is_healthy(self, channel: _Channel) -> bool:
+    if not channel.is_open():
+      return False
+    idle = time.monotonic() - channel.last_used
+    if idle > self.max_idle_seconds:
+      return False
+    if idle > self.health_check_seconds:
+      try:
+        channel.sftp_client.normalize('.')
+      except Exception:
+        return False
+    return True
+
+  def _connection(self, host: _HostPool, hostname, port, username,
+                  password) -> _Connection:
+    """
+    Returns a connection to the host with room for one more channel, which is
+    counted in, connecting a new one if none has room.
+    """
+    with host.connect_lock:
+      with self._lock:
+        host.connections = [c for c in host.connections
+                            if c.channels or c.is_active()]
+        for connection in host.connections:
+          if connection.channels < self.channels_per_transport and \
+              connection.is_active():
+            connection.channels += 1
+            return connection
+
+      import paramiko
+      ssh_client = paramiko.SSHClient()
+      ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+      ssh_client.connect(hostname, port, username, password)
+      connection = _Connection(ssh_client)
+      connection.channels = 1
+      with self._lock:
+        self.connects += 1
+        host.connections.append(connection)
+      return connection
+
+  def _release(self, host: _HostPool, connection: _Connection):
+    with self._lock:
+      connection.channels -= 1
+      close = connection.channels == 0 and not connection.is_active()
+      if close and connection in host.connections:
+        host.connections.remove(connection)
+    if close:
+      connection.ssh_client.close()
+
+  def _discard(self, host: _HostPool, channel: _Channel):
+    try:
+      channel.sftp_client.close()
+    except Exception:
+      pass
+    self._release(host, channel.connection)
+
+  def close(self):
+    """
+    Closes all the connections. Channels that are checked out are closed
+    under their users.
+    """
+    with self._lock:
+      hosts = list(self._hosts.values())
+      self._hosts.clear()
+    for host in hosts:
+      for connection in host.connections:
+        connection.ssh_client.close()
+
+
+# The pool of this process.
+POOL = SftpPool()
+atexit.register(POOL.close)
+
+
+def sftp(hostname: str, port: int, username: str, password: str = None):
+  return POOL.sftp(hostname, port, username, password)
@@ -0,0 +1,167 @@
+"""
+A reader of remote SFTP files that reads ahead while the file is consumed.
+
+Reading an SFTPFile as a stream (as read_csv does) asks for one block of at
+most 32KB at a time, and waits for it before asking for the next, so a large
+file takes one network round trip per 32KB. The reader has a thread that
+fetches the file in blocks of block_size, the requests of a block pipelined
+by paramiko, and keeps up to read_ahead blocks ready while the caller parses
+the ones before:
+
+    with sftp_reader.open_prefetching(sftp_client, path) as f:
+      for chunk in common_io.iter_csv_chunks(f, ...):
+        ...
+
+At most (read_ahead + 1) * block_size bytes of the file are in memory at once.
+
+The reader can seek (e.g. for zipfile to find the members of an archive),
+which starts the read ahead again from the new position.
+"""
+from __future__ import annotations
+
+import io
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+  import paramiko
+
+
+BLOCK_SIZE = 1024 * 1024
+READ_AHEAD = 4
+
+# paramiko asks for at most this much in one SFTP read request.
+_MAX_REQUEST_SIZE = 32768
+
+# How often the read ahead thread checks whether the reader was closed while
+# it waits for room in the queue.
+_POLL_SECONDS = 0.1
+
+
+class PrefetchingReader(io.RawIOBase):
+  """
+  A raw binary stream over a remote file, fed by a thread that reads ahead.
+  Wrap it in an io.BufferedReader, as open_prefetching does.
+  """
+
+  def __init__(self,
+               sftp_file: paramiko.SFTPFile,
+               size: int,
+               block_size: int = BLOCK_SIZE,
+               read_ahead: int = READ_AHEAD):
+    super().__init__()
+    self._file = sftp_file
+    self._size = size
+    self._block_size = block_size
+    self._read_ahead_blocks = read_ahead
+    self._start(0)
+
+  def _start(self, offset: int):
+    self._position = offset
+    self._blocks: queue.Queue = queue.Queue(maxsize=self._read_ahead_blocks)
+    self._block = memoryview(b'')
+    self._eof = False
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._read_ahead,
+                                    args=(offset, self._blocks, self._stopped),
+                                    daemon=True)
+    self._thread.start()
+
+  def _stop(self):
+    self._stopped.set()
+    self._thread.join()
+
+  @staticmethod
+  def _put(blocks: queue.Queue, stopped: threading.Event, item) -> bool:
+    while not stopped.is_set():
+      try:
+        blocks.put(item, timeout=_POLL_SECONDS)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _read_ahead(self, offset: int, blocks: queue.Queue,
+                  stopped: threading.Event):
+    try:
+      while offset < self._size and not stopped.is_set():
+        length = min(self._block_size, self._size - offset)
+        ranges = [(start, min(_MAX_REQUEST_SIZE, offset + length - start))
+                  for start in range(offset, offset + length, _MAX_REQUEST_SIZE)]
+        block = b''.join(self._file.readv(ranges))
+        if not block:
+          break
+        offset += len(block)
+        if not self._put(blocks, stopped, block):
+          return
+    except BaseException as e:
+      self._put(blocks, stopped, e)
+      return
+    self._put(blocks, stopped, None)
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def tell(self) -> int:
+    return self._position
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_CUR:
+      offset += self._position
+    elif whence == io.SEEK_END:
+      offset += self._size
+    offset = max(0, offset)
+    if offset != self._position:
+      self._stop()
+      self._start(offset)
+    return self._position
+
+  def readinto(self, buffer) -> int:
+    while not self._block and not self._eof:
+      item = self._blocks.get()
+      if isinstance(item, BaseException):
+        raise item
+      if item is None:
+        self._eof = True
+      else:
+        self._block = memoryview(item)
+
+    n = min(len(buffer), len(self._block))
+    buffer[:n] = self._block[:n]
+    self._block = self._block[n:]
+    self._position += n
+    return n
+
+  def close(self):
+    if not self.closed:
+      self._stop()
+      self._file.close()
+    super().close()
+
+
+@contextmanager
+def open_prefetching(sftp_client: paramiko.SFTPClient,
+                     path: str,
+                     block_size: int = BLOCK_SIZE,
+                     read_ahead: int = READ_AHEAD,
+                     size: Optional[int] = None) -> Iterator[io.BufferedReader]:
+  """
+  Opens the remote file for reading with a PrefetchingReader, buffered so that
+  it can be read by lines. The size of the file is looked up when it is not
+  passed in.
+  """
+  sftp_file = sftp_client.open(path, 'rb')
+  if size is None:
+    size = sftp_file.stat().st_size
+  reader = io.BufferedReader(
+    PrefetchingReader(sftp_file, size, block_size, read_ahead),
+    buffer_size=io.DEFAULT_BUFFER_SIZE)
+  try:
+    yield reader
+  finally:
+    reader.close()
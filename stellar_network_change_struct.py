@@ -45,5 +45,5 @@ class StellarNetworkChangeStructSchema(Schema):
   from_medical_group_name = fields.Str(required=True, allow_none=True)
 
   @post_load
-  def make_network_change_struct(self, data):
+  def make_network_change_struct(self, data, **kwargs):
     return StellarNetworkChangeStruct(**data)
@@ -1,6 +1,5 @@
 from typing import List, Optional
 
-from pandas import DataFrame
 import stlukes_constants
 from common_mappings import CommonAppointmentMapping
 
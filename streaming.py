@@ -0,0 +1,169 @@
+"""
+A single pass, bounded memory pipeline of stages connected by bounded queues.
+
+Each stage runs in its own worker thread(s), takes items from the queue before
+it and puts what it produces in the queue after it. Since the queues are
+bounded, a slow stage blocks the stages before it once its queue is full: when
+the SFE slows down, the posting stage backs up and we stop parsing the file,
+instead of reading all of it in memory. At most `maxsize` items wait between
+two stages, so the memory used depends on the chunk size and the queue sizes,
+but not on the size of the file.
+
+    summaries = streaming.pipeline(
+      common_io.iter_csv_chunks(path, columns, chunksize=1000, sep='|'),
+      [
+        Stage("transform", chunk_to_appointments),
+        Stage("post", post_appointments, workers=4),
+      ],
+      maxsize=4,
+    )
+    for summary in summaries:
+      accumulator.add(summary)
+
+A stage function takes one item and returns an iterable of the items to pass
+on (possibly none), so a stage can filter, split or transform items. The first
+error raised by a stage stops the pipeline, and is raised again by the
+iterator that `pipeline` returns.
+"""
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List
+
+
+DEFAULT_MAXSIZE = 4
+
+# Put in a queue by the last worker of a stage, once it is done.
+_DONE = object()
+
+# How often blocked workers check whether the pipeline was stopped.
+_POLL_SECONDS = 0.1
+
+
+class Stage:
+  def __init__(self,
+               name: str,
+               fn: Callable[[Any], Iterable[Any]],
+               workers: int = 1):
+    self.name = name
+    self.fn = fn
+    self.workers = workers
+
+
+class _Stopped(Exception):
+  pass
+
+
+class _Pipeline:
+
+  def __init__(self, source: Iterable[Any], stages: List[Stage], maxsize: int):
+    self.stop = threading.Event()
+    self.error = None
+    self.queues = [queue.Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+    self.threads = [threading.Thread(target=self._feed, args=(source,),
+                                     name="stream-source", daemon=True)]
+
+    for i, stage in enumerate(stages):
+      remaining = [stage.workers]
+      lock = threading.Lock()
+      for n in range(stage.workers):
+        self.threads.append(threading.Thread(
+          target=self._work,
+          args=(stage, self.queues[i], self.queues[i + 1], remaining, lock),
+          name=f"stream-{stage.name}-{n}",
+          daemon=True,
+        ))
+
+  # ----------------------------------------------------------------------
+  # Queues that give up when the pipeline is stopped.
+
+  def _put(self, q: queue.Queue, item: Any):
+    while True:
+      if self.stop.is_set():
+        raise _Stopped()
+      try:
+        q.put(item, timeout=_POLL_SECONDS)
+        return
+      except queue.Full:
+        pass
+
+  def _get(self, q: queue.Queue) -> Any:
+    while True:
+      if self.stop.is_set():
+        raise _Stopped()
+      try:
+        return q.get(timeout=_POLL_SECONDS)
+      except queue.Empty:
+        pass
+
+  def _fail(self, error: BaseException):
+    if not self.stop.is_set():
+      self.error = error
+      self.stop.set()
+
+  # ----------------------------------------------------------------------
+  # Workers
+
+  def _feed(self, source: Iterable[Any]):
+    try:
+      for item in source:
+        self._put(self.queues[0], item)
+      self._put(self.queues[0], _DONE)
+    except _Stopped:
+      pass
+    except BaseException as e:
+      self._fail(e)
+
+  def _work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue,
+            remaining: List[int], lock: threading.Lock):
+    try:
+      while True:
+        item = self._get(inbox)
+        if item is _DONE:
+          # Let the other workers of this stage see it too.
+          self._put(inbox, _DONE)
+          break
+        for result in stage.fn(item) or ():
+          self._put(outbox, result)
+
+      with lock:
+        remaining[0] -= 1
+        last = remaining[0] == 0
+      if last:
+        self._put(outbox, _DONE)
+    except _Stopped:
+      pass
+    except BaseException as e:
+      self._fail(e)
+
+  def results(self) -> Iterator[Any]:
+    for thread in self.threads:
+      thread.start()
+
+    try:
+      while True:
+        try:
+          item = self._get(self.queues[-1])
+        except _Stopped:
+          break
+        if item is _DONE:
+          break
+        yield item
+    finally:
+      # Also stops the workers if the caller stops iterating early.
+      self.stop.set()
+      for thread in self.threads:
+        thread.join()
+
+    if self.error is not None:
+      raise self.error
+
+
+def pipeline(source: Iterable[Any],
+             stages: List[Stage],
+             maxsize: int = DEFAULT_MAXSIZE) -> Iterator[Any]:
+  """
+  Runs the items of source through the stages, and returns an iterator over
+  the items that the last stage produces. Nothing runs until the iterator is
+  consumed.
+  """
+  return _Pipeline(source, stages, maxsize).results()
@@ -0,0 +1,247 @@
+"""
+Running totals for the update summaries returned by the SFE.
+
+Instead of loading every response into a full summary struct, and then walking
+the list of structs to add them up, we fold each raw `update_summary` dict into
+an accumulator as it comes in, and only materialize the final, merged summary
+through its schema.
+
+Details are kept as counts by etl_err code, plus a capped sample of the
+messages, and so are the network changes of the patient summaries.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from marshmallow import Schema
+
+import etl_err
+
+from external_appointment_update_summary_struct import \
+  ExternalAppointmentUpdateSummaryStruct, \
+  ExternalAppointmentUpdateSummaryStructSchema
+
+
+# At most this many detail messages are kept, on top of the counts of details
+# by etl_err code, so that a summary stays small whatever the number of rows.
+MAX_DETAILS_SAMPLE = 100
+
+
+class SummaryAccumulator(ABC):
+  """
+  Adds up the COUNTERS of the update summaries that are passed to `add`, and
+  counts their details by etl_err code, keeping only the first
+  max_details_sample of them. Subclasses say which counters they know about,
+  and which schema is used to materialize the merged summary.
+
+  Accumulators merge associatively, so summaries can be added up in any
+  grouping - e.g. as a tree, over the batches of a flow. `to_dict` returns a
+  summary that `add` takes back, so the partial sums can go between tasks.
+  """
+
+  COUNTERS: List[str] = []
+
+  def __init__(self, max_details_sample: int = MAX_DETAILS_SAMPLE):
+    self.max_details_sample = max_details_sample
+    self.counters: Dict[str, int] = {counter: 0 for counter in self.COUNTERS}
+    self.details: List[str] = []
+    self.error_counts: Dict[str, int] = {}
+
+  def add(self, update_summary: Optional[dict]):
+    """
+    Folds one raw update summary, as returned by the SFE, or one merged
+    summary returned by `to_dict`, into the totals.
+    """
+    if not update_summary:
+      return
+
+    for counter in self.COUNTERS:
+      self.counters[counter] += update_summary.get(counter) or 0
+
+    details = update_summary.get('details') or []
+    error_counts = update_summary.get('error_counts')
+    if error_counts is None:
+      self.add_details(details)
+    else:
+      # Already counted, and details is a sample of them.
+      for code, count in error_counts.items():
+        self.error_counts[code] = self.error_counts.get(code, 0) + count
+      self._sample(details)
+
+  def add_details(self, details: Iterable[str]):
+    details = list(details)
+    for detail in details:
+      code = etl_err.code_of(detail) or 'unknown'
+      self.error_counts[code] = self.error_counts.get(code, 0) + 1
+    self._sample(details)
+
+  def _sample(self, details: List[str]):
+    room = self.max_details_sample - len(self.details)
+    if room > 0:
+      self.details.extend(details[:room])
+
+  def merge(self, other: 'SummaryAccumulator') -> 'SummaryAccumulator':
+    """
+    Adds the totals of another accumulator to this one, and returns this one.
+    """
+    self.add(other.to_dict())
+    return self
+
+  def to_dict(self) -> dict:
+    result = dict(self.counters)
+    result['details'] = list(self.details)
+    result['error_counts'] = dict(self.error_counts)
+    return result
+
+  @abstractmethod
+  def schema(self) -> Schema:
+    """
+    Returns the schema that loads the merged summary.
+    """
+
+  def materialize(self):
+    """
+    Returns the merged summary, as the struct that the schema loads.
+    """
+    return self.schema().load(self.to_dict())
+
+
+class ExternalAppointmentSummaryAccumulator(SummaryAccumulator):
+
+  COUNTERS = [
+    'num_valid_appointments',
+    'num_new_appointments',
+    'num_existing_appointments',
+    'num_dropped_appointments',
+  ]
+
+  def schema(self) -> Schema:
+    return ExternalAppointmentUpdateSummaryStructSchema()
+
+  def materialize(self) -> ExternalAppointmentUpdateSummaryStruct:
+    return super().materialize()
+
+
+class PatientSummaryAccumulator(SummaryAccumulator):
+  """
+  On top of the counters, keeps the min / max dates of the new claims, the
+  member numbers and NPIs / TINs as sets, and adds up the per-code diagnosis
+  counts. Like the details, only the first max_details_sample network changes
+  are kept, along with their number.
+  """
+
+  COUNTERS = [
+    'num_valid_patients',
+    'num_new_patients',
+    'num_existing_patients',
+    'num_dropped_patients',
+    'num_placeholder_patients',
+    'num_attributed_to_provider_patients',
+    'num_attributed_to_medical_group_patients',
+    'num_changed_member_number',
+    'num_changed_provider',
+    'num_changed_demographics',
+    'num_changed_plan',
+    'num_new_claims',
+    'num_patients_with_new_claims',
+    'num_claims_with_new_procedures',
+    'num_claims_with_new_diagnoses',
+    'num_claims_with_new_drug_fills',
+    'orphaned_count',
+    'num_icd9_diagnoses',
+    'num_icd10_diagnoses',
+    'num_invalid_diagnoses',
+    'num_uncertain_diagnoses',
+  ]
+  MEMBER_NUMBER_SETS = [
+    'all_member_numbers',
+    'attributed_to_provider_member_numbers',
+    'attributed_to_medical_group_member_numbers',
+    'orphaned_member_numbers',
+  ]
+  CODE_COUNTS = ['invalid_diagnoses', 'uncertain_diagnoses', 'patients_per_plan']
+
+  def __init__(self, max_details_sample: int = MAX_DETAILS_SAMPLE):
+    super().__init__(max_details_sample)
+    self.new_claims_min_date: Optional[datetime] = None
+    self.new_claims_max_date: Optional[datetime] = None
+    self.new_stellar_npis: Set[str] = set()
+    self.new_stellar_tins: Set[str] = set()
+    self.member_numbers: Dict[str, Set[str]] = {
+      name: set() for name in self.MEMBER_NUMBER_SETS}
+    self.code_counts: Dict[str, Dict[str, int]] = {
+      name: {} for name in self.CODE_COUNTS}
+    self.network_changes: List[dict] = []
+    self.num_network_changes = 0
+
+  def add(self, update_summary: Optional[dict]):
+    if not update_summary:
+      return
+    super().add(update_summary)
+
+    min_date = _parse_datetime(update_summary.get('new_claims_min_date'))
+    if min_date and (not self.new_claims_min_date or
+                     min_date < self.new_claims_min_date):
+      self.new_claims_min_date = min_date
+
+    max_date = _parse_datetime(update_summary.get('new_claims_max_date'))
+    if max_date and (not self.new_claims_max_date or
+                     max_date > self.new_claims_max_date):
+      self.new_claims_max_date = max_date
+
+    self.new_stellar_npis.update(update_summary.get('new_stellar_npis') or [])
+    self.new_stellar_tins.update(update_summary.get('new_stellar_tins') or [])
+
+    for name in self.MEMBER_NUMBER_SETS:
+      self.member_numbers[name].update(update_summary.get(name) or [])
+
+    for name in self.CODE_COUNTS:
+      counts = self.code_counts[name]
+      for code, count in (update_summary.get(name) or {}).items():
+        counts[code] = counts.get(code, 0) + (count or 0)
+
+    network_changes = update_summary.get('network_changes') or []
+    # A raw summary from the SFE has all its changes, a merged one only a
+    # sample of them and their number.
+    self.num_network_changes += update_summary.get('num_network_changes') \
+      or len(network_changes)
+    room = self.max_details_sample - len(self.network_changes)
+    if room > 0:
+      self.network_changes.extend(network_changes[:room])
+
+  def to_dict(self) -> dict:
+    result = super().to_dict()
+    result['new_claims_min_date'] = _format_datetime(self.new_claims_min_date)
+    result['new_claims_max_date'] = _format_datetime(self.new_claims_max_date)
+    result['new_stellar_npis'] = sorted(self.new_stellar_npis)
+    result['new_stellar_tins'] = sorted(self.new_stellar_tins)
+    for name in self.MEMBER_NUMBER_SETS:
+      result[name] = sorted(self.member_numbers[name])
+    for name in self.CODE_COUNTS:
+      result[name] = dict(self.code_counts[name])
+    result['network_changes'] = list(self.network_changes)
+    result['num_network_changes'] = self.num_network_changes
+    return result
+
+  def schema(self) -> Schema:
+    # The patient summary structs pull in structlog through the network change
+    # struct, which the appointments flow does not need to have installed.
+    from patient_update_summary_struct import PatientUpdateSummaryStructSchema
+    return PatientUpdateSummaryStructSchema()
+
+  def materialize(self) -> 'PatientUpdateSummaryStruct':
+    return super().materialize()
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+  if not value:
+    return None
+  if isinstance(value, datetime):
+    return value
+
+  # The SFE dumps these with marshmallow's DateTime field, which is ISO 8601.
+  return datetime.fromisoformat(value)
+
+
+def _format_datetime(value: Optional[datetime]) -> Optional[str]:
+  return value.isoformat() if value else None
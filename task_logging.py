@@ -0,0 +1,207 @@
+"""
+A logging facade for tasks that process one row at a time.
+
+Logging a line per row is expensive once Prefect ships the logs to its backend,
+and it ends up writing patient names to the logs. TaskLogger wraps the task
+logger and:
+
++ rate limits each message template, and samples the ones that we only need
+  to see a few of,
++ never writes the values passed as `phi` when in PHI-safe mode (the default),
++ aggregates row and error counts into periodic progress lines, with errors
+  counted by their etl_err code.
+
+    log = TaskLogger("post_batch")
+    log.info("Got appt for {first_name}", phi={'first_name': node.first_name})
+    log.progress(rows=1, details=summary['details'])
+    log.flush()
+
+The budgets of the message templates, and the interval of the progress lines,
+are shared by all the TaskLoggers with the same name in a flow run, so that
+the mapped runs of a task write no more lines together than one of them
+would.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+import prefect
+
+import etl_err
+
+
+# When True, values passed as `phi` are never written to the logs.
+PHI_SAFE = True
+
+REDACTED = '[redacted]'
+
+# At most this many lines per message template per interval.
+DEFAULT_MAX_PER_INTERVAL = 5
+DEFAULT_INTERVAL_SECONDS = 60.0
+
+# Progress lines are written at most this often.
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 10.0
+
+
+# The rate limits of this many (flow run, name) pairs are kept, the ones used
+# the longest time ago are dropped.
+MAX_SHARED_LIMITS = 256
+
+
+class _TemplateBudget:
+  def __init__(self):
+    self.window_start = 0.0
+    self.emitted = 0
+    self.suppressed = 0
+
+
+class _RateLimit:
+  """
+  The state that the TaskLoggers of a name share within a flow run.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.budgets: Dict[str, _TemplateBudget] = defaultdict(_TemplateBudget)
+    self.last_progress_at = time.monotonic()
+
+
+_rate_limits: 'OrderedDict[Tuple[Optional[str], str], _RateLimit]' = OrderedDict()
+_rate_limits_lock = threading.Lock()
+
+
+def _shared_rate_limit(name: str) -> _RateLimit:
+  key = (prefect.context.get("flow_run_id"), name)
+  with _rate_limits_lock:
+    rate_limit = _rate_limits.get(key)
+    if rate_limit is None:
+      rate_limit = _rate_limits[key] = _RateLimit()
+      while len(_rate_limits) > MAX_SHARED_LIMITS:
+        _rate_limits.popitem(last=False)
+    else:
+      _rate_limits.move_to_end(key)
+    return rate_limit
+
+
+class TaskLogger:
+
+  def __init__(self,
+               name: str,
+               logger: logging.Logger = None,
+               phi_safe: bool = None,
+               sample_rate: float = 1.0,
+               max_per_interval: int = DEFAULT_MAX_PER_INTERVAL,
+               interval_seconds: float = DEFAULT_INTERVAL_SECONDS,
+               progress_interval_seconds: float = DEFAULT_PROGRESS_INTERVAL_SECONDS):
+    self.name = name
+    self.logger = logger or prefect.context.get("logger") or \
+      prefect.utilities.logging.get_logger(name)
+    self.phi_safe = PHI_SAFE if phi_safe is None else phi_safe
+    self.sample_rate = sample_rate
+    self.max_per_interval = max_per_interval
+    self.interval_seconds = interval_seconds
+    self.progress_interval_seconds = progress_interval_seconds
+
+    self._lock = threading.Lock()
+    self._rate_limit = _shared_rate_limit(name)
+
+    self._started_at = time.monotonic()
+    self.rows = 0
+    self.errors_by_code: Dict[str, int] = defaultdict(int)
+
+  # ----------------------------------------------------------------------
+  # Messages
+
+  def debug(self, template: str, phi: dict = None, **fields):
+    self._log(logging.DEBUG, template, phi, fields, sample=True)
+
+  def info(self, template: str, phi: dict = None, **fields):
+    self._log(logging.INFO, template, phi, fields, sample=True)
+
+  def warning(self, template: str, phi: dict = None, **fields):
+    self._log(logging.WARNING, template, phi, fields, sample=False)
+
+  def error(self, template: str, phi: dict = None, **fields):
+    self._log(logging.ERROR, template, phi, fields, sample=False)
+
+  def _log(self, level: int, template: str, phi: Optional[dict], fields: dict,
+           sample: bool):
+    if not self.logger.isEnabledFor(level):
+      return
+    # Warnings and errors are never sampled, only rate limited.
+    if sample and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+      return
+
+    suppressed = self._take_budget(template)
+    if suppressed is None:
+      return
+
+    values = dict(fields)
+    for key, value in (phi or {}).items():
+      values[key] = REDACTED if self.phi_safe else value
+
+    message = template.format(**values)
+    if suppressed:
+      message += f" ({suppressed} similar messages suppressed)"
+    self.logger.log(level, message)
+
+  def _take_budget(self, template: str) -> Optional[int]:
+    """
+    Returns None if the template is over its budget for the current interval,
+    and otherwise the number of its messages that were suppressed since the
+    last one that was written.
+    """
+    now = time.monotonic()
+    with self._rate_limit.lock:
+      budget = self._rate_limit.budgets[template]
+      if now - budget.window_start >= self.interval_seconds:
+        budget.window_start = now
+        budget.emitted = 0
+
+      if budget.emitted >= self.max_per_interval:
+        budget.suppressed += 1
+        return None
+
+      budget.emitted += 1
+      suppressed, budget.suppressed = budget.suppressed, 0
+      return suppressed
+
+  # ----------------------------------------------------------------------
+  # Progress
+
+  def progress(self, rows: int = 0, details: Iterable[str] = None):
+    """
+    Counts rows that were processed, and the errors in their etl_err details,
+    and writes an aggregated progress line if the progress interval passed.
+    """
+    with self._lock:
+      self.rows += rows
+      for detail in details or []:
+        self.errors_by_code[etl_err.code_of(detail) or 'unknown'] += 1
+
+    now = time.monotonic()
+    with self._rate_limit.lock:
+      if now - self._rate_limit.last_progress_at < self.progress_interval_seconds:
+        return
+      self._rate_limit.last_progress_at = now
+
+    self._write_progress()
+
+  def flush(self):
+    """
+    Writes the final progress line. Call this at the end of the task.
+    """
+    self._write_progress(final=True)
+
+  def _write_progress(self, final: bool = False):
+    with self._lock:
+      elapsed = max(time.monotonic() - self._started_at, 1e-9)
+      errors = ", ".join(f"{code}={count}" for code, count
+                         in sorted(self.errors_by_code.items())) or "none"
+      rows = self.rows
+
+    prefix = "Done" if final else "Progress"
+    self.logger.info(f"{prefix} {self.name}: rows={rows} "
+                     f"rows/s={rows / elapsed:.1f} errors: {errors}")
@@ -1,48 +1,121 @@
-import paramiko
+from __future__ import annotations
+
 from prefect import task, context
-from typing import List, Dict
+from typing import BinaryIO, ContextManager, Iterable, Iterator, List, Dict, \
+  Optional, Tuple, TYPE_CHECKING
+import threading
 import prefect
 from prefect.engine import signals
 
 from external_appointment_struct import ExternalAppointmentStruct
 from prefect.engine.results.prefect_result import PrefectResult
 from stlukes_mappings import StLukesEtlAppointmentMapping
-import common_io
 from stlukes_constants import APPOINTMENTS_XWALK
-import requests
 from external_appointment_update_summary_struct import ExternalAppointmentUpdateSummaryStruct,\
   ExternalAppointmentUpdateSummaryStructSchema
 from external_appointment_struct import ExternalAppointmentStructSchema
 import common
+import etl_err
 import json
+from retry_queue import RetryQueue
+import appointment_state_store
+from appointment_state_store import AppointmentStateStore
+from summary_accumulator import ExternalAppointmentSummaryAccumulator, \
+  MAX_DETAILS_SAMPLE
+from task_logging import TaskLogger
+from executor_profiles import CPU_BOUND, IO_BOUND
+import retry_queue
 from prefect.triggers import manual_only
-from pandas.core.frame import DataFrame
+import frame_store
+from frame_store import FrameHandle, ParquetResult
+import streaming
+import profiling
+import expectations
+import schema_rules
+import sftp_download
+import sftp_pool
+import sftp_reader
+from sftp_mirror import SftpMirror
+from streaming import Stage
 
+# pandas, paramiko and Great Expectations are imported by the tasks that use
+# them, so that the flows import quickly - see benchmarks/import_time.py.
+if TYPE_CHECKING:
+  import paramiko
+  from pandas import DataFrame
 
-@task
+
+SFTP_HOSTNAME = 'elb-shared-us-east-1-doit-13794.aptible.in'
+SFTP_PORT = 22
+SFTP_USERNAME = 'aptible'
+
+# Where each row of the appointments comes from: the name of the member of the
+# file (see common_io.iter_members), and the row in that member, counting
+# from 1 after the header. Only used in the details of the dropped rows.
+SOURCE_MEMBER_COLUMN = '_source_member'
+SOURCE_ROW_COLUMN = '_source_row'
+SOURCE_COLUMNS = [SOURCE_MEMBER_COLUMN, SOURCE_ROW_COLUMN]
+
+
+def _open_sftp(sftp_password: str) -> ContextManager[paramiko.SFTPClient]:
+  return sftp_pool.sftp(
+    hostname=SFTP_HOSTNAME,
+    port=SFTP_PORT,
+    username=SFTP_USERNAME,
+    password=sftp_password,
+  )
+
+
+def _appointment_members(file, mapping,
+                         logger) -> Iterator[Tuple[str, BinaryIO]]:
+  """
+  Yields the (name, stream) of the members of the file (see
+  common_io.iter_members) whose header has the columns of the mapping, and
+  logs the ones that are skipped.
+  """
+  import common_io
+  for name, member in common_io.iter_members(file):
+    if mapping.matches_header(common_io.read_header(member)):
+      yield name, member
+    else:
+      logger.warning(f"Skipping {name}, it is not an appointments file")
+
+
+def _with_source(df: DataFrame, member_name: str) -> DataFrame:
+  # The readers number the rows of a member from 0, across chunks.
+  df[SOURCE_MEMBER_COLUMN] = member_name
+  df[SOURCE_ROW_COLUMN] = df.index + 1
+  return df
+
+
+@task(result=ParquetResult(), tags=[IO_BOUND])
 def extract_data_frame(
         input_file_path: str,
         sftp_password,
         sftp_file_path,
-) -> DataFrame:
+        sftp_mirror_dir: str = None,
+) -> FrameHandle:
+  """
+  Reads the appointments file into the frame store, and returns the handle of
+  the stored DataFrame - see frame_store.py.
+
+  A zip, gzip or bz2 file is decompressed as it is read, and the appointments
+  of all of its members are read - see common_io.iter_members.
+
+  With an sftp_mirror_dir, the SFTP file is downloaded into the mirror and
+  read from there, or read from there right away if it did not change since
+  it was downloaded - see sftp_mirror.py.
+  """
+  import common_io
+  import pandas as pd
   logger = prefect.context.get("logger")
   logger.info("extracting nodes")
   mapping = StLukesEtlAppointmentMapping()
 
-  if sftp_file_path:
-    logger.info(f'Reading file from SFTP: {sftp_file_path}')
-    ssh_client = paramiko.SSHClient()
-    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh_client.connect(
-      hostname='elb-shared-us-east-1-doit-13794.aptible.in',
-      port=22,
-      username='aptible',
-      password=sftp_password,
-    )
-    sftp_client = ssh_client.open_sftp()
-    with sftp_client.file(sftp_file_path) as f:
-      df = common_io.read_csv_fast(
-        f,
+  def read(file) -> DataFrame:
+    dfs = [
+      _with_source(common_io.read_csv_fast(
+        member,
         columns=mapping.columns(),
         sep='|',
         parse_dates=[
@@ -51,29 +124,229 @@ def extract_data_frame(
           mapping.external_created_date,
           mapping.external_last_modified_date,
         ],
-      )
-  else:
-    logger.info(f'Reading file from local file system: {input_file_path}')
-    df = common_io.read_csv_fast(
-      input_file_path,
-      columns=mapping.columns(),
-      sep='|',
-      parse_dates=[
-        mapping.appointment_date,
-        mapping.date_of_birth,
-        mapping.external_created_date,
-        mapping.external_last_modified_date,
-      ],
-    )
+      ), name)
+      for name, member in _appointment_members(file, mapping, logger)
+    ]
+    if not dfs:
+      raise ValueError(f"No appointments file in {sftp_file_path or input_file_path}")
+    return dfs[0] if len(dfs) == 1 else pd.concat(dfs, ignore_index=True)
 
-  return df
+  with profiling.stage("read_csv") as timer:
+    if sftp_file_path and sftp_mirror_dir:
+      logger.info(f'Reading file from SFTP mirror: {sftp_file_path}')
+      with _open_sftp(sftp_password) as sftp_client:
+        attrs = sftp_client.stat(sftp_file_path)
+
+      def download(remote: str, local: str):
+        sftp_download.download(SFTP_HOSTNAME, SFTP_PORT, SFTP_USERNAME,
+                               sftp_password, remote, local, attrs.st_size,
+                               attrs.st_mtime)
+
+      # The file is leased until the mirror is closed, see sftp_mirror.py.
+      mirror = SftpMirror(sftp_mirror_dir)
+      try:
+        local_path, _ = mirror.fetch(None, f"{SFTP_HOSTNAME}:{SFTP_PORT}",
+                                     sftp_file_path, attrs, download)
+        df = read(local_path)
+      finally:
+        mirror.close()
+    elif sftp_file_path:
+      logger.info(f'Reading file from SFTP: {sftp_file_path}')
+      with _open_sftp(sftp_password) as sftp_client, \
+          sftp_reader.open_prefetching(sftp_client, sftp_file_path) as f:
+        df = read(f)
+    else:
+      logger.info(f'Reading file from local file system: {input_file_path}')
+      df = read(input_file_path)
+    timer.rows_out = len(df)
+
+  with profiling.stage("frame_store_put", rows_in=len(df)):
+    frame = frame_store.put(df)
+  return frame
 
 
 @task
-def extract_nodes(df: DataFrame) -> List[ExternalAppointmentStruct]:
+def reset_profiling():
+  """
+  Resets the profiler of the process, so that the performance report of the
+  run only has the stages of this run. The flows run it before their other
+  tasks.
+  """
+  profiling.reset()
+
+
+@task(tags=[IO_BOUND])
+def delete_frame(frame: FrameHandle):
+  """
+  Deletes the stored frame once the run succeeded, and sweeps the old frames
+  that other runs left behind. When the run fails, the frame is kept for
+  ParquetResult to read back if the run is restarted, until a sweep.
+  """
+  if isinstance(frame, FrameHandle):
+    frame.delete()
+  frame_store.sweep()
+
+
+def _suite_validator(ge_ctx_root: str,
+                     expectation_suite_name: str,
+                     validation_mode: str,
+                     sample_size: int) -> expectations.SuiteValidator:
+  suite = expectations.load_suite(ge_ctx_root, expectation_suite_name)
+  if validation_mode == expectations.VALIDATION_MODE_VECTORIZED:
+    return expectations.SuiteValidator(suite)
+  if validation_mode == expectations.VALIDATION_MODE_SAMPLED:
+    return expectations.SuiteValidator(suite, sample_size=sample_size)
+  raise ValueError(f"validation_mode must be one of "
+                   f"{expectations.VALIDATION_MODES}, not {validation_mode!r}")
+
+
+@task(tags=[CPU_BOUND])
+def validate_appointments(frame: FrameHandle,
+                          ge_ctx_root: str,
+                          expectation_suite_name: str = expectations.DEFAULT_SUITE_NAME,
+                          validation_mode: str = expectations.VALIDATION_MODE_VECTORIZED,
+                          validation_sample_size: int = expectations.DEFAULT_SAMPLE_SIZE):
+  """
+  Validates the appointments against the expectation suite, with the
+  vectorized engine of expectations.py, which only loads the columns that the
+  suite looks at, or with Great Expectations itself when validation_mode is
+  'great_expectations' - e.g. for expectations that the engine does not
+  support, or to build the data docs.
+
+  In the 'sampled' mode, the column expectations are only checked on a sample
+  of validation_sample_size rows, with confidence bounds, and the row count
+  is still exact.
+  """
+  if validation_mode == expectations.VALIDATION_MODE_GREAT_EXPECTATIONS:
+    return _validate_with_great_expectations(frame, ge_ctx_root,
+                                             expectation_suite_name)
+
+  validator = _suite_validator(ge_ctx_root, expectation_suite_name,
+                               validation_mode, validation_sample_size)
+  with profiling.stage("validation", rows_in=len(frame)) as timer:
+    # A column that is not in the frame fails its expectations, rather than
+    # the load. Parquet has no rows without columns, so the row count needs
+    # at least one.
+    columns = [c for c in validator.columns if c in frame.columns]
+    df = frame_store.load(frame, columns or list(frame.columns[:1]))
+    validator.update(df)
+    result = validator.result()
+    timer.rows_out = len(df)
+
+  if not result['success']:
+    raise signals.FAIL(result=result)
+  return result
+
+
+def _validate_with_great_expectations(frame: FrameHandle,
+                                      ge_ctx_root: str,
+                                      expectation_suite_name: str):
+  from prefect.tasks.great_expectations.checkpoints import \
+    RunGreatExpectationsValidation
+
+  df = frame_store.load(frame, [c for c in frame.columns
+                                 if c not in SOURCE_COLUMNS])
+  with profiling.stage("ge_validation", rows_in=len(df)) as timer:
+    result = RunGreatExpectationsValidation().run(
+      batch_kwargs={"dataset": df, "datasource": "appts"},
+      expectation_suite_name=expectation_suite_name,
+      context_root_dir=ge_ctx_root,
+    )
+    timer.rows_out = len(df)
+  return result
+
+
+@task(nout=2, tags=[CPU_BOUND])
+def extract_nodes(
+    frame: FrameHandle,
+    appointment_state_path: str = None
+) -> Tuple[List[ExternalAppointmentStruct], Dict]:
+  """
+  Returns the appointments of the frame, and a summary of the rows that were
+  dropped as invalid - see _drop_invalid - for aggregate_summaries.
+  """
+  log = TaskLogger("extract_nodes")
   mapping = StLukesEtlAppointmentMapping()
+  accumulator = ExternalAppointmentSummaryAccumulator()
+  df = frame_store.load(frame, columns=mapping.columns() + SOURCE_COLUMNS)
+  with profiling.stage("extract_nodes", rows_in=len(df)) as timer:
+    df, details, num_dropped = _drop_invalid(df, mapping,
+                                             _appointment_rules(mapping))
+    if num_dropped:
+      log.warning("Dropping {num_dropped} invalid appointments",
+                  num_dropped=num_dropped)
+      accumulator.counters['num_dropped_appointments'] += num_dropped
+      accumulator.add_details(details)
+    log.progress(rows=len(df) + num_dropped, details=details)
+    appointments = _appointments_from_df(df, mapping)
+    timer.rows_out = len(appointments)
+  log.flush()
+
+  # Drop the appointments that did not change since they were last posted, so
+  # that we only post the delta of the daily snapshot.
+  if appointment_state_path:
+    logger = prefect.context.get("logger")
+    appointments, num_unchanged = _drop_unchanged(appointments,
+                                                  appointment_state_path)
+    logger.info(f"Skipping {num_unchanged} unchanged appointments, "
+                f"{len(appointments)} left to post")
+
+  return appointments, accumulator.to_dict()
+
+
+def _appointment_rules(
+    mapping: StLukesEtlAppointmentMapping) -> List[schema_rules.ColumnRule]:
+  # The struct gets the gender that get_gender maps the column to, not the
+  # column itself.
+  return schema_rules.column_rules(ExternalAppointmentStructSchema, mapping,
+                                   exclude=['gender'])
+
+
+def _drop_invalid(
+    df: DataFrame,
+    mapping: StLukesEtlAppointmentMapping,
+    rules: List[schema_rules.ColumnRule]
+) -> Tuple[DataFrame, List[str], int]:
+  """
+  Drops the rows that break the rules of ExternalAppointmentStructSchema,
+  with vectorized checks on the whole frame before any struct is built.
+  Returns the rows left, an E066_EXTERNAL_APPOINTMENT_DROPPED detail for each
+  reason that rows were dropped for, and the number of rows dropped.
+  """
+  violations = schema_rules.rule_violations(df, rules, mapping.NA_VALUES)
+  if not violations:
+    return df, [], 0
+
+  details = []
+  rejected = None
+  for reason, mask in violations.items():
+    details.append(_dropped_detail(reason, df.loc[mask, SOURCE_COLUMNS]))
+    rejected = mask if rejected is None else rejected | mask
+  return df[~rejected], details, int(rejected.sum())
+
+
+def _dropped_detail(reason: str, sources: DataFrame) -> str:
+  """
+  One detail for all the rows dropped for the same reason, with the member
+  and the row in the member of the first MAX_DETAILS_SAMPLE of them - see
+  SOURCE_COLUMNS.
+  """
+  sample = sources.head(MAX_DETAILS_SAMPLE)
+  where = "; ".join(
+    f"{member or 'file'} rows {','.join(str(row) for row in rows)}"
+    for member, rows in sample.groupby(SOURCE_MEMBER_COLUMN,
+                                       sort=False)[SOURCE_ROW_COLUMN])
+  if len(sources) > MAX_DETAILS_SAMPLE:
+    where += ",..."
+  return etl_err.E066_EXTERNAL_APPOINTMENT_DROPPED.display(
+    f"{reason} in {len(sources)} rows, {where}")
+
+
+def _appointments_from_df(
+    df: DataFrame,
+    mapping: StLukesEtlAppointmentMapping
+) -> List[ExternalAppointmentStruct]:
   appointments = []
-  
   for i in df.index:
     row = df.loc[i]
 
@@ -90,50 +363,400 @@ def extract_nodes(df: DataFrame) -> List[ExternalAppointmentStruct]:
 
   return appointments
 
-@task
+
+def _drop_unchanged(
+    appointments: List[ExternalAppointmentStruct],
+    appointment_state_path: str
+) -> Tuple[List[ExternalAppointmentStruct], int]:
+  store = AppointmentStateStore(appointment_state_path)
+  appointments, num_unchanged = store.drop_unchanged(appointments,
+                                                     APPOINTMENT_COMMIT)
+  store.close()
+  return appointments, num_unchanged
+
+@task(tags=[CPU_BOUND])
+@profiling.profiled("build_graphs")
 def build_graphs(nodes: List[ExternalAppointmentStruct]) -> List[ExternalAppointmentStruct]:
-  logger = prefect.context.get("logger")
-  logger.info("building graphs")
+  log = TaskLogger("build_graphs")
+  log.info("building graphs")
   for node in nodes:
-    logger.info(f"Got appt for {node.first_name} {node.last_name}")
+    log.debug("Got appt {external_appointment_id} for {first_name} {last_name}",
+              external_appointment_id=node.external_appointment_id,
+              phi={'first_name': node.first_name, 'last_name': node.last_name})
+    log.progress(rows=1)
 
+  log.flush()
   return nodes
 
 
-@task
-def post_graph(appointment: ExternalAppointmentStruct) -> Dict:
-  logger = prefect.context.get("logger")
-  logger.info(f"Starting post_graph")
-  s = ExternalAppointmentUpdateSummaryStruct()
-  external_appointment_schema = ExternalAppointmentStructSchema()
-  external_appointment_update_schema = ExternalAppointmentUpdateSummaryStructSchema()
-
-  json_data = external_appointment_schema.dump(appointment)
-  
-  summary: ExternalAppointmentUpdateSummaryStruct
-  logger.info(f"About to post")
+APPOINTMENT_UPDATE_PATH = '/api/external_appointment/update'
+# The appointments are only validated by the SFE for now. The state store
+# keys what was posted by this flag, see appointment_state_store.py.
+APPOINTMENT_COMMIT = False
+
+
+def _post_appointment(appointment: ExternalAppointmentStruct,
+                      content_encoding: str = None) -> Tuple[Dict, Dict, List[str]]:
+  """
+  Dumps and posts a single appointment.
+
+  We don't load the summary through its schema here - aggregate_summaries
+  folds the raw update summaries into an accumulator, and only the merged
+  summary is loaded.
+
+  :return: The posted json data, the raw update summary and the errors.
+  """
+  with profiling.stage("dump", rows_in=1) as timer:
+    json_data = ExternalAppointmentStructSchema().dump(appointment)
+    timer.rows_out = 1
   summary, err = common.post_to_endpoint(1, json_data,
-                                         '/api/external_appointment/update',
-                                         external_appointment_update_schema,
-                                         commit=False)
-  logger.info(f"Finished posting")
+                                         APPOINTMENT_UPDATE_PATH,
+                                         commit=APPOINTMENT_COMMIT,
+                                         content_encoding=content_encoding)
+  return json_data, summary, err
+
+
+@task(tags=[IO_BOUND])
+def post_graph(appointment: ExternalAppointmentStruct,
+               retry_queue_path: str = None,
+               content_encoding: str = None,
+               appointment_state_path: str = None) -> Dict:
+  log = TaskLogger("post_graph")
+  log.debug("Starting post_graph")
+
+  summary: Dict
+  json_data, summary, err = _post_appointment(appointment, content_encoding)
+  log.debug("Finished posting")
   if err:
+    # Keep the payload around so that it can be retried later, instead of
+    # having to re-run the whole flow for it.
+    if retry_queue_path:
+      queue = RetryQueue(retry_queue_path)
+      queue.enqueue(1, APPOINTMENT_UPDATE_PATH, json_data,
+                    commit=APPOINTMENT_COMMIT, error=str(err),
+                    state=_queued_state(appointment))
+      queue.close()
     raise signals.FAIL(message=str(err))
 
+  if appointment_state_path:
+    store = AppointmentStateStore(appointment_state_path)
+    store.mark_posted([appointment], APPOINTMENT_COMMIT)
+    store.close()
+
+  return summary
+
+
+@task(tags=[CPU_BOUND])
+@profiling.profiled("partition_appointments")
+def partition_appointments(
+    appointments: List[ExternalAppointmentStruct],
+    batch_size: int = None
+) -> List[List[ExternalAppointmentStruct]]:
+  """
+  Splits the appointments in batches of batch_size, so that the flow maps one
+  post_batch task run over each batch, instead of one task run per appointment.
+  """
+  return list(common.batch(appointments, batch_size))
+
+
+@task(tags=[IO_BOUND])
+def post_batch(appointments: List[ExternalAppointmentStruct],
+               retry_queue_path: str = None,
+               content_encoding: str = None,
+               appointment_state_path: str = None) -> Dict:
+  """
+  Posts a batch of appointments, and returns the update summaries of the batch
+  added up.
+
+  An appointment that fails to post does not fail the batch - the error is
+  added to the details of the summary as E067_APPOINTMENT_ENDPOINT_FAILED, the
+  same error that a failed post_graph task would report, and the payload goes
+  to the retry queue.
+  """
+  log = TaskLogger("post_batch")
+  with profiling.stage("post_batch", rows_in=len(appointments)) as timer:
+    summary, num_posted = _post_appointments(appointments, log,
+                                             retry_queue_path,
+                                             content_encoding,
+                                             appointment_state_path)
+    timer.rows_out = num_posted
+  log.info("Posted batch of {num_appointments} appointments, {num_failed} failed",
+           num_appointments=len(appointments),
+           num_failed=len(appointments) - num_posted)
+  log.flush()
   return summary
 
-@task(result=PrefectResult())
-def aggregate_summaries(summaries: List[ExternalAppointmentUpdateSummaryStruct]) -> Dict:
+
+def _queued_state(appointment: ExternalAppointmentStruct) -> Optional[Tuple]:
+  """
+  The row of the appointment state store that the retry queue records once
+  the post of the appointment succeeds.
+  """
+  if not appointment.external_appointment_id:
+    return None
+  return appointment_state_store.state(appointment, APPOINTMENT_COMMIT)
+
+
+def _post_appointments(appointments: List[ExternalAppointmentStruct],
+                       log: TaskLogger,
+                       retry_queue_path: str = None,
+                       content_encoding: str = None,
+                       appointment_state_path: str = None) -> Tuple[Dict, int]:
+  """
+  Posts the appointments one at a time, see post_batch.
+
+  :return: The update summaries added up, and the number of appointments that
+  were posted successfully.
+  """
+  accumulator = ExternalAppointmentSummaryAccumulator()
+  queue = RetryQueue(retry_queue_path) if retry_queue_path else None
+  posted = []
+
+  for appointment in appointments:
+    json_data, summary, err = _post_appointment(appointment, content_encoding)
+    if err:
+      detail = etl_err.E067_APPOINTMENT_ENDPOINT_FAILED.display(
+        f"external_appointment_id={appointment.external_appointment_id} {err}")
+      accumulator.add_details([detail])
+      log.progress(rows=1, details=[detail])
+      if queue:
+        queue.enqueue(1, APPOINTMENT_UPDATE_PATH, json_data,
+                      commit=APPOINTMENT_COMMIT, error=str(err),
+                      state=_queued_state(appointment))
+      continue
+
+    accumulator.add(summary)
+    posted.append(appointment)
+    log.progress(rows=1, details=(summary or {}).get('details'))
+
+  if queue:
+    queue.close()
+
+  if appointment_state_path:
+    store = AppointmentStateStore(appointment_state_path)
+    store.mark_posted(posted, APPOINTMENT_COMMIT)
+    store.close()
+
+  return accumulator.to_dict(), len(posted)
+
+
+@task(tags=[IO_BOUND])
+def retry_failed_posts(retry_queue_path: str = None,
+                       appointment_state_path: str = None):
+  """
+  Retries the posts from previous runs that failed and whose backoff expired.
+  With an appointment_state_path, the appointments whose post succeeds are
+  recorded in it, so that they are not posted again while they do not
+  change.
+  """
+  if not retry_queue_path:
+    return
+
   logger = prefect.context.get("logger")
-  result = ExternalAppointmentUpdateSummaryStruct()
-  for summary in summaries:
-    result.num_new_appointments += summary.num_new_appointments
-    result.num_valid_appointments += summary.num_valid_appointments
-    result.num_existing_appointments += summary.num_existing_appointments
-    result.num_dropped_appointments += summary.num_dropped_appointments
-    result.details.extend(summary.details)
-  
-  return ExternalAppointmentUpdateSummaryStructSchema().dump(result)
+  queue = RetryQueue(retry_queue_path)
+  on_success = retry_queue.mark_posted(appointment_state_path) \
+    if appointment_state_path else None
+  succeeded, failed, dead = retry_queue.retry_due(queue, on_success=on_success)
+  pending, dead_letters = queue.counts()
+  queue.close()
+  logger.info(f"Retried failed posts: succeeded={succeeded} failed={failed} "
+              f"dead_lettered={dead}, pending={pending} "
+              f"dead_letter={dead_letters}")
+
 
+@task(tags=[CPU_BOUND])
+def summary_ranges(batches: List[List[ExternalAppointmentStruct]],
+                   fan_in: int = 32) -> List[Tuple[int, int]]:
+  """
+  Returns the (start, stop) of each group of fan_in batches, so that the flow
+  can map merge_summaries over the groups, and aggregate_summaries only adds
+  up one merged summary per group. Only the number of batches is used.
 
+  This is a two-level reduction, not a tree: the shape of a Prefect flow is
+  fixed before it runs, so the number of levels can not depend on the number
+  of batches. aggregate_summaries still adds up len(batches) / fan_in
+  summaries in one task, which is cheap since they are small.
+  """
+  return [(start, min(start + fan_in, len(batches)))
+          for start in range(0, len(batches), fan_in)]
+
+
+@task(tags=[CPU_BOUND])
+def merge_summaries(summary_range: Tuple[int, int],
+                    summaries: List[Dict]) -> Dict:
+  """
+  Merges summaries[start:stop] into one, that is still a summary that can be
+  merged again - see summary_accumulator.py. Only the summaries in the range
+  are read, the list itself is shared by the mapped runs.
+  """
+  start, stop = summary_range
+  accumulator = ExternalAppointmentSummaryAccumulator()
+  for i in range(start, stop):
+    accumulator.add(summaries[i])
+  return accumulator.to_dict()
+
+
+@task(result=PrefectResult(), tags=[CPU_BOUND])
+def aggregate_summaries(summaries: List[Dict],
+                        performance_report_path: str = None,
+                        extract_summary: Dict = None) -> Dict:
+  """
+  Adds up the raw update summaries of post_graph, or the per batch summaries
+  of post_batch, or the merged ones of merge_summaries, and the summary of
+  the rows that extract_nodes dropped.
+
+  Only a sample of the details is kept, along with their counts by etl_err
+  code, so the result stays small whatever the number of appointments.
+
+  The performance report of the run is attached to the result as
+  `performance`, and written to performance_report_path if one is passed -
+  see profiling.py.
+  """
+  with profiling.stage("aggregate_summaries", rows_in=len(summaries)):
+    accumulator = ExternalAppointmentSummaryAccumulator()
+    accumulator.add(extract_summary)
+    for summary in summaries:
+      accumulator.add(summary)
+
+    result = accumulator.materialize()
+    result = ExternalAppointmentUpdateSummaryStructSchema().dump(result)
+
+  return _attach_performance(result, performance_report_path)
+
+
+def _attach_performance(result: Dict, performance_report_path: str = None) -> Dict:
+  result['performance'] = profiling.report()
+  if performance_report_path:
+    profiling.write_report(performance_report_path, result['performance'],
+                           extra={'flow_run_id': prefect.context.get('flow_run_id')})
+  return result
+
+
+# ----------------------------------------------------------------------
+# Streaming
+
+def _read_appointment_chunks(input_file_path: str,
+                             sftp_password: str,
+                             sftp_file_path: str,
+                             chunksize: int,
+                             logger) -> Iterator[DataFrame]:
+  import common_io
+  mapping = StLukesEtlAppointmentMapping()
+  kwargs = dict(
+    columns=mapping.columns(),
+    chunksize=chunksize,
+    sep='|',
+    parse_dates=[
+      mapping.appointment_date,
+      mapping.date_of_birth,
+      mapping.external_created_date,
+      mapping.external_last_modified_date,
+    ],
+  )
+
+  if sftp_file_path:
+    with _open_sftp(sftp_password) as sftp_client, \
+        sftp_reader.open_prefetching(sftp_client, sftp_file_path) as f:
+      for name, member in _appointment_members(f, mapping, logger):
+        for chunk in common_io.iter_csv_chunks(member, **kwargs):
+          yield _with_source(chunk, name)
+  else:
+    for name, member in _appointment_members(input_file_path, mapping, logger):
+      for chunk in common_io.iter_csv_chunks(member, **kwargs):
+        yield _with_source(chunk, name)
+
+
+@task(result=PrefectResult(), tags=[IO_BOUND])
+def stream_appointments(input_file_path: str,
+                        sftp_password: str = None,
+                        sftp_file_path: str = None,
+                        retry_queue_path: str = None,
+                        content_encoding: str = None,
+                        appointment_state_path: str = None,
+                        chunksize: int = 1000,
+                        post_batch_size: int = 100,
+                        post_workers: int = 4,
+                        queue_size: int = streaming.DEFAULT_MAXSIZE,
+                        performance_report_path: str = None,
+                        ge_ctx_root: str = None,
+                        expectation_suite_name: str = expectations.DEFAULT_SUITE_NAME,
+                        validation_mode: str = expectations.VALIDATION_MODE_VECTORIZED,
+                        validation_sample_size: int = expectations.DEFAULT_SAMPLE_SIZE) -> Dict:
+  """
+  Reads, validates, transforms and posts the appointments in a single pass,
+  chunk by chunk, through a bounded pipeline - see streaming.py. Only a few
+  chunks are in memory at any time, whatever the size of the file.
+
+  Rows that break the rules of the schema are dropped with
+  E066_EXTERNAL_APPOINTMENT_DROPPED, the rest goes through the same transform
+  and posting as in the batch flow.
+
+  With a ge_ctx_root, the chunks are also checked against the expectation
+  suite as they go through, with the vectorized engine of expectations.py. Its
+  result is in the 'validation' of the summary, and the task fails at the end
+  when the suite does not pass. validation_mode is 'vectorized' or 'sampled',
+  see validate_appointments.
+  """
+  log = TaskLogger("stream_appointments")
+  mapping = StLukesEtlAppointmentMapping()
+  accumulator = ExternalAppointmentSummaryAccumulator()
+  lock = threading.Lock()
+  rules = _appointment_rules(mapping)
+  validator = _suite_validator(ge_ctx_root, expectation_suite_name,
+                               validation_mode, validation_sample_size) \
+    if ge_ctx_root else None
+
+  def validate(df: DataFrame) -> Iterable[DataFrame]:
+    with profiling.stage("validate", rows_in=len(df)) as timer:
+      if validator:
+        with lock:
+          validator.update(df)
+      df, details, num_dropped = _drop_invalid(df, mapping, rules)
+      if num_dropped:
+        with lock:
+          accumulator.counters['num_dropped_appointments'] += num_dropped
+          accumulator.add_details(details)
+        log.progress(details=details)
+      timer.rows_out = len(df)
+    return [df] if len(df) else []
+
+  def transform(df: DataFrame) -> Iterable[List[ExternalAppointmentStruct]]:
+    with profiling.stage("transform", rows_in=len(df)) as timer:
+      appointments = _appointments_from_df(df, mapping)
+      if appointment_state_path:
+        appointments, _ = _drop_unchanged(appointments, appointment_state_path)
+      timer.rows_out = len(appointments)
+    return common.batch(appointments, post_batch_size)
+
+  def post(appointments: List[ExternalAppointmentStruct]) -> Iterable[Dict]:
+    with profiling.stage("post_batch", rows_in=len(appointments)) as timer:
+      summary, timer.rows_out = _post_appointments(
+        appointments, log, retry_queue_path, content_encoding,
+        appointment_state_path)
+    return [summary]
+
+  summaries = streaming.pipeline(
+    _read_appointment_chunks(input_file_path, sftp_password, sftp_file_path,
+                             chunksize, log.logger),
+    [
+      Stage("validate", validate),
+      Stage("transform", transform),
+      Stage("post", post, workers=post_workers),
+    ],
+    maxsize=queue_size,
+  )
+  for summary in summaries:
+    with lock:
+      accumulator.add(summary)
 
+  log.flush()
+  result = accumulator.materialize()
+  result = ExternalAppointmentUpdateSummaryStructSchema().dump(result)
+  result = _attach_performance(result, performance_report_path)
+  if validator:
+    result['validation'] = validator.result()
+    if not result['validation']['success']:
+      raise signals.FAIL(
+        message=f"The appointments did not pass {expectation_suite_name}",
+        result=result)
+  return result
@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple, Type, TYPE_CHECKING
+
+import prefect
+from prefect import task
+
+import etl_err
+import sftp_download
+import sftp_index
+import sftp_pool
+import sftp_reader
+from sftp_index import SftpIndex
+from sftp_mirror import SftpMirror
+from common_mappings import Mapping
+from executor_profiles import IO_BOUND
+from stlukes_mappings import StLukesEtlAppointmentMapping
+import stlukes_constants
+
+if TYPE_CHECKING:
+  import paramiko
+
+
+EXCLUDED_FILES = [
+  'authorized_keys',
+  'id_rsa',
+  'id_rsa.pub',
+  'keys',
+]
+EXCLUDED_DIRECTORIES = ['.', '..', '.ssh']
+
+# The mappings that files found on the SFTP are matched against, by header.
+MAPPINGS: List[Type[Mapping]] = [
+  StLukesEtlAppointmentMapping,
+]
+
+# extract_directories lists this many directories of a host at once, and not
+# those more than MAX_WALK_DEPTH levels below the path it was given.
+WALK_CHANNELS = 4
+MAX_WALK_DEPTH = 32
+
+
+@task(nout=2)
+def extract_directories(
+        hostname,
+        port,
+        username,
+        password,
+        path,
+        index_path: str = None,
+        max_depth: int = MAX_WALK_DEPTH,
+        channels: int = WALK_CHANNELS,
+) -> Tuple[set, List[Tuple[str, str]]]:
+  """
+  Returns all the directories under path, and the (path, file) of all the
+  files under it, sorted so that the flow can map over them.
+
+  With an index_path, only the files that are new or changed since they were
+  last processed are returned - see sftp_index.py.
+
+  The directories are listed over several SFTP channels at once, see _walk.
+  """
+  logger = prefect.context.get('logger')
+
+  logger.info('Connecting to SFTP')
+  dirs, files = _walk(hostname, port, username, password, path, max_depth,
+                      channels, logger)
+
+  logger.info(f'Directories: {dirs}')
+  logger.info(f'Files: {set(files)}')
+
+  if index_path:
+    index = SftpIndex(index_path)
+    changed = index.changed(_index_host(hostname, port), {
+      os.path.join(*file): attrs for file, attrs in files.items()
+    })
+    index.close()
+    files = {file: attrs for file, attrs in files.items()
+             if os.path.join(*file) in changed}
+    logger.info(f'{len(files)} new or changed files to process')
+
+  return dirs, sorted(files)
+
+
+def _walk(hostname,
+          port,
+          username,
+          password,
+          path: str,
+          max_depth: int = MAX_WALK_DEPTH,
+          channels: int = WALK_CHANNELS,
+          logger=None) -> Tuple[set, Dict[Tuple[str, str], Tuple[int, int]]]:
+  """
+  Returns the directories under path, and the {(path, file): (size, mtime)} of
+  the files under it.
+
+  The directories are listed breadth first, as many at a time as there are
+  channels, each over an SFTP channel from sftp_pool.py. Directories more
+  than max_depth below path are not listed. A directory that resolves to one that was listed already, e.g. through a symlink to one
+  of its parents, is not listed again.
+  """
+  seen = set()
+  seen_lock = threading.Lock()
+
+  def list_directory(directory: str) -> Optional[list]:
+    with sftp_pool.sftp(hostname, port, username, password) as sftp_client:
+      real_path = sftp_client.normalize(directory)
+      with seen_lock:
+        if real_path in seen:
+          return None
+        seen.add(real_path)
+      return sftp_client.listdir_attr(directory)
+
+  dirs = set()
+  files = {}
+  too_deep = []
+  with ThreadPoolExecutor(max_workers=channels) as executor:
+    pending = {executor.submit(list_directory, path): (path, 0)}
+    while pending:
+      done, _ = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        directory, depth = pending.pop(future)
+        entries = future.result()
+        if entries is None:
+          if logger:
+            logger.info(f'Skipping {directory}, it was listed already')
+          continue
+
+        dirs.add(directory)
+        for fileattr in entries:
+          full_path = os.path.join(directory, fileattr.filename)
+          if stat.S_ISDIR(fileattr.st_mode):
+            # SftpClient does not return "." and ".." as directories, but
+            # some clients are weirder than others.
+            if fileattr.filename in EXCLUDED_DIRECTORIES:
+              continue
+            if depth >= max_depth:
+              too_deep.append(full_path)
+              continue
+            child = executor.submit(list_directory, full_path)
+            pending[child] = (full_path, depth + 1)
+          elif fileattr.filename.lower() not in EXCLUDED_FILES:
+            files[(directory, fileattr.filename)] = (fileattr.st_size,
+                                                     fileattr.st_mtime)
+
+  if too_deep and logger:
+    logger.warning(f'Not listing {len(too_deep)} directories more than '
+                   f'{max_depth} levels below {path}: {too_deep[:10]}')
+
+  return dirs, files
+
+
+def _index_host(hostname, port) -> str:
+  return f"{hostname}:{port}"
+
+
+@task(nout=3)
+def get_existing_datasets(directories: set) -> Tuple[list, dict, dict]:
+  # TODO: GET /businessentity/<sftp_username>/data/sets?internal_names=<directories>
+  # TODO: categorize directories based on datasets response
+  # The new directories are a list, so that the flow can map over them.
+  new_directories = []
+  monitoring_directories = {}
+  not_monitoring_directories = {}
+
+  return new_directories, monitoring_directories, not_monitoring_directories
+
+
+@task
+def post_dataset(directory: str, sftp_username: str):
+  # TODO: POST /businessentity/<sftp_username>/data/sets
+  # TODO: return response
+  pass
+
+
+# ----------------------------------------------------------------------
+# Processing of the files
+
+def match_mapping(header: str) -> Optional[Mapping]:
+  """
+  Returns the first of MAPPINGS that finds its columns in the header.
+  """
+  for mapping_class in MAPPINGS:
+    mapping = mapping_class()
+    if mapping.matches_header(header):
+      return mapping
+  return None
+
+
+def _process_appointments(
+    local_path: str,
+    retry_queue_path: str = None
+) -> Tuple[List[str], Dict[str, int]]:
+  from tasks.appointment_tasks import stream_appointments
+  summary = stream_appointments.run(local_path,
+                                    retry_queue_path=retry_queue_path)
+  return summary.get('details') or [], summary.get('error_counts') or {}
+
+
+# The etl_err codes of a processor that mean some of the rows of the file were
+# not posted, so that the file has to be processed again.
+POST_FAILURE_CODES = {
+  etl_err.E067_APPOINTMENT_ENDPOINT_FAILED.code,
+}
+
+
+def _post_failed(error_counts: Dict[str, int]) -> bool:
+  # The details are only a sample, the counts cover all of them.
+  return any(error_counts.get(code, 0) > 0 for code in POST_FAILURE_CODES)
+
+
+# What to do with a downloaded file, by the FILE_TYPE of its mapping. Each
+# takes the local path and the retry_queue_path, and returns the details and
+# their counts by etl_err code, as in the merged summaries.
+FILE_PROCESSORS = {
+  stlukes_constants.APPOINTMENTS_FILE: _process_appointments,
+}
+
+
+@task(tags=[IO_BOUND])
+def process_file(
+        file: Tuple[str, str],
+        hostname,
+        port,
+        username,
+        password,
+        download_dir: str = None,
+        process: bool = True,
+        index_path: str = None,
+        mirror_dir: str = None,
+        retry_queue_path: str = None,
+) -> Dict:
+  """
+  Matches one (path, file) from extract_directories to a mapping by its
+  header, downloads it and processes it.
+
+  Zip, gzip and bz2 files are matched by the headers of their members, which
+  are decompressed as they are read, without downloading the file first -
+  see common_io.iter_members. The members that the mapping of the file does
+  not recognize are skipped by the processors.
+
+  Files that no mapping recognizes are skipped with E061_UNKNOWN_FILE, as are
+  the members of an archive. Pass process=False to only match and download
+  the file.
+
+  With an index_path, the file is recorded in the index once it was
+  processed. A file whose size and mtime did not change since it was last
+  processed is skipped before it is downloaded, and one whose content did not
+  change is downloaded but not processed again. A file some of whose rows
+  failed to post is not recorded, so that the next run processes it again,
+  unless there is a retry_queue_path that the failed posts went to - see
+  retry_queue.py.
+
+  With a mirror_dir, the file is downloaded into the mirror, or served from it
+  if it did not change since it was downloaded - see sftp_mirror.py. A
+  download into the mirror that failed is resumed by the retries of the task.
+  """
+  import common_io
+  logger = prefect.context.get('logger')
+  path, file_name = file
+  remote_path = os.path.join(path, file_name)
+  result = {'path': remote_path, 'file_type': None, 'size': 0, 'details': []}
+
+  local_dir = tempfile.mkdtemp(dir=download_dir)
+  mirror = SftpMirror(mirror_dir) if mirror_dir else None
+  digest = None
+  try:
+    with sftp_pool.sftp(hostname, port, username, password) as sftp_client:
+      attrs = sftp_client.stat(remote_path)
+      entry = _processed_entry(index_path, hostname, port, remote_path) \
+        if index_path else None
+      if entry and entry[:2] == (attrs.st_size, attrs.st_mtime):
+        logger.info(f"Skipping {remote_path}, it did not change since it was "
+                    f"processed")
+        return result
+
+      # Only the start of each member is read, to find its header.
+      with sftp_reader.open_prefetching(sftp_client, remote_path,
+                                        block_size=common_io.HEADER_PEEK_SIZE,
+                                        read_ahead=1,
+                                        size=attrs.st_size) as f:
+        members = [(name, match_mapping(common_io.read_header(member)))
+                   for name, member in common_io.iter_members(f)]
+
+      mapping = next((m for _, m in members if m), None)
+      if not mapping:
+        result['details'].append(etl_err.E061_UNKNOWN_FILE.display(
+          f"No mapping for {remote_path}", action="file skipped"))
+        logger.warning(result['details'][-1])
+        if index_path:
+          _mark_processed(index_path, hostname, port, remote_path, attrs)
+        return result
+
+      for name, member_mapping in members:
+        if not member_mapping or member_mapping.FILE_TYPE != mapping.FILE_TYPE:
+          result['details'].append(etl_err.E061_UNKNOWN_FILE.display(
+            f"No {mapping.FILE_TYPE} mapping for {name} in {remote_path}",
+            action="member skipped"))
+          logger.warning(result['details'][-1])
+
+    # The download checks out channels of its own, in parallel ranges - see
+    # sftp_download.py.
+    def download(remote: str, local: str):
+      sftp_download.download(hostname, port, username, password, remote, local,
+                             attrs.st_size, attrs.st_mtime)
+
+    result['file_type'] = mapping.FILE_TYPE
+    if mirror:
+      local_path, digest = mirror.fetch(
+        None, _index_host(hostname, port), remote_path, attrs, download)
+    else:
+      local_path = os.path.join(local_dir, file_name)
+      download(remote_path, local_path)
+    result['size'] = os.path.getsize(local_path)
+
+    logger.info(f"Downloaded {remote_path} ({result['size']} bytes) as "
+                f"{mapping.FILE_TYPE}")
+
+    if index_path:
+      digest = digest or sftp_index.content_hash(local_path)
+      if entry and entry[2] == digest:
+        logger.info(f"Skipping {remote_path}, its content did not change")
+        process = False
+
+    processor = FILE_PROCESSORS.get(mapping.FILE_TYPE)
+    error_counts = {}
+    if process and processor:
+      details, error_counts = processor(local_path, retry_queue_path)
+      result['details'].extend(details)
+
+    if index_path and not retry_queue_path and _post_failed(error_counts):
+      logger.warning(f"Not marking {remote_path} as processed, some of its "
+                     f"rows failed to post")
+    elif index_path:
+      _mark_processed(index_path, hostname, port, remote_path, attrs, digest)
+  finally:
+    if mirror:
+      mirror.close()
+    shutil.rmtree(local_dir, ignore_errors=True)
+
+  return result
+
+
+def _processed_entry(index_path: str, hostname, port,
+                     remote_path: str) -> Optional[Tuple[int, int, Optional[str]]]:
+  index = SftpIndex(index_path)
+  entry = index.entries(_index_host(hostname, port), [remote_path]).get(remote_path)
+  index.close()
+  return entry
+
+
+def _mark_processed(index_path: str, hostname, port, remote_path: str,
+                    attrs: paramiko.SFTPAttributes, digest: str = None):
+  index = SftpIndex(index_path)
+  index.mark_processed(_index_host(hostname, port), remote_path,
+                       attrs.st_size, attrs.st_mtime, digest)
+  index.close()
+
+
+@task
+def summarize_files(results: List[Dict]) -> Dict:
+  logger = prefect.context.get('logger')
+  by_type: Dict[str, int] = {}
+  details = []
+  for result in results:
+    file_type = result['file_type'] or 'unknown'
+    by_type[file_type] = by_type.get(file_type, 0) + 1
+    details.extend(result['details'])
+
+  logger.info(f"Processed {len(results)} files: {by_type}, "
+              f"{len(details)} errors")
+  return {'files_by_type': by_type, 'details': details}